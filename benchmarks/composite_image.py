@@ -0,0 +1,92 @@
+"""
+Compare sending the screen and the webcam as two images with sending one composite image per turn.
+
+    python -m benchmarks.composite_image --turns 10
+    python -m benchmarks.composite_image --screen screenshot.png --cam webcam.jpg --prefill-per-1k 0.3
+
+Every turn captures nothing: it encodes the same screen and webcam images, builds the
+reaction request and sends it to the local OpenAI stand-in. Reports the prompt tokens the
+vision model would bill, the request bytes and the end-to-end latency of a turn for both
+modes. The stand-in counts image tokens from the images' sizes, and --prefill-per-1k adds
+the time a model takes to read a thousand prompt tokens.
+"""
+import time
+import asyncio
+import statistics
+from typing import Optional
+import click
+from PIL import Image
+from openai import AsyncOpenAI
+
+from narrator.api import react
+from narrator.config import ImageOptions, Speaker
+from narrator.history import ConversationHistory
+from narrator.image import composite_image, encode_image
+from narrator.policy import RequestPolicy
+from .image_encoding import synthetic_screenshot
+from .standins import OpenAIStandIn
+
+async def run_mode(composite: bool, screen: Image.Image, cam: Image.Image, options: ImageOptions, turns: int,
+                   llm: OpenAIStandIn) -> dict:
+    """
+    Run `turns` reaction requests in one mode and measure them.
+    """
+    url = await llm.start()
+    client = AsyncOpenAI(api_key="benchmark", base_url=url)
+    loop = asyncio.get_running_loop()
+    latencies = []
+    try:
+        for turn in range(turns):
+            speaker = list(Speaker)[turn % len(Speaker)]
+            start = time.perf_counter()
+            if composite:
+                screen_buffer = await loop.run_in_executor(
+                    None, lambda: encode_image(composite_image(screen, cam, options), options))
+                cam_buffer = None
+            else:
+                screen_buffer, cam_buffer = await asyncio.gather(
+                    loop.run_in_executor(None, encode_image, screen, options),
+                    loop.run_in_executor(None, encode_image, cam, options))
+            await react(speaker, cam_buffer, screen_buffer, ConversationHistory(client), list(Speaker), client,
+                        policy=RequestPolicy(hedge=False), composite=composite)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+        await llm.stop()
+    return {
+        "prompt_tokens": statistics.mean(llm.prompt_tokens),
+        "request_kb": statistics.mean(llm.request_bytes) / 1024,
+        "latency_median": statistics.median(latencies),
+        "latency_max": max(latencies),
+    }
+
+@click.command()
+@click.option("--turns", type=int, default=10, help="Number of reaction requests per mode.")
+@click.option("--screen", "screen_path", type=click.Path(exists=True, dir_okay=False), default=None, help="Use this screenshot instead of a synthetic one.")
+@click.option("--cam", "cam_path", type=click.Path(exists=True, dir_okay=False), default=None, help="Use this webcam image instead of a synthetic one.")
+@click.option("--pip-size", type=click.FloatRange(0.1, 0.5), default=0.3, help="Width of the webcam inset as a fraction of the screen width.")
+@click.option("--image-format", type=click.Choice(["JPEG", "WEBP", "PNG"], case_sensitive=False), default="JPEG", help="Codec of the images.")
+@click.option("--llm-latency", type=float, default=0.2, help="Time to first token of the chat stand-in in seconds.")
+@click.option("--prefill-per-1k", type=float, default=0.1, help="Extra latency of the chat stand-in per thousand prompt tokens in seconds.")
+def main(turns: int, screen_path: Optional[str], cam_path: Optional[str], pip_size: float, image_format: str,
+         llm_latency: float, prefill_per_1k: float):
+    """
+    Print the prompt tokens, request size and latency per turn of the two-image and the composite mode.
+    """
+    screen = Image.open(screen_path).convert("RGB") if screen_path else synthetic_screenshot()
+    cam = Image.open(cam_path).convert("RGB") if cam_path else synthetic_screenshot(1280, 720)
+    options = ImageOptions(format=image_format.upper(), pip_fraction=pip_size)
+    print(f"{'mode':<12}{'prompt tokens':>15}{'request':>12}{'latency p50':>14}{'max':>9}")
+    results = {}
+    for label, composite in (("two images", False), ("composite", True)):
+        llm = OpenAIStandIn(latency=llm_latency, prefill_per_1k=prefill_per_1k)
+        result = results[label] = asyncio.run(run_mode(composite, screen, cam, options, turns, llm))
+        print(f"{label:<12}{result['prompt_tokens']:>15.0f}{result['request_kb']:>9.0f} KB"
+              f"{result['latency_median']:>13.3f}s{result['latency_max']:>8.3f}s")
+    two, one = results["two images"], results["composite"]
+    print(f"composite saves {1 - one['prompt_tokens'] / two['prompt_tokens']:.0%} of the prompt tokens, "
+          f"{1 - one['request_kb'] / two['request_kb']:.0%} of the request bytes and "
+          f"{two['latency_median'] - one['latency_median']:.3f}s per turn")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Run the real narration pipeline end to end against local stand-ins for OpenAI, ElevenLabs, the camera and the screen.
+
+    python -m benchmarks.harness --turns 6 --llm-latency 1.5 --tts-latency 0.4 --stream-tts
+    python -m benchmarks.harness --runs 3 --json results.json --max-ttfa 4 --max-gap 1.5
+
+Captures are served from the images in --fixtures (files whose names start with "screen"
+and "cam"), or from synthetic images. Every run reports the time to first audio, the gaps
+between utterances, the CPU time and the peak RSS of the process. Exits with status 1 if
+a run exceeds one of the --max-* thresholds, so it can gate a deployment.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import resource
+import itertools
+import statistics
+from typing import List, Optional
+import click
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from PIL import Image
+from pygame import mixer
+from openai import AsyncOpenAI
+
+import narrator.pipeline
+from narrator.audio import TTSClient, PCM_SAMPLE_RATE
+from narrator.cadence import CadenceController
+from narrator.config import ImageOptions, Speaker
+from narrator.history import ConversationHistory
+from narrator.image import encode_image
+from narrator.metrics import Tracer, set_tracer, span
+from narrator.pipeline import NarrationPipeline
+from narrator.playback import PlaybackEngine
+from narrator.policy import RequestPolicy
+from narrator.scene import SceneChangeDetector
+from .image_encoding import synthetic_screenshot
+from .standins import ElevenLabsStandIn, OpenAIStandIn
+
+class FixtureCaptures:
+    """
+    Serves screen and webcam captures from fixture images instead of the display and the camera.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        screens, cams = [], []
+        if directory:
+            for name in sorted(os.listdir(directory)):
+                if name.startswith("screen"):
+                    screens.append(Image.open(os.path.join(directory, name)).convert("RGB"))
+                elif name.startswith("cam"):
+                    cams.append(Image.open(os.path.join(directory, name)).convert("RGB"))
+        self._screens = itertools.cycle(screens or [synthetic_screenshot()])
+        self._cams = itertools.cycle(cams or [synthetic_screenshot(1280, 720)])
+
+    def grab_screen(self) -> Image.Image:
+        return next(self._screens)
+
+    def grab_cam(self, camera=None) -> Image.Image:
+        return next(self._cams)
+
+    async def capture_screen(self, options: ImageOptions):
+        with span("screen_capture"):
+            return await asyncio.get_running_loop().run_in_executor(None, encode_image, self.grab_screen(), options)
+
+    async def capture_cam(self, camera, options: ImageOptions):
+        with span("cam_capture"):
+            return await asyncio.get_running_loop().run_in_executor(None, encode_image, self.grab_cam(), options)
+
+    def install(self):
+        """
+        Replace the capture functions used by the pipeline with the fixture-backed ones.
+        """
+        narrator.pipeline.grab_screen = self.grab_screen
+        narrator.pipeline.grab_cam = self.grab_cam
+        narrator.pipeline.capture_screen = self.capture_screen
+        narrator.pipeline.capture_cam = self.capture_cam
+
+def peak_rss_mb() -> float:
+    """
+    Get the peak resident set size of this process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+async def run_once(turns: int, llm: OpenAIStandIn, tts: ElevenLabsStandIn, stream_tts: bool,
+                   stream_reactions: bool, speculative: bool, lookahead: int, crossfade_ms: int = 0,
+                   composite: bool = False, cadence: Optional[CadenceController] = None) -> dict:
+    """
+    Run the pipeline until `turns` utterances have been played and measure the run.
+    """
+    llm_url, tts_url = await llm.start(), await tts.start()
+    client = AsyncOpenAI(api_key="benchmark", base_url=llm_url)
+    starts: List[float] = []
+    ends: List[float] = []
+    finished = asyncio.Event()
+    playback = PlaybackEngine(crossfade_ms)
+
+    def on_playback(speaker: Speaker, text: str, started: bool):
+        (starts if started else ends).append(time.perf_counter())
+        if len(ends) >= turns:
+            finished.set()
+
+    try:
+        async with TTSClient("benchmark", tts_url) as tts_client:
+            pipeline = NarrationPipeline(
+                client, tts_client, None, ConversationHistory(client), list(Speaker), "eleven_multilingual_v2",
+                stream_tts=stream_tts, stream_reactions=stream_reactions, speculative=speculative,
+                lookahead=lookahead, request_policy=RequestPolicy(hedge=False), on_playback=on_playback,
+                playback=playback, image_options=ImageOptions(composite=composite), cadence=cadence,
+                scene_detector=SceneChangeDetector(None) if cadence else None,
+            )
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            run = asyncio.create_task(pipeline.run())
+            await asyncio.wait([run, asyncio.create_task(finished.wait())], return_when=asyncio.FIRST_COMPLETED)
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            run.cancel()
+            await asyncio.gather(run, return_exceptions=True)
+    finally:
+        playback.stop()
+        await client.close()
+        await llm.stop()
+        await tts.stop()
+
+    gaps = [start - end for start, end in zip(starts[1:], ends)]
+    return {
+        "ttfa": starts[0] - wall_start if starts else None,
+        "gap_mean": statistics.mean(gaps) if gaps else None,
+        "gap_max": max(gaps) if gaps else None,
+        "utterances": len(ends),
+        "wall": wall,
+        "cpu": cpu,
+        "cpu_percent": 100 * cpu / wall if wall else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "prompt_tokens": sum(llm.prompt_tokens),
+        "tts_chars": cadence.tts_chars_used if cadence else None,
+    }
+
+def format_seconds(value: Optional[float]) -> str:
+    return "    n/a" if value is None else f"{value:6.2f}s"
+
+@click.command()
+@click.option("--turns", type=int, default=6, help="Number of utterances to play per run.")
+@click.option("--runs", type=int, default=1, help="Number of runs.")
+@click.option("--fixtures", type=click.Path(exists=True, file_okay=False), default=None, help="Directory of screen* and cam* fixture images.")
+@click.option("--llm-latency", type=float, default=1.0, help="Time to first token of the chat stand-in in seconds.")
+@click.option("--llm-jitter", type=float, default=0.5, help="Maximum random extra latency of the chat stand-in in seconds.")
+@click.option("--token-interval", type=float, default=0.02, help="Time between streamed tokens of the chat stand-in in seconds.")
+@click.option("--tts-latency", type=float, default=0.3, help="Latency of the ElevenLabs stand-in in seconds.")
+@click.option("--tts-jitter", type=float, default=0.1, help="Maximum random extra latency of the ElevenLabs stand-in in seconds.")
+@click.option("--speech-rate", type=float, default=0.01, help="Seconds of synthesized audio per character of text.")
+@click.option("--stream-tts", is_flag=True, help="Stream TTS audio into playback.")
+@click.option("--stream-reactions", is_flag=True, help="Stream reactions and synthesize every sentence as soon as it is complete.")
+@click.option("--speculative", is_flag=True, help="Prepare the next turn while the current reaction is generated.")
+@click.option("--lookahead", type=click.IntRange(1, 5), default=1, help="Number of utterances prepared ahead of playback.")
+@click.option("--crossfade-ms", type=click.IntRange(0, 500), default=0, help="Crossfade consecutive utterances by this many milliseconds.")
+@click.option("--composite-image", is_flag=True, help="Send the screen with the webcam inset as one image per turn.")
+@click.option("--adaptive-cadence", is_flag=True, help="Pace the turns with the cadence controller.")
+@click.option("--prompt-tokens-per-minute", type=int, default=None, help="Prompt token budget per minute of the cadence controller. Implies --adaptive-cadence.")
+@click.option("--tts-chars-per-minute", type=int, default=None, help="TTS character budget per minute of the cadence controller. Implies --adaptive-cadence.")
+@click.option("--metrics", is_flag=True, help="Print the latency percentiles of every pipeline stage.")
+@click.option("--json", "json_path", type=click.Path(dir_okay=False), default=None, help="Write the results to this JSON file.")
+@click.option("--max-ttfa", type=float, default=None, help="Fail if the time to first audio exceeds this many seconds.")
+@click.option("--max-gap", type=float, default=None, help="Fail if the mean gap between utterances exceeds this many seconds.")
+@click.option("--max-rss", type=float, default=None, help="Fail if the peak RSS exceeds this many MB.")
+def main(turns: int, runs: int, fixtures: Optional[str], llm_latency: float, llm_jitter: float, token_interval: float,
+         tts_latency: float, tts_jitter: float, speech_rate: float, stream_tts: bool, stream_reactions: bool,
+         speculative: bool, lookahead: int, crossfade_ms: int, composite_image: bool,
+         adaptive_cadence: bool, prompt_tokens_per_minute: Optional[int], tts_chars_per_minute: Optional[int], metrics: bool, json_path: Optional[str], max_ttfa: Optional[float],
+         max_gap: Optional[float], max_rss: Optional[float]):
+    """
+    Measure the end-to-end latency and resource use of the narration pipeline.
+    """
+    FixtureCaptures(fixtures).install()
+    mixer.init(frequency=PCM_SAMPLE_RATE, size=-16, channels=1)
+    tracer = Tracer() if metrics else None
+    if tracer:
+        set_tracer(tracer)
+    results = []
+    for run in range(runs):
+        llm = OpenAIStandIn(latency=llm_latency, jitter=llm_jitter, token_interval=token_interval)
+        tts = ElevenLabsStandIn(latency=tts_latency, jitter=tts_jitter, seconds_per_char=speech_rate)
+        cadence = None
+        if adaptive_cadence or prompt_tokens_per_minute or tts_chars_per_minute:
+            cadence = CadenceController(prompt_tokens_per_minute, tts_chars_per_minute)
+        result = asyncio.run(run_once(turns, llm, tts, stream_tts, stream_reactions, speculative, lookahead,
+                                          crossfade_ms, composite_image, cadence))
+        results.append(result)
+        print(f"run {run + 1}: first audio {format_seconds(result['ttfa'])}, "
+              f"gap mean {format_seconds(result['gap_mean'])} max {format_seconds(result['gap_max'])}, "
+              f"cpu {result['cpu']:.2f}s ({result['cpu_percent']:.0f}%), peak rss {result['peak_rss_mb']:.0f} MB, "
+              f"{result['prompt_tokens'] / result['wall'] * 60:.0f} prompt tokens/min")
+        if cadence:
+            print(cadence.summary(result["wall"]))
+
+    if tracer:
+        print(tracer.summary())
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({
+                "options": {"turns": turns, "llm_latency": llm_latency, "llm_jitter": llm_jitter,
+                            "tts_latency": tts_latency, "tts_jitter": tts_jitter, "speech_rate": speech_rate,
+                            "stream_tts": stream_tts, "stream_reactions": stream_reactions,
+                            "speculative": speculative, "lookahead": lookahead, "crossfade_ms": crossfade_ms,
+                            "composite_image": composite_image, "adaptive_cadence": adaptive_cadence,
+                            "prompt_tokens_per_minute": prompt_tokens_per_minute,
+                            "tts_chars_per_minute": tts_chars_per_minute},
+                "runs": results,
+            }, f, indent=2)
+
+    failures = []
+    for result in results:
+        if max_ttfa is not None and (result["ttfa"] is None or result["ttfa"] > max_ttfa):
+            failures.append(f"time to first audio {format_seconds(result['ttfa']).strip()} > {max_ttfa}s")
+        if max_gap is not None and result["gap_mean"] is not None and result["gap_mean"] > max_gap:
+            failures.append(f"mean gap {result['gap_mean']:.2f}s > {max_gap}s")
+        if max_rss is not None and result["peak_rss_mb"] > max_rss:
+            failures.append(f"peak rss {result['peak_rss_mb']:.0f} MB > {max_rss} MB")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
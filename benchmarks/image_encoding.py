@@ -0,0 +1,75 @@
+"""
+Benchmark encode time, payload size and estimated image tokens of the vision preprocessing settings.
+
+Uses a synthetic 5K screenshot unless a real one is passed with --image:
+
+    python -m benchmarks.image_encoding --image screenshot.png
+"""
+import io
+import time
+import base64
+import statistics
+from typing import Optional
+import click
+from PIL import Image, ImageDraw
+
+from narrator.config import ImageOptions
+from narrator.image import encode_image, vision_tokens
+
+SETTINGS = [
+    ("PNG (baseline)", None),
+    ("PNG", ImageOptions(format="PNG")),
+    ("JPEG q90", ImageOptions(format="JPEG", quality=90)),
+    ("JPEG q80", ImageOptions(format="JPEG", quality=80)),
+    ("JPEG q60", ImageOptions(format="JPEG", quality=60)),
+    ("WEBP q80", ImageOptions(format="WEBP", quality=80)),
+    ("WEBP q60", ImageOptions(format="WEBP", quality=60)),
+    ("JPEG q80 1024px", ImageOptions(format="JPEG", quality=80, max_dimension=1024)),
+    ("JPEG q80 768px", ImageOptions(format="JPEG", quality=80, max_dimension=768)),
+]
+
+def synthetic_screenshot(width: int = 5120, height: int = 2880) -> Image.Image:
+    """
+    Draw an editor-like screenshot: a dark background with lines of monospaced text.
+    """
+    img = Image.new("RGB", (width, height), (30, 30, 36))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, width // 6, height), fill=(45, 45, 52))
+    line = "async def capture_screen(options: ImageOptions) -> io.BytesIO:  # narrate the abyss"
+    for row, y in enumerate(range(40, height, 36)):
+        indent = (row % 5) * 48
+        draw.text((width // 6 + 40 + indent, y), line[:40 + row % 45], fill=(200, 200 - row % 80, 160 + row % 90))
+    return img
+
+def _encode_baseline(img: Image.Image) -> io.BytesIO:
+    buffer = io.BytesIO()
+    img.convert("RGB").save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+@click.command()
+@click.option("--image", "image_path", type=click.Path(exists=True, dir_okay=False), default=None, help="Use this screenshot instead of a synthetic one.")
+@click.option("--repeat", type=int, default=5, help="Number of encodes per setting.")
+def main(image_path: Optional[str], repeat: int):
+    """
+    Print encode time, encoded size, base64 payload size and estimated image tokens per setting.
+    """
+    img = Image.open(image_path) if image_path else synthetic_screenshot()
+    img.load()
+    print(f"Source image: {img.width}x{img.height} {img.mode}")
+    print(f"{'setting':<18}{'encode ms':>11}{'size':>10}{'payload':>10}{'output':>12}{'tokens':>8}")
+    for label, options in SETTINGS:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            buffer = _encode_baseline(img) if options is None else encode_image(img, options)
+            timings.append(time.perf_counter() - start)
+        data = buffer.getvalue()
+        payload = len(base64.b64encode(data))
+        with Image.open(buffer) as encoded:
+            width, height = encoded.size
+        print(f"{label:<18}{statistics.median(timings) * 1000:>11.1f}{len(data) / 1024:>9.0f}K{payload / 1024:>9.0f}K"
+              f"{f'{width}x{height}':>12}{vision_tokens(width, height):>8}")
+
+if __name__ == "__main__":
+    main()
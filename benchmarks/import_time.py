@@ -0,0 +1,87 @@
+"""
+Measure how long Narrator takes to start, in fresh interpreters.
+
+    python -m benchmarks.import_time --runs 5
+    python -m benchmarks.import_time --max-seconds 1.0
+
+Every target is run in a new Python process with `-X importtime`. The median wall time of
+the runs is reported together with the packages that took longest to import in the last run.
+Exits with status 1 if a median exceeds --max-seconds, so a heavy top-level import can
+fail CI before it reaches a release.
+"""
+import os
+import sys
+import time
+import statistics
+import subprocess
+from typing import List, Optional, Tuple
+import click
+
+TARGETS = [
+    ("import narrator.main", "import narrator.main"),
+    ("narrator --help", "import sys; from narrator.main import main; sys.argv = ['narrator', '--help']; main()"),
+    ("narrator batch --help", "import sys; from narrator.main import main; sys.argv = ['narrator', 'batch', '--help']; main()"),
+]
+
+def run_target(code: str) -> Tuple[float, str]:
+    """
+    Run Python code in a fresh interpreter with import timing.
+
+    Returns:
+        Tuple[float, str]: The wall time in seconds and the `-X importtime` report.
+    """
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise click.ClickException(f"{code!r} failed:\n{result.stderr[-2000:]}")
+    return elapsed, result.stderr
+
+def slowest_packages(report: str, top: int) -> List[Tuple[str, float]]:
+    """
+    Get the packages with the highest cumulative import time from an `-X importtime` report.
+
+    A package's time includes the packages it imports, so the list shows both the heavy
+    dependencies and the modules that pull them in.
+    """
+    packages = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if not cumulative.strip().isdigit() or "." in name or name in ("site", "encodings"):
+            continue
+        packages.append((name, int(cumulative) / 1e6))
+    return sorted(packages, key=lambda item: item[1], reverse=True)[:top]
+
+@click.command()
+@click.option("--runs", type=click.IntRange(1), default=5, help="Number of fresh interpreters per target.")
+@click.option("--top", type=int, default=8, help="Number of slowest packages to list per target.")
+@click.option("--max-seconds", type=float, default=None, help="Fail if the median startup time of a target exceeds this many seconds.")
+def main(runs: int, top: int, max_seconds: Optional[float]):
+    """
+    Print the startup time of the CLI and the packages that slow it down.
+    """
+    baseline = statistics.median(run_target("pass")[0] for _ in range(runs))
+    print(f"{'interpreter':<24}{baseline:>8.3f}s")
+    failures = []
+    for label, code in TARGETS:
+        timings = []
+        for _ in range(runs):
+            elapsed, report = run_target(code)
+            timings.append(elapsed)
+        median = statistics.median(timings)
+        print(f"{label:<24}{median:>8.3f}s  (+{median - baseline:.3f}s over the interpreter)")
+        for name, seconds in slowest_packages(report, top):
+            print(f"    {name:<36}{seconds * 1000:>8.1f}ms")
+        if max_seconds is not None and median > max_seconds:
+            failures.append(f"{label} took {median:.3f}s > {max_seconds}s")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
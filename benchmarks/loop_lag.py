@@ -0,0 +1,59 @@
+"""
+Measure how long image encoding blocks the event loop when it runs inline versus in a worker thread.
+
+    python -m benchmarks.loop_lag --turns 5 --threshold 0.05
+
+Exits with status 1 if the executor variant blocks the loop longer than the threshold.
+"""
+import asyncio
+import click
+
+from narrator.config import ImageOptions
+from narrator.image import encode_image, image_to_base64, images_to_base64
+from narrator.monitor import LoopLagMonitor
+from .image_encoding import synthetic_screenshot
+
+async def _inline_turn(screen, cam, options: ImageOptions):
+    screen_buffer = encode_image(screen, options)
+    cam_buffer = encode_image(cam, options)
+    image_to_base64(cam_buffer)
+    image_to_base64(screen_buffer)
+
+async def _executor_turn(screen, cam, options: ImageOptions):
+    loop = asyncio.get_running_loop()
+    screen_buffer, cam_buffer = await asyncio.gather(
+        loop.run_in_executor(None, encode_image, screen, options),
+        loop.run_in_executor(None, encode_image, cam, options),
+    )
+    await images_to_base64(cam_buffer, screen_buffer)
+
+async def _measure(turn, turns: int, threshold: float) -> LoopLagMonitor:
+    screen = synthetic_screenshot()
+    cam = synthetic_screenshot(1280, 720)
+    options = ImageOptions()
+    monitor = LoopLagMonitor(threshold, interval=0.005)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    for _ in range(turns):
+        await turn(screen, cam, options)
+        await asyncio.sleep(0.05)
+    monitor.stop()
+    return monitor
+
+@click.command()
+@click.option("--turns", type=int, default=5, help="Number of capture turns per variant.")
+@click.option("--threshold", type=float, default=0.05, help="Maximum acceptable event loop lag in seconds.")
+def main(turns: int, threshold: float):
+    """
+    Report the maximum event loop lag while encoding screen and webcam images.
+    """
+    results = {}
+    for label, turn in (("inline", _inline_turn), ("executor", _executor_turn)):
+        monitor = asyncio.run(_measure(turn, turns, threshold))
+        results[label] = monitor
+        print(f"{label:<10}max lag {monitor.max_lag * 1000:7.1f} ms, {monitor.stalls} stalls above {threshold * 1000:.0f} ms")
+    if results["executor"].max_lag > threshold:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
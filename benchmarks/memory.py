@@ -0,0 +1,139 @@
+"""
+Measure the peak memory the media path of one narration turn allocates, with tracemalloc.
+
+    python -m benchmarks.memory --turns 5
+    python -m benchmarks.memory --screen screenshot.png --stream-tts --max-peak-mb 8
+
+Every turn runs the real code for the webcam frame, the screenshot, the base64 data URLs
+and the speech of one utterance, which is downloaded from the local ElevenLabs stand-in,
+normalized and stored in a TTS cache. The stand-in runs in a separate process, so only the
+narrator's allocations are measured. The screen and the webcam frame are synthetic and
+created once, like the buffers the display and the camera hand over. Reports the median
+peak of the memory allocated on top of what was allocated before, per stage and per turn.
+Exits with status 1 if a turn's peak exceeds --max-peak-mb.
+
+Pixel buffers that Pillow allocates itself are not visible to tracemalloc; the figures cover
+the encoded images, base64 strings, PCM audio and sample arrays.
+"""
+import asyncio
+import tempfile
+import multiprocessing
+import statistics
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+import click
+import numpy as np
+from PIL import Image
+
+from narrator.audio import StreamingPlayback, TTSClient, tts_output, tts_stream
+from narrator.cache import TTSCache
+from narrator.config import ImageOptions, Speaker
+from narrator.image import encode_image, grab_cam, image_to_base64
+from .image_encoding import synthetic_screenshot
+from .standins import ElevenLabsStandIn
+
+UTTERANCE = ("Werner Herzog: The programmer stares into the abyss of the stack trace, "
+             "and the stack trace, indifferent as the jungle, stares back without mercy. ") * 2
+
+def serve_elevenlabs(conn, speech_rate: float):
+    """
+    Run the ElevenLabs stand-in until the connection is closed, and send its URL over the connection.
+    """
+    async def serve():
+        tts = ElevenLabsStandIn(seconds_per_char=speech_rate)
+        conn.send(await tts.start())
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, conn.poll, None)
+        await tts.stop()
+    asyncio.run(serve())
+
+class StaticCamera:
+    """
+    Stands in for the CameraService with a fixed BGR frame.
+    """
+
+    def __init__(self, width: int, height: int):
+        self._frame = np.ascontiguousarray(np.asarray(synthetic_screenshot(width, height))[:, :, ::-1])
+
+    def latest_frame(self, timeout: float = 5.0) -> np.ndarray:
+        return self._frame
+
+class Stages:
+    """
+    Records the peak allocation of every stage of a turn.
+    """
+
+    def __init__(self):
+        self.peaks: Dict[str, List[int]] = {}
+        self._turn_start = 0
+        self._turn_peak = 0
+
+    def start_turn(self):
+        self._turn_start = self._turn_peak = tracemalloc.get_traced_memory()[0]
+
+    def end_turn(self):
+        self.peaks.setdefault("turn", []).append(self._turn_peak - self._turn_start)
+
+    async def measure(self, name: str, stage: Callable):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = stage()
+        if asyncio.iscoroutine(result):
+            result = await result
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peaks.setdefault(name, []).append(peak - before)
+        self._turn_peak = max(self._turn_peak, peak)
+        return result
+
+async def run(turns: int, screen: Image.Image, stream: bool, speech_rate: float) -> Stages:
+    camera = StaticCamera(1280, 720)
+    options = ImageOptions()
+    conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve_elevenlabs, args=(child_conn, speech_rate), daemon=True)
+    server.start()
+    url = conn.recv()
+    stages = Stages()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            async with TTSClient("benchmark", url, cache=TTSCache(directory)) as client:
+                tracemalloc.start()
+                for turn in range(turns):
+                    text = f"{UTTERANCE} Turn {turn}."
+                    stages.start_turn()
+                    cam = await stages.measure("cam", lambda: encode_image(grab_cam(camera), options))
+                    screen_buffer = await stages.measure("screen", lambda: encode_image(screen, options))
+                    await stages.measure("base64", lambda: (image_to_base64(cam), image_to_base64(screen_buffer)))
+                    if stream:
+                        sink = StreamingPlayback()
+                        await stages.measure("tts", lambda: tts_stream(Speaker.HERZOG, text, "model", client, sink))
+                    else:
+                        await stages.measure("tts", lambda: tts_output(Speaker.HERZOG, text, "model", client))
+                    stages.end_turn()
+                tracemalloc.stop()
+    finally:
+        conn.send(None)
+        server.join(timeout=5)
+    return stages
+
+@click.command()
+@click.option("--turns", type=int, default=5, help="Number of turns.")
+@click.option("--screen", "screen_path", type=click.Path(exists=True, dir_okay=False), default=None, help="Use this screenshot instead of a synthetic 5K one.")
+@click.option("--stream-tts", is_flag=True, help="Stream the speech into a playback sink instead of downloading it whole.")
+@click.option("--speech-rate", type=float, default=0.06, help="Seconds of synthesized audio per character of text.")
+@click.option("--max-peak-mb", type=float, default=None, help="Fail if the median peak allocation of a turn exceeds this many MB.")
+def main(turns: int, screen_path: Optional[str], stream_tts: bool, speech_rate: float, max_peak_mb: Optional[float]):
+    """
+    Print the median peak allocation per stage and per turn.
+    """
+    screen = Image.open(screen_path).convert("RGB") if screen_path else synthetic_screenshot()
+    stages = asyncio.run(run(turns, screen, stream_tts, speech_rate))
+    print(f"{'stage':<10}{'peak MB':>10}{'max MB':>10}")
+    for name, peaks in stages.peaks.items():
+        print(f"{name:<10}{statistics.median(peaks) / 2 ** 20:>10.2f}{max(peaks) / 2 ** 20:>10.2f}")
+    turn_peak = statistics.median(stages.peaks["turn"]) / 2 ** 20
+    if max_peak_mb is not None and turn_peak > max_peak_mb:
+        print(f"FAIL: peak allocation per turn {turn_peak:.2f} MB > {max_peak_mb} MB")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
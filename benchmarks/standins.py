@@ -0,0 +1,181 @@
+"""
+Local stand-ins for the remote APIs used by narrator, for benchmarks that must run without network access or API keys.
+"""
+import json
+import time
+import asyncio
+import random
+from aiohttp import web
+
+from narrator.api import estimate_prompt_tokens
+
+WORDS = ("the", "abyss", "of", "code", "stares", "back", "at", "a", "programmer", "who", "types",
+         "without", "mercy", "into", "screen", "ideology", "nature", "chaos", "and", "culture")
+
+class ElevenLabsStandIn:
+    """
+    A local aiohttp server that mimics the ElevenLabs text-to-speech endpoints.
+
+    Every request waits for `latency` seconds (plus up to `jitter` seconds) and then answers
+    with silent 16-bit mono PCM whose length is proportional to the requested text.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, sample_rate: int = 22050,
+                 seconds_per_char: float = 0.06):
+        self.latency = latency
+        self.jitter = jitter
+        self.sample_rate = sample_rate
+        self.seconds_per_char = seconds_per_char
+        self.requests = 0
+        self.connections = set()
+        self._runner = None
+
+    def _pcm_for(self, text: str) -> bytes:
+        return bytes(int(len(text) * self.seconds_per_char * self.sample_rate) * 2)
+
+    async def _delay(self):
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+    async def _handle_tts(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+        payload = await request.json()
+        await self._delay()
+        return web.Response(body=self._pcm_for(payload["text"]), content_type="application/octet-stream")
+
+    async def _handle_tts_stream(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+        payload = await request.json()
+        await self._delay()
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        pcm = self._pcm_for(payload["text"])
+        chunk_size = self.sample_rate // 5 * 2
+        try:
+            await response.prepare(request)
+            for offset in range(0, len(pcm), chunk_size):
+                await response.write(pcm[offset:offset + chunk_size])
+                await asyncio.sleep(0.01)
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client cancelled the download, e.g. because the pipeline was stopped.
+            pass
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/text-to-speech/{voice_id}", self._handle_tts)
+        app.router.add_post("/v1/text-to-speech/{voice_id}/stream", self._handle_tts_stream)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start the server and return its base URL.
+        """
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_host, bound_port = self._runner.addresses[0][:2]
+        return f"http://{bound_host}:{bound_port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+class OpenAIStandIn:
+    """
+    A local aiohttp server that mimics the OpenAI chat completions endpoint, with and without streaming.
+
+    Every request waits for `latency` seconds (plus up to `jitter` seconds) before the first
+    token. The reply consists of `sentences` sentences of `words_per_sentence` words; a streamed
+    reply sends one word per chunk every `token_interval` seconds.
+
+    Prompt tokens are counted like the vision models count them: images by their size and
+    detail level, text at about four characters per token. `prefill_per_1k` adds that many
+    seconds of latency per thousand prompt tokens, to model the time the model spends reading
+    the prompt. The prompt tokens and body sizes of all requests are recorded.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, sentences: int = 2,
+                 words_per_sentence: int = 12, token_interval: float = 0.02, prefill_per_1k: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.sentences = sentences
+        self.words_per_sentence = words_per_sentence
+        self.token_interval = token_interval
+        self.prefill_per_1k = prefill_per_1k
+        self.requests = 0
+        self.prompt_tokens = []
+        self.request_bytes = []
+        self._runner = None
+
+    def _reply_words(self):
+        words = []
+        for _ in range(self.sentences):
+            sentence = random.choices(WORDS, k=self.words_per_sentence)
+            sentence[0] = sentence[0].capitalize()
+            sentence[-1] += random.choice(".?!")
+            words.extend(sentence)
+        return words
+
+    def _usage(self, prompt_tokens: int, completion_tokens: int) -> dict:
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    async def _handle_chat(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.read()
+        payload = json.loads(body)
+        prompt_tokens = estimate_prompt_tokens(payload["messages"])
+        self.prompt_tokens.append(prompt_tokens)
+        self.request_bytes.append(len(body))
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter) + self.prefill_per_1k * prompt_tokens / 1000)
+        words = self._reply_words()
+        completion = {"id": f"chatcmpl-{self.requests}", "created": int(time.time()), "model": payload["model"]}
+        if not payload.get("stream"):
+            return web.json_response({
+                **completion,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": self._usage(prompt_tokens, len(words)),
+            })
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        try:
+            await response.prepare(request)
+            for index, word in enumerate(words):
+                chunk = {**completion, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "finish_reason": None,
+                                      "delta": {"content": word if index == 0 else f" {word}"}}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await asyncio.sleep(self.token_interval)
+            last = {**completion, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]}
+            await response.write(f"data: {json.dumps(last)}\n\ndata: [DONE]\n\n".encode())
+            await response.write_eof()
+        except ConnectionResetError:
+            pass
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self._handle_chat)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start the server and return its base URL, including the /v1 prefix expected by AsyncOpenAI.
+        """
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_host, bound_port = self._runner.addresses[0][:2]
+        return f"http://{bound_host}:{bound_port}/v1"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,96 @@
+"""
+Load-test the subtitle IPC without a display, through the SRT subtitle backend.
+
+    python -m benchmarks.subtitle_ipc --turns 200
+    python -m benchmarks.subtitle_ipc --turns 5000 --turn-interval 0
+
+Every turn sends the commands a narration turn sends: clear, the red capture notice, clear,
+and the new subtitle. Reports the messages and bytes sent compared to pickling the full
+style with every command, the number of subtitles the subtitle process actually drew, and
+the CPU time the subtitle process used while idle and under load. The commands of a turn
+arrive within the coalescing window, so each turn should draw exactly one subtitle; with
+--turn-interval 0 whole runs of turns collapse into a few updates.
+"""
+import os
+import time
+import pickle
+import resource
+import tempfile
+import click
+
+from narrator.pipeline import CAPTURE_NOTICE
+from narrator.subtitle_ipc import SrtSubtitles
+
+STYLE = dict(text_color="white", font_size=30, font="Helvetica", shadow_color="black", shadow_offset=(5.0, -5.0),
+             shadow_blur_radius=3, shadow_alpha=1.0, font_alpha=1.0)
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def naive_bytes(command: dict) -> int:
+    """
+    The size of a command when every command carries its full style, as the overlay used to send them.
+    """
+    return len(pickle.dumps(command))
+
+def count_cues(path: str) -> int:
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for line in f if " --> " in line)
+
+def run(turns: int, idle: float, turn_interval: float) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "subtitles.srt")
+        cpu_start = children_cpu()
+        backend = SrtSubtitles(path=path)
+        time.sleep(idle)
+        backend.dispose()
+        idle_cpu = children_cpu() - cpu_start
+
+        cpu_start = children_cpu()
+        backend = SrtSubtitles(path=path)
+        naive = 0
+        start = time.perf_counter()
+        for turn in range(turns):
+            text = f"Werner Herzog: Turn {turn} stares back into the abyss of the code."
+            backend.clearSubtitle()
+            backend.setSubtitle(CAPTURE_NOTICE, **{**STYLE, "text_color": "red"})
+            backend.clearSubtitle()
+            backend.setSubtitle(text, **STYLE)
+            naive += (naive_bytes({"action": "clear"}) * 2
+                      + naive_bytes({"action": "set", "text": CAPTURE_NOTICE, **STYLE, "text_color": "red"})
+                      + naive_bytes({"action": "set", "text": text, **STYLE}))
+            if turn_interval:
+                time.sleep(turn_interval)
+        send_time = time.perf_counter() - start
+        channel = backend.channel
+        backend.dispose()
+        return {
+            "idle_cpu": idle_cpu,
+            "load_cpu": children_cpu() - cpu_start,
+            "commands": turns * 4,
+            "messages": channel.messages_sent,
+            "bytes": channel.bytes_sent,
+            "naive_bytes": naive,
+            "drawn": count_cues(path),
+            "send_time": send_time,
+        }
+
+@click.command()
+@click.option("--turns", type=int, default=200, help="Number of narration turns to send.")
+@click.option("--idle", type=float, default=2.0, help="Seconds the subtitle process is left idle before the load test.")
+@click.option("--turn-interval", type=float, default=0.05, help="Seconds between turns; 0 sends all turns in one burst.")
+def main(turns: int, idle: float, turn_interval: float):
+    """
+    Print the IPC volume and the CPU time of the subtitle process.
+    """
+    result = run(turns, idle, turn_interval)
+    print(f"idle:     subtitle process used {result['idle_cpu']:.3f}s CPU in {idle:.1f}s")
+    print(f"commands: {result['commands']} sent as {result['messages']} messages, "
+          f"{result['bytes'] / 1024:.0f} KB (full style per command: {result['naive_bytes'] / 1024:.0f} KB)")
+    print(f"drawn:    {result['drawn']} subtitles for {turns} turns, "
+          f"{result['commands'] / result['send_time']:.0f} commands/s sent")
+    print(f"load:     subtitle process used {result['load_cpu']:.3f}s CPU")
+
+if __name__ == "__main__":
+    main()
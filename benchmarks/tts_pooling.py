@@ -0,0 +1,66 @@
+"""
+Benchmark per-request ElevenLabs latency with a pooled TTSClient versus a fresh session per request.
+
+Runs against a local stand-in server, so no API key or network access is needed:
+
+    python -m benchmarks.tts_pooling --requests 50
+"""
+import asyncio
+import statistics
+import time
+from typing import List
+import click
+
+from narrator.audio import TTSClient, tts_output
+from narrator.config import Speaker
+from .standins import ElevenLabsStandIn
+
+TEXT = "The programmer stares into the abyss of his terminal, and the terminal stares back."
+
+async def _measure(base_url: str, requests: int, pooled: bool) -> List[float]:
+    latencies = []
+    client = TTSClient("benchmark", base_url=base_url)
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            samples = await tts_output(Speaker.HERZOG, TEXT, "eleven_turbo_v2", client)
+            latencies.append(time.perf_counter() - start)
+            if samples is None:
+                raise click.ClickException("The stand-in server returned an error.")
+            if not pooled:
+                await client.close()
+    finally:
+        await client.close()
+    return latencies
+
+def _report(label: str, latencies: List[float], connections: int):
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    p95 = latencies_ms[int(0.95 * (len(latencies_ms) - 1))]
+    print(f"{label:<10} mean {statistics.mean(latencies_ms):7.2f} ms  p50 {statistics.median(latencies_ms):7.2f} ms  "
+          f"p95 {p95:7.2f} ms  connections {connections}")
+
+async def _run(requests: int, latency: float, host: str):
+    server = ElevenLabsStandIn(latency=latency)
+    base_url = await server.start(host=host)
+    try:
+        # Warm up the stand-in server so neither variant pays for its first request.
+        await _measure(base_url, 1, pooled=True)
+        for label, pooled in (("fresh", False), ("pooled", True)):
+            server.connections.clear()
+            latencies = await _measure(base_url, requests, pooled)
+            _report(label, latencies, len(server.connections))
+    finally:
+        await server.stop()
+
+@click.command()
+@click.option("--requests", type=int, default=50, help="Number of sequential TTS requests per variant.")
+@click.option("--latency", type=float, default=0.0, help="Simulated server processing time per request in seconds.")
+@click.option("--host", default="127.0.0.1", help="Address the stand-in server binds to. Use 'localhost' to include DNS resolution.")
+def main(requests: int, latency: float, host: str):
+    """
+    Compare pooled and unpooled TTS request latency against a local stand-in server.
+    """
+    asyncio.run(_run(requests, latency, host))
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
 import re
 import io
-from openai import AsyncOpenAI
-from typing import List
-from .config import SPEAKER_TO_STYLE_ATTRIBUTES, SPEAKER_TO_FIRST_NAME, Speaker
-from .image import image_to_base64
-from typing import Tuple
+import base64
+import asyncio
+from PIL import Image
+from typing import TYPE_CHECKING, AsyncIterator, Callable, List, Optional, Tuple, Union
+from .config import SPEAKER_TO_STYLE_ATTRIBUTES, SPEAKER_TO_FIRST_NAME, SPEAKER_TO_FALLBACK_REACTION, Speaker
+from .image import images_to_base64, vision_tokens
+from .history import ConversationHistory
+from .policy import RequestPolicy
+from .providers import GenerationProvider, as_generation_provider
+from .metrics import span
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+REFUSAL = "I'm sorry, I cannot provide that information."
+SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+(?=\S)")
+ABBREVIATIONS = {"e.g.", "i.e.", "etc.", "vs.", "cf.", "dr.", "mr.", "mrs.", "ms.", "prof.", "st."}
 
 def other_speakers(speaker: Speaker, selected_speakers: List[Speaker]) -> str:
     """
@@ -19,6 +31,35 @@ def other_speakers(speaker: Speaker, selected_speakers: List[Speaker]) -> str:
     """
     return " and ".join([s.value for s in selected_speakers if s != speaker])
 
+def estimate_prompt_tokens(messages: List[dict]) -> int:
+    """
+    Estimate the prompt tokens of chat messages the way the vision model bills them: images by their
+    size and detail level, text at about four characters per token.
+
+    The images are decoded from base64 to read their size, so this runs in a worker thread
+    when it is called from the event loop.
+
+    Args:
+        messages (List[dict]): The chat messages, with images as base64 data URLs.
+
+    Returns:
+        int: The estimated number of prompt tokens.
+    """
+    characters, tokens = 0, 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            characters += len(content)
+            continue
+        for part in content:
+            if part["type"] == "text":
+                characters += len(part["text"])
+            elif part["type"] == "image_url":
+                # Opening an image only reads its header, so this does not decode the pixels.
+                data = base64.b64decode(part["image_url"]["url"].partition(",")[2])
+                tokens += vision_tokens(*Image.open(io.BytesIO(data)).size, part["image_url"].get("detail", "high"))
+    return tokens + characters // 4
+
 def get_next_speaker(speaker: Speaker, last_message: str, selected_speakers: List[Speaker], override_next_speaker: bool) -> Speaker:
     """
     Determine the next speaker based on the last message and selected speakers.
@@ -43,28 +84,153 @@ def get_next_speaker(speaker: Speaker, last_message: str, selected_speakers: Lis
     next_idx = (selected_speakers.index(speaker) + 1) % len(selected_speakers)
     return selected_speakers[next_idx]
 
-async def react(speaker: Speaker, webcam_image_bytes_io: io.BytesIO, screenshot_bytes_io: io.BytesIO,
-                history: List[str], selected_speakers: List[Speaker], client: AsyncOpenAI) -> Tuple[str, str]:
+def image_content(intro: str, unchanged_note: str, image_base64_url: Optional[str], detail: str) -> List[dict]:
     """
-    Generate a reaction from the specified speaker based on the provided images and conversation history.
+    Build the user message parts that present one image to the vision model.
+
+    Args:
+        intro (str): The text that introduces the image.
+        unchanged_note (str): The text sent instead of the image if the image is left out.
+        image_base64_url (Optional[str]): The image as a base64 data URL, or None to leave it out.
+        detail (str): The detail level to send the image at.
+
+    Returns:
+        List[dict]: The message content parts.
+    """
+    if image_base64_url is None:
+        return [{"type": "text", "text": unchanged_note}]
+    return [
+        {
+            "type": "text",
+            "text": intro
+        },
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": image_base64_url,
+                "detail": detail
+            }
+        },
+    ]
+
+def clean_reaction(text: str) -> str:
+    """
+    Strip bracketed annotations such as a speaker name prefix from generated text.
+
+    Args:
+        text (str): The generated text.
+
+    Returns:
+        str: The cleaned text.
+    """
+    return re.sub(r"\[.*\]", "", text).strip()
+
+class SentenceSplitter:
+    """
+    Splits a stream of generated text into complete, cleaned sentences.
+
+    A sentence is only complete once the first character of the next one has arrived, so
+    a trailing period of an abbreviation or initial (e.g. "Theodor W. Adorno") is not
+    mistaken for the end of a sentence, and no sentence ends inside an unclosed bracket.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+
+    def _is_boundary(self, text: str) -> bool:
+        words = text.split()
+        last_word = words[-1] if words else ""
+        if re.fullmatch(r"[A-Z]\.", last_word) or last_word.lower() in ABBREVIATIONS:
+            return False
+        return text.rfind("[") <= text.rfind("]")
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Add generated text and return the sentences it completes.
+        """
+        self._buffer += text
+        sentences = []
+        position = 0
+        while True:
+            match = SENTENCE_END.search(self._buffer, position)
+            if not match:
+                return sentences
+            if not self._is_boundary(self._buffer[:match.end()]):
+                position = match.end()
+                continue
+            sentence = clean_reaction(self._buffer[:match.end()])
+            self._buffer = self._buffer[match.end():]
+            position = 0
+            if sentence:
+                sentences.append(sentence)
+
+    def flush(self) -> List[str]:
+        """
+        Return the remaining text as the last sentence once generation has finished.
+        """
+        sentence = clean_reaction(self._buffer)
+        self._buffer = ""
+        return [sentence] if sentence else []
+
+async def build_messages(speaker: Speaker, webcam_image_bytes_io: Optional[io.BytesIO], screenshot_bytes_io: Optional[io.BytesIO],
+                         history: ConversationHistory, selected_speakers: List[Speaker],
+                         webcam_detail: str = "high", screenshot_detail: str = "high", composite: bool = False,
+                         webcam: bool = True) -> List[dict]:
+    """
+    Build the chat messages that ask the specified speaker for a reaction.
 
     Args:
         speaker (Speaker): The current speaker.
-        webcam_image_bytes_io (io.BytesIO): The webcam image as a BytesIO object.
-        screenshot_bytes_io (io.BytesIO): The screenshot image as a BytesIO object.
-        history (List[str]): The conversation history.
+        webcam_image_bytes_io (Optional[io.BytesIO]): The webcam image as a BytesIO object, or None if it is unchanged.
+        screenshot_bytes_io (Optional[io.BytesIO]): The screenshot image as a BytesIO object, or None if it is unchanged.
+        history (ConversationHistory): The conversation history.
         selected_speakers (List[Speaker]): The list of selected speakers.
-        client (AsyncOpenAI): The OpenAI API client.
+        webcam_detail (str): The detail level to send the webcam image at.
+        screenshot_detail (str): The detail level to send the screenshot at.
+        composite (bool): Whether the screenshot is a composite with the webcam image inset, in which case
+            the webcam image is not sent separately.
+        webcam (bool): Whether the scene has a webcam at all. Without one, the prompt covers the screen alone.
 
     Returns:
-        Tuple[str, str]: A tuple containing the speaker name and the generated reaction.
+        List[dict]: The system prompt, the history and the user message with the images.
     """
-    webcam_image_base64_url = image_to_base64(webcam_image_bytes_io)
-    screenshot_base64_url = image_to_base64(screenshot_bytes_io)
+    image_buffers = [buffer for buffer in (webcam_image_bytes_io, screenshot_bytes_io) if buffer is not None]
+    image_urls = iter(await images_to_base64(*image_buffers))
+    webcam_image_base64_url = next(image_urls) if webcam_image_bytes_io is not None else None
+    screenshot_base64_url = next(image_urls) if screenshot_bytes_io is not None else None
     speaker_name = speaker.value
     style = SPEAKER_TO_STYLE_ATTRIBUTES[speaker]
+    if not webcam:
+        sources = "a screenshot of what the software engineer sees"
+        both = "the screenshot"
+        presented = "the screenshot you're presented with"
+        mentions = '"the image" or "the screenshot"'
+    elif composite:
+        sources = "a screenshot with the webcam image of the software engineer inset in its bottom-right corner"
+        both = "the screenshot and the webcam inset"
+        presented = "the image you're presented with or its inset -"
+        mentions = '"the image" or "the inset"'
+    else:
+        sources = "an image from the webcam of the software engineer and a screenshot"
+        both = "both images"
+        presented = "the two images you're presented with"
+        mentions = '"the first image" or "the second image"'
+    if webcam:
+        observations = f"""Specifically comment on what the programmer looks like in the webcam image and what the 
+developer is currently doing, holding, or doing with their hands. 
+
+Is he smoking an e-cigarette? Is he drinking? What is he wearing? 
+What is his hair style? Is he shaved? 
+Comment on these actions and details if they are present. 
+Also look for details and actions in {both}, and narrate them. 
+Only comment on these if the developer is actually doing them - not on their absence. 
+E.g., if the user is not smoking, don't comment on him not smoking."""
+    else:
+        observations = f"""Specifically comment on what the developer is currently doing on the screen. 
+Also look for details and actions in {both}, and narrate them. 
+Only comment on these if the developer is actually doing them - not on their absence."""
     other_speaker_names = other_speakers(speaker, selected_speakers)
-    history_messages = [{"role": "assistant", "content": [{"type": "text", "text": msg}]} for msg in history]
+    history_messages = history.messages()
 
     prompt_and_messages = [
         {
@@ -82,25 +248,17 @@ You drive a conversation with your co-narrators about the observed scene.
 
 You often compare observations or analyses from the scene to examples from 
 your works or the works and topics of your colleagues. You are supplied with 
-an image from the webcam of the software engineer and a screenshot to drive your narration.
+{sources} to drive your narration.
 
 {"React directly to the last comment of your co-narrator from the message history, if any, and continue their or your own line of thinking. You may address your co-narrators and express your agreement or disagreement with their statements, or add your own view on the analysis or observation." if history else ""}
 
-Specifically comment on what the programmer looks like in the webcam image and what the 
-developer is currently doing, holding, or doing with their hands. 
-
-Is he smoking an e-cigarette? Is he drinking? What is he wearing? 
-What is his hair style? Is he shaved? 
-Comment on these actions and details if they are present. 
-Also look for details and actions in both images, and narrate them. 
-Only comment on these if the developer is actually doing them - not on their absence. 
-E.g., if the user is not smoking, don't comment on him not smoking.
+{observations}
 
 You may also infer what the user is programming based on the code visible in the screenshot 
 and use that for your narration.
 
-Never mention the source - the two images you're presented with directly. 
-Describe the images, narrate what's happening, but don't mention "the first image" or "the second image" - 
+Never mention the source - {presented} directly. 
+Describe the images, narrate what's happening, but don't mention {mentions} - 
 just comment on the content of the scenes you're perceiving.
 
 Generate EXACTLY 2 sentences in the style of {speaker_name}, without any pre-text, 
@@ -133,43 +291,158 @@ Do NOT prefix your message with your speaker name."""
         *prompt_and_messages,
         {
             "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": "Here is a current image of the programmer, shot via the webcam:"
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": webcam_image_base64_url,
-                        "detail": "high"
-                    }
-                },
-                {
-                    "type": "text",
-                    "text": "Here is a current image of the screen that the programmer sees:"
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": screenshot_base64_url,
-                        "detail": "high"
-                    }
-                },
+            "content": image_content(
+                "Here is a current image of the screen that the programmer sees, with the programmer "
+                "shot via the webcam in the bottom-right corner:",
+                "The screen and the programmer have not changed since the previous image.",
+                screenshot_base64_url, screenshot_detail,
+            ) if composite and webcam else [
+                *(image_content("Here is a current image of the programmer, shot via the webcam:",
+                                "The programmer looks the same as in the previous webcam image.",
+                                webcam_image_base64_url, webcam_detail) if webcam else []),
+                *image_content("Here is a current image of the screen that the programmer sees:",
+                               "The screen that the programmer sees has not changed since the previous screenshot.",
+                               screenshot_base64_url, screenshot_detail),
             ],
         }
     ]
 
-    while True:
-        response = await client.chat.completions.create(
-            model="gpt-4-vision-preview",
-            messages=messages,
-            max_tokens=300,
-            temperature=1.0,
-        )
-        reaction = response.choices[0].message.content
-        reaction = re.sub(r"\[.*\]", "", reaction).strip()
-        if "I'm sorry, I cannot provide that information." not in reaction:
-            break
-
-    return speaker_name, reaction
\ No newline at end of file
+    return messages
+
+async def react(speaker: Speaker, webcam_image_bytes_io: Optional[io.BytesIO], screenshot_bytes_io: Optional[io.BytesIO],
+                history: ConversationHistory, selected_speakers: List[Speaker], client: Union["AsyncOpenAI", GenerationProvider],
+                webcam_detail: str = "high", screenshot_detail: str = "high",
+                policy: Optional[RequestPolicy] = None, composite: bool = False, max_tokens: int = 300,
+                on_prompt_tokens: Optional[Callable[[int], None]] = None, webcam: bool = True) -> Tuple[str, str]:
+    """
+    Generate a reaction from the specified speaker based on the provided images and conversation history.
+
+    Args:
+        speaker (Speaker): The current speaker.
+        webcam_image_bytes_io (Optional[io.BytesIO]): The webcam image as a BytesIO object, or None if it is unchanged.
+        screenshot_bytes_io (Optional[io.BytesIO]): The screenshot image as a BytesIO object, or None if it is unchanged.
+        history (ConversationHistory): The conversation history.
+        selected_speakers (List[Speaker]): The list of selected speakers.
+        client (Union[AsyncOpenAI, GenerationProvider]): The generation provider, or an OpenAI API client to use
+            with the default vision model.
+        webcam_detail (str): The detail level to send the webcam image at.
+        screenshot_detail (str): The detail level to send the screenshot at.
+        policy (Optional[RequestPolicy]): The deadline, retry and hedging policy. Defaults to RequestPolicy().
+        composite (bool): Whether the screenshot is a composite with the webcam image inset.
+        max_tokens (int): The maximum length of the reaction in tokens.
+        on_prompt_tokens (Optional[Callable[[int], None]]): Called with the prompt tokens of every request sent.
+        webcam (bool): Whether the scene has a webcam at all, as opposed to a webcam image that is unchanged.
+
+    Returns:
+        Tuple[str, str]: A tuple containing the speaker name and the generated reaction.
+    """
+    messages = await build_messages(speaker, webcam_image_bytes_io, screenshot_bytes_io, history, selected_speakers,
+                                    webcam_detail, screenshot_detail, composite, webcam)
+    speaker_name = speaker.value
+    generation = as_generation_provider(client)
+
+    async def request_reaction() -> str:
+        with span("openai_request"):
+            response = await generation.complete(messages, max_tokens, speaker=speaker)
+        # Not every OpenAI-compatible server reports the usage.
+        if response.usage:
+            prompt_tokens = response.usage.prompt_tokens
+        else:
+            prompt_tokens = await asyncio.get_running_loop().run_in_executor(None, estimate_prompt_tokens, messages)
+        print(f"({prompt_tokens} prompt tokens, about {history.token_count()} of them history)")
+        if on_prompt_tokens:
+            on_prompt_tokens(prompt_tokens)
+        return clean_reaction(response.choices[0].message.content or "")
+
+    policy = policy or RequestPolicy()
+    reaction = await policy.run(request_reaction,
+                                accept=lambda reaction: bool(reaction) and REFUSAL not in reaction,
+                                fallback=lambda: SPEAKER_TO_FALLBACK_REACTION[speaker])
+
+    return speaker_name, reaction
+
+def stream_text(chunk) -> str:
+    """
+    Get the generated text of a streamed chat completion chunk.
+    """
+    return chunk.choices[0].delta.content or "" if chunk.choices else ""
+
+async def react_stream(speaker: Speaker, webcam_image_bytes_io: Optional[io.BytesIO], screenshot_bytes_io: Optional[io.BytesIO],
+                       history: ConversationHistory, selected_speakers: List[Speaker], client: Union["AsyncOpenAI", GenerationProvider],
+                       webcam_detail: str = "high", screenshot_detail: str = "high",
+                       policy: Optional[RequestPolicy] = None, composite: bool = False, max_tokens: int = 300,
+                       on_prompt_tokens: Optional[Callable[[int], None]] = None,
+                       webcam: bool = True) -> AsyncIterator[str]:
+    """
+    Generate a reaction like `react`, but stream it and yield every sentence as soon as it is complete.
+
+    The policy covers the time until the first sentence has arrived. A refusal is detected in
+    the first sentence and retried, and a refusal later in the stream ends the reaction.
+
+    Args:
+        speaker (Speaker): The current speaker.
+        webcam_image_bytes_io (Optional[io.BytesIO]): The webcam image as a BytesIO object, or None if it is unchanged.
+        screenshot_bytes_io (Optional[io.BytesIO]): The screenshot image as a BytesIO object, or None if it is unchanged.
+        history (ConversationHistory): The conversation history.
+        selected_speakers (List[Speaker]): The list of selected speakers.
+        client (Union[AsyncOpenAI, GenerationProvider]): The generation provider, or an OpenAI API client to use
+            with the default vision model.
+        webcam_detail (str): The detail level to send the webcam image at.
+        screenshot_detail (str): The detail level to send the screenshot at.
+        policy (Optional[RequestPolicy]): The deadline, retry and hedging policy. Defaults to RequestPolicy().
+        composite (bool): Whether the screenshot is a composite with the webcam image inset.
+        max_tokens (int): The maximum length of the reaction in tokens.
+        on_prompt_tokens (Optional[Callable[[int], None]]): Called with the prompt tokens of every request sent.
+            Streamed responses carry no usage, so the prompt tokens are estimated.
+        webcam (bool): Whether the scene has a webcam at all, as opposed to a webcam image that is unchanged.
+
+    Yields:
+        str: The sentences of the reaction.
+    """
+    messages = await build_messages(speaker, webcam_image_bytes_io, screenshot_bytes_io, history, selected_speakers,
+                                    webcam_detail, screenshot_detail, composite, webcam)
+    # Streamed responses carry no usage, so the prompt tokens are estimated.
+    prompt_tokens = await asyncio.get_running_loop().run_in_executor(None, estimate_prompt_tokens, messages)
+    generation = as_generation_provider(client)
+
+    async def open_stream():
+        print(f"({prompt_tokens} prompt tokens, about {history.token_count()} of them history)")
+        if on_prompt_tokens:
+            on_prompt_tokens(prompt_tokens)
+        with span("openai_request"):
+            stream = await generation.complete(messages, max_tokens, stream=True, speaker=speaker)
+            splitter = SentenceSplitter()
+            try:
+                sentences = []
+                async for chunk in stream:
+                    sentences = splitter.feed(stream_text(chunk))
+                    if sentences:
+                        break
+                else:
+                    sentences = splitter.flush()
+                if not sentences or REFUSAL in sentences[0]:
+                    raise ValueError("The reaction was refused")
+                return stream, splitter, sentences
+            except BaseException:
+                await stream.close()
+                raise
+
+    policy = policy or RequestPolicy()
+    stream, splitter, sentences = await policy.run(
+        open_stream, fallback=lambda: (None, None, [SPEAKER_TO_FALLBACK_REACTION[speaker]]),
+        discard=lambda opened: opened[0].close())
+    try:
+        for sentence in sentences:
+            yield sentence
+        if stream is None:
+            return
+        async for chunk in stream:
+            for sentence in splitter.feed(stream_text(chunk)):
+                if REFUSAL in sentence:
+                    return
+                yield sentence
+        for sentence in splitter.flush():
+            yield sentence
+    finally:
+        if stream is not None:
+            await stream.close()
@@ -1,26 +1,36 @@
-import io
-from typing import Union
-from pydub import AudioSegment
-from mutagen.mp3 import MP3
+import asyncio
+from typing import Optional, Union
+import numpy as np
 import aiohttp
+from .cache import TTSCache, tts_cache_key
 from .config import SPEAKER_TO_VOICE_ID, Speaker
+from .metrics import span
+from .playback import Clip
+from .providers import SpeechProvider
+from .ratelimit import ProviderLimiter
 
-async def tts_output(speaker: Speaker, text: str, model_id: str, api_key: str) -> Union[io.BytesIO, None]:
+ELEVENLABS_API_URL = "https://api.elevenlabs.io"
+PCM_SAMPLE_RATE = 22050
+PCM_OUTPUT_FORMAT = f"pcm_{PCM_SAMPLE_RATE}"
+TARGET_DBFS = -20
+TTS_ATTEMPTS = 4
+# The backoff in seconds before retrying a request that failed on the network, doubled for every further retry.
+TTS_RETRY_BACKOFF = 0.5
+# The gain is applied in blocks of this many samples, so the float copy of the audio stays small.
+GAIN_BLOCK_SAMPLES = 65536
+
+def tts_payload(model_id: str, text: str) -> dict:
     """
-    Generate text-to-speech audio using the ElevenLabs API.
+    Build the JSON payload for an ElevenLabs text-to-speech request.
 
     Args:
-        speaker (Speaker): The speaker enum representing the desired voice.
-        text (str): The text to be converted to speech.
         model_id (str): The ID of the TTS model to use.
-        api_key (str): The ElevenLabs API key.
+        text (str): The text to be converted to speech.
 
     Returns:
-        io.BytesIO: The generated audio as a BytesIO object, or None if an error occurs.
+        dict: The request payload.
     """
-    voice_id = SPEAKER_TO_VOICE_ID[speaker]
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-    payload = {
+    return {
         "model_id": model_id,
         "text": text,
         "voice_settings": {
@@ -30,49 +40,364 @@ async def tts_output(speaker: Speaker, text: str, model_id: str, api_key: str) -
             "use_speaker_boost": True
         }
     }
-    headers = {"xi-api-key": api_key}
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload, headers=headers) as response:
-            if response.status == 200:
-                audio_buffer_io = io.BytesIO()
-                async for chunk in response.content.iter_chunked(1024*1000):
-                    audio_buffer_io.write(chunk)
-                audio_buffer_io.flush()
-                audio_buffer_io.seek(0)
-                normalized_audio_buffer = match_target_amplitude(audio_buffer_io, -20)
-                return normalized_audio_buffer
-            else:
+
+class TTSClient(SpeechProvider):
+    """
+    The ElevenLabs speech provider, a long-lived client that keeps one pooled keep-alive
+    connection across utterances.
+
+    The underlying aiohttp session is created lazily on first use, so the client can be
+    constructed outside of a running event loop. Call `close` (or use the client as an
+    async context manager) to release the pooled connections on shutdown.
+    If a `TTSCache` is given, utterances that were synthesized before are served from disk.
+    Requests go through a `ProviderLimiter`, which may be shared with other clients of the
+    same API key; by default the client gets its own, limited to `max_connections`.
+    """
+
+    def __init__(self, api_key: str, base_url: str = ELEVENLABS_API_URL, max_connections: int = 4,
+                 dns_cache_ttl: int = 300, keepalive_timeout: float = 60.0, connect_timeout: float = 10.0,
+                 timeout: float = 60.0, cache: Optional[TTSCache] = None, limiter: Optional[ProviderLimiter] = None):
+        self.api_key = api_key
+        self.cache = cache
+        self.limiter = limiter or ProviderLimiter("ElevenLabs", max_concurrency=max_connections)
+        self.base_url = base_url.rstrip("/")
+        self._max_connections = max_connections
+        self._dns_cache_ttl = dns_cache_ttl
+        self._keepalive_timeout = keepalive_timeout
+        self._timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        The pooled aiohttp session, created on first access.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._max_connections,
+                limit_per_host=self._max_connections,
+                ttl_dns_cache=self._dns_cache_ttl,
+                keepalive_timeout=self._keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._timeout,
+                headers={"xi-api-key": self.api_key},
+            )
+        return self._session
+
+    def voice_url(self, speaker: Speaker, stream: bool = False) -> str:
+        """
+        Build the text-to-speech endpoint URL for a speaker's voice.
+        """
+        url = f"{self.base_url}/v1/text-to-speech/{SPEAKER_TO_VOICE_ID[speaker]}"
+        return f"{url}/stream" if stream else url
+
+    def cache_key(self, speaker: Speaker, payload: dict) -> str:
+        """
+        Build the cache key of an utterance from its voice, request payload and normalization target.
+        """
+        return tts_cache_key(SPEAKER_TO_VOICE_ID[speaker], payload, TARGET_DBFS, PCM_OUTPUT_FORMAT)
+
+    async def close(self):
+        """
+        Close the pooled session and its connections.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def synthesize(self, speaker: Speaker, text: str, model_id: str) -> Optional[np.ndarray]:
+        return await tts_output(speaker, text, model_id, self)
+
+    async def stream(self, speaker: Speaker, text: str, model_id: str, sink: "StreamingPlayback") -> bool:
+        return await tts_stream(speaker, text, model_id, self, sink)
+
+async def tts_output(speaker: Speaker, text: str, model_id: str, client: TTSClient) -> Union[np.ndarray, None]:
+    """
+    Generate text-to-speech audio using the ElevenLabs API.
+
+    Cached utterances are returned without a request and without normalizing them again.
+
+    Args:
+        speaker (Speaker): The speaker enum representing the desired voice.
+        text (str): The text to be converted to speech.
+        model_id (str): The ID of the TTS model to use.
+        client (TTSClient): The pooled ElevenLabs client.
+
+    Returns:
+        np.ndarray: The normalized 16-bit mono PCM samples, or None if an error occurs.
+    """
+    payload = tts_payload(model_id, text)
+    params = {"output_format": PCM_OUTPUT_FORMAT}
+    if client.cache is not None:
+        key = client.cache_key(speaker, payload)
+        pcm = await client.cache.get(key)
+        if pcm is not None:
+            return pcm_samples(pcm)
+
+    with span("tts_download"):
+        for attempt in range(TTS_ATTEMPTS):
+            try:
+                async with client.limiter.slot():
+                    async with client.session.post(client.voice_url(speaker), json=payload, params=params) as response:
+                        retry_delay = client.limiter.observe(response.status, response.headers)
+                        if response.status == 200:
+                            pcm = await response.read()
+                            break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == TTS_ATTEMPTS - 1:
+                    print(f"Error generating TTS audio: {e!r}")
+                    return None
+                await asyncio.sleep(TTS_RETRY_BACKOFF * 2 ** attempt)
+                continue
+            if retry_delay is None or attempt == TTS_ATTEMPTS - 1:
                 print(f"Error generating TTS audio: {response.status}")
                 return None
 
-def match_target_amplitude(bufferio: io.BytesIO, target_dbfs: int = -10) -> io.BytesIO:
+    with span("normalize"):
+        samples = normalize_pcm(pcm, TARGET_DBFS)
+    if client.cache is not None:
+        await client.cache.put(key, pcm_bytes(samples))
+    return samples
+
+async def tts_stream(speaker: Speaker, text: str, model_id: str, client: TTSClient, sink: "StreamingPlayback") -> bool:
+    """
+    Stream text-to-speech audio from the ElevenLabs streaming endpoint into a playback sink.
+
+    The audio is requested as raw 16-bit mono PCM, so every chunk can be handed to the sink
+    as soon as it arrives without waiting for the rest of the utterance. Cached utterances are
+    fed to the sink at once; new ones are cached after they have been streamed, with the gain the
+    sink estimated from their lead-in, so a replay sounds like the first play.
+
+    Args:
+        speaker (Speaker): The speaker enum representing the desired voice.
+        text (str): The text to be converted to speech.
+        model_id (str): The ID of the TTS model to use.
+        client (TTSClient): The pooled ElevenLabs client.
+        sink (StreamingPlayback): The playback sink that receives the audio chunks.
+
+    Returns:
+        bool: True if the whole utterance was streamed, False if an error occurred.
+    """
+    payload = tts_payload(model_id, text)
+    params = {"output_format": PCM_OUTPUT_FORMAT}
+
+    try:
+        if client.cache is not None:
+            key = client.cache_key(speaker, payload)
+            pcm = await client.cache.get(key)
+            if pcm is not None:
+                sink.feed_normalized(pcm)
+                return True
+        with span("tts_download"):
+            streamed = False
+            for attempt in range(TTS_ATTEMPTS):
+                try:
+                    async with client.limiter.slot():
+                        async with client.session.post(client.voice_url(speaker, stream=True), json=payload,
+                                                       params=params) as response:
+                            retry_delay = client.limiter.observe(response.status, response.headers)
+                            if response.status == 200:
+                                received = bytearray()
+                                async for chunk in response.content.iter_any():
+                                    streamed = True
+                                    sink.feed(chunk)
+                                    if client.cache is not None:
+                                        received.extend(chunk)
+                                break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    # Audio that already went to the sink cannot be taken back, so a broken stream is not retried.
+                    if streamed or attempt == TTS_ATTEMPTS - 1:
+                        print(f"Error streaming TTS audio: {e!r}")
+                        return False
+                    await asyncio.sleep(TTS_RETRY_BACKOFF * 2 ** attempt)
+                    continue
+                if retry_delay is None or attempt == TTS_ATTEMPTS - 1:
+                    print(f"Error streaming TTS audio: {response.status}")
+                    return False
+        if client.cache is not None:
+            with span("normalize"):
+                samples = apply_gain(pcm_samples(received), sink.final_gain())
+            await client.cache.put(key, pcm_bytes(samples))
+        return True
+    finally:
+        sink.finish()
+
+class StreamingPlayback:
+    """
+    An incremental playback sink that turns raw PCM audio into a streamed Clip while it is still arriving.
+
+    The clip is played by enqueuing `clip` on a PlaybackEngine; audio fed before that is
+    buffered in the clip until playback reaches it. The loudness of the whole clip is not known
+    while it streams, so the normalization gain is estimated from the first `lead_ms` of audio
+    and applied to the rest of the stream.
+    """
+
+    def __init__(self, lead_ms: int = 300, target_dbfs: float = TARGET_DBFS):
+        self._lead_bytes = int(PCM_SAMPLE_RATE * lead_ms / 1000) * 2
+        self._target_dbfs = target_dbfs
+        self._gain = None
+        self._pending = bytearray()
+        self.clip = Clip()
+
+    def feed(self, chunk: bytes):
+        """
+        Add a chunk of PCM audio and pass its whole samples on to the clip.
+        """
+        self._pending.extend(chunk)
+        if self._gain is None:
+            if len(self._pending) < self._lead_bytes:
+                return
+            with memoryview(self._pending) as pending:
+                self._gain = pcm_gain(pcm_samples(pending[:self._lead_bytes]), self._target_dbfs)
+        self._flush(len(self._pending) - len(self._pending) % 2)
+
+    def feed_normalized(self, pcm: bytes):
+        """
+        Add PCM audio that is already normalized, such as a cached utterance, and play it without a gain.
+        """
+        if self._gain is None:
+            self._gain = 1.0
+        if self._pending or len(pcm) % 2:
+            self.feed(pcm)
+        else:
+            self.clip.feed(pcm_samples(pcm))
+
+    def final_gain(self) -> float:
+        """
+        Get the gain applied to the stream, once the whole stream has been fed.
+
+        A stream shorter than the lead-in gets the gain of all of its audio.
+        """
+        if self._gain is None:
+            remainder = len(self._pending) - len(self._pending) % 2
+            with memoryview(self._pending) as pending:
+                self._gain = pcm_gain(pcm_samples(pending[:remainder]), self._target_dbfs)
+        return self._gain
+
+    def finish(self):
+        """
+        Mark the end of the audio stream and flush the remaining samples.
+        """
+        remainder = len(self._pending) - len(self._pending) % 2
+        self.final_gain()
+        self._flush(remainder)
+        self._pending.clear()
+        self.clip.close()
+
+    def _flush(self, size: int):
+        """
+        Apply the normalization gain to the first `size` bytes of pending audio and feed them to the clip.
+        """
+        if size:
+            # The samples are read through a view of the pending bytes; the view must be released before they are deleted.
+            with memoryview(self._pending) as pending:
+                if self._gain == 1.0:
+                    self.clip.feed(pcm_samples(pending[:size]).copy())
+                else:
+                    self.clip.feed(apply_gain(pcm_samples(pending[:size]), self._gain))
+            del self._pending[:size]
+
+    async def wait_done(self):
+        """
+        Wait until the whole stream has been played.
+        """
+        await self.clip.wait_done()
+
+def pcm_samples(pcm: Union[bytes, bytearray, memoryview]) -> np.ndarray:
+    """
+    View raw 16-bit little-endian PCM audio as an array of samples, without copying it.
+
+    Args:
+        pcm (Union[bytes, bytearray, memoryview]): The raw PCM audio. A trailing odd byte is ignored.
+
+    Returns:
+        np.ndarray: The samples as 16-bit integers.
+    """
+    return np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2)
+
+def pcm_bytes(samples: np.ndarray) -> memoryview:
+    """
+    View 16-bit PCM samples as raw bytes, without copying them.
+
+    Args:
+        samples (np.ndarray): The samples as a contiguous array of 16-bit integers.
+
+    Returns:
+        memoryview: The raw PCM audio.
+    """
+    return memoryview(samples).cast("B")
+
+def pcm_gain(samples: np.ndarray, target_dbfs: float) -> float:
+    """
+    Compute the linear gain that brings the samples to a target dBFS level.
+
+    Args:
+        samples (np.ndarray): The 16-bit PCM samples.
+        target_dbfs (float): The target dBFS level.
+
+    Returns:
+        float: The linear gain factor, or 1.0 for silent audio.
+    """
+    if not samples.size:
+        return 1.0
+    squares = 0.0
+    block = np.empty(min(len(samples), GAIN_BLOCK_SAMPLES), dtype=np.float64)
+    for start in range(0, len(samples), GAIN_BLOCK_SAMPLES):
+        part = samples[start:start + GAIN_BLOCK_SAMPLES]
+        squared = block[:len(part)]
+        np.square(part, out=squared, dtype=np.float64)
+        squares += float(squared.sum())
+    rms = np.sqrt(squares / len(samples))
+    if rms == 0:
+        return 1.0
+    dbfs = 20 * np.log10(rms / 32768)
+    return float(10 ** ((target_dbfs - dbfs) / 20))
+
+def apply_gain(samples: np.ndarray, gain: float) -> np.ndarray:
+    """
+    Apply a linear gain to 16-bit PCM samples, clipping to the valid sample range.
+
+    Args:
+        samples (np.ndarray): The 16-bit PCM samples.
+        gain (float): The linear gain factor.
+
+    Returns:
+        np.ndarray: The amplified samples as 16-bit integers, in a new array.
+    """
+    amplified = np.empty(len(samples), dtype=np.int16)
+    block = np.empty(min(len(samples), GAIN_BLOCK_SAMPLES), dtype=np.float32)
+    for start in range(0, len(samples), GAIN_BLOCK_SAMPLES):
+        part = samples[start:start + GAIN_BLOCK_SAMPLES]
+        scaled = block[:len(part)]
+        np.multiply(part, np.float32(gain), out=scaled)
+        np.clip(scaled, -32768, 32767, out=scaled)
+        amplified[start:start + len(part)] = scaled
+    return amplified
+
+def normalize_pcm(pcm: bytes, target_dbfs: float = -10) -> np.ndarray:
     """
-    Normalize the audio amplitude to a target dBFS level.
+    Normalize raw 16-bit PCM audio to a target dBFS level.
 
     Args:
-        bufferio (io.BytesIO): The input audio buffer.
-        target_dbfs (int): The target dBFS level for normalization.
+        pcm (bytes): The raw PCM audio.
+        target_dbfs (float): The target dBFS level for normalization.
 
     Returns:
-        io.BytesIO: The normalized audio buffer.
+        np.ndarray: The normalized samples as 16-bit integers.
     """
-    sound = AudioSegment.from_file(bufferio)
-    change_in_dbfs = target_dbfs - sound.dBFS
-    normalized_sound = sound.apply_gain(change_in_dbfs)
-    outf = io.BytesIO()
-    normalized_sound.export(outf, format="mp3")
-    outf.seek(0)
-    return outf
+    samples = pcm_samples(pcm)
+    return apply_gain(samples, pcm_gain(samples, target_dbfs))
 
-def get_audio_duration(audio_buffer: io.BytesIO) -> float:
+def pcm_duration(samples: np.ndarray) -> float:
     """
-    Get the duration of an audio buffer in seconds.
+    Get the duration of mono PCM audio in seconds.
 
     Args:
-        audio_buffer (io.BytesIO): The input audio buffer.
+        samples (np.ndarray): The PCM samples.
 
     Returns:
         float: The duration of the audio in seconds.
     """
-    return MP3(audio_buffer).info.length
\ No newline at end of file
+    return len(samples) / PCM_SAMPLE_RATE
@@ -0,0 +1,333 @@
+import os
+import io
+import re
+import time
+import wave
+import random
+import asyncio
+import importlib.util
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+import numpy as np
+from PIL import Image
+from cv2 import VideoCapture, CAP_PROP_FPS, CAP_PROP_FRAME_COUNT, CAP_PROP_POS_MSEC
+
+from .config import ImageOptions, Speaker
+from .audio import PCM_SAMPLE_RATE
+from .image import composite_image, encode_image, frame_to_image
+from .history import ConversationHistory
+from .api import react, get_next_speaker
+from .policy import RequestPolicy
+from .providers import GenerationProvider, SpeechProvider
+from .metrics import tagged
+from .subtitles import srt_timestamp
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".avi", ".webm")
+
+class FrameDirectory:
+    """
+    A recorded session stored as a directory of frame pairs.
+
+    Screenshots are files whose names start with "screen", webcam images files whose names
+    start with "cam". Both are paired in the natural order of their names, and pair n is
+    taken to be recorded `n * interval` seconds into the session.
+    """
+
+    def __init__(self, path: str, interval: float):
+        names = sorted(os.listdir(path), key=natural_key)
+        images = [name for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+        self.name = os.path.basename(os.path.normpath(path))
+        self._screens = [os.path.join(path, name) for name in images if name.startswith("screen")]
+        self._cams = [os.path.join(path, name) for name in images if name.startswith("cam")]
+        self.timestamps = [index * interval for index in range(len(self._screens))]
+
+    def load(self, index: int) -> Tuple[Image.Image, Optional[Image.Image]]:
+        screen = Image.open(self._screens[index]).convert("RGB")
+        cam = Image.open(self._cams[index]).convert("RGB") if index < len(self._cams) else None
+        return screen, cam
+
+    def close(self):
+        pass
+
+class VideoRecording:
+    """
+    A recorded session stored as a screen recording, sampled every `interval` seconds.
+
+    If a video with the same name plus "_cam" (e.g. "session_cam.mp4" next to "session.mp4")
+    exists, it is used as the webcam footage and sampled at the same timestamps.
+
+    Raises:
+        ValueError: If the frame rate of the screen recording is not positive, e.g. because it cannot be read.
+    """
+
+    def __init__(self, path: str, interval: float):
+        stem, extension = os.path.splitext(path)
+        self.name = os.path.basename(stem)
+        self._screen = VideoCapture(path)
+        fps = self._screen.get(CAP_PROP_FPS)
+        if fps <= 0:
+            self._screen.release()
+            raise ValueError(f"The frame rate of {path} is not positive: {fps}")
+        cam_path = f"{stem}_cam{extension}"
+        self._cam = VideoCapture(cam_path) if os.path.exists(cam_path) else None
+        duration = self._screen.get(CAP_PROP_FRAME_COUNT) / fps
+        self.timestamps = list(np.arange(0.0, duration, interval))
+
+    @staticmethod
+    def _frame_at(video: VideoCapture, timestamp: float) -> Optional[Image.Image]:
+        video.set(CAP_PROP_POS_MSEC, timestamp * 1000)
+        ret, frame = video.read()
+        if not ret:
+            return None
+        return frame_to_image(frame)
+
+    def load(self, index: int) -> Tuple[Optional[Image.Image], Optional[Image.Image]]:
+        timestamp = self.timestamps[index]
+        screen = self._frame_at(self._screen, timestamp)
+        cam = self._frame_at(self._cam, timestamp) if self._cam is not None else None
+        return screen, cam
+
+    def close(self):
+        self._screen.release()
+        if self._cam is not None:
+            self._cam.release()
+
+def natural_key(name: str) -> list:
+    """
+    Sort key that orders "frame2" before "frame10".
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+def open_session(path: str, interval: float):
+    """
+    Open a recorded session.
+
+    Args:
+        path (str): A directory of frame pairs or a screen recording video file.
+        interval (float): The time in seconds between narrated frames.
+
+    Returns:
+        FrameDirectory or VideoRecording: The session.
+    """
+    if os.path.isdir(path):
+        return FrameDirectory(path, interval)
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        return VideoRecording(path, interval)
+    raise ValueError(f"Not a frame directory or a video file: {path}")
+
+def output_names(paths: List[str]) -> List[str]:
+    """
+    Name the output files of sessions after their directory or video file.
+
+    Sessions with the same name, e.g. "day1/session.mp4" and "day2/session.mp4", get a numeric
+    suffix ("session" and "session-2"), so they do not overwrite each other's files.
+
+    Args:
+        paths (List[str]): The recorded sessions.
+
+    Returns:
+        List[str]: The output name of every session, without an extension.
+    """
+    names = []
+    for path in paths:
+        name = os.path.basename(os.path.normpath(path))
+        if not os.path.isdir(path):
+            name = os.path.splitext(name)[0]
+        candidate, suffix = name, 1
+        while candidate in names:
+            suffix += 1
+            candidate = f"{name}-{suffix}"
+        names.append(candidate)
+    return names
+
+def write_srt(path: str, cues: List[Tuple[float, float, str]]):
+    """
+    Write subtitle cues to an SRT file.
+
+    Args:
+        path (str): The output path.
+        cues (List[Tuple[float, float, str]]): The start time, end time and text of every cue.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for index, (start, end, text) in enumerate(cues, start=1):
+            f.write(f"{index}\n{srt_timestamp(start)} --> {srt_timestamp(end)}\n{text}\n\n")
+
+def mp3_supported() -> bool:
+    """
+    Check whether the optional pydub dependency for MP3 output is installed.
+    """
+    return importlib.util.find_spec("pydub") is not None
+
+def write_audio(path: str, samples: np.ndarray, audio_format: str):
+    """
+    Write 16-bit mono PCM samples as a WAV or MP3 file. MP3 requires pydub and ffmpeg.
+    """
+    if audio_format == "mp3":
+        # pydub is an optional dependency and warns on import if ffmpeg is missing, so it is only imported here.
+        from pydub import AudioSegment
+        segment = AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=PCM_SAMPLE_RATE, channels=1)
+        segment.export(path, format="mp3")
+    else:
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(PCM_SAMPLE_RATE)
+            f.writeframes(samples.tobytes())
+
+class BatchNarrator:
+    """
+    Narrates recorded sessions offline into an audio track and an SRT subtitle track per session.
+
+    Within a session, reactions are generated one after another, since every turn reacts to
+    the history of the previous ones, while the speech of earlier turns is synthesized in the
+    background. Sessions are independent and run in parallel; the number of reaction
+    requests in flight across all sessions is limited to `workers`, and TTS downloads are
+    limited by the connection pool of the TTS client.
+    """
+
+    def __init__(self, client: Union["AsyncOpenAI", GenerationProvider], tts_client: SpeechProvider,
+                 selected_speakers: List[Speaker], tts_model_id: str,
+                 output_dir: str, workers: int = 4, interval: float = 20.0, audio_format: str = "mp3",
+                 override_next_speaker: bool = True, image_options: ImageOptions = None,
+                 request_policy: Optional[RequestPolicy] = None, history_token_budget: int = 1500,
+                 history_turns: int = 6, summary_model: str = "gpt-3.5-turbo"):
+        """
+        Args:
+            client (Union[AsyncOpenAI, GenerationProvider]): The generation provider, or the OpenAI API client,
+                shared by all sessions.
+            tts_client (SpeechProvider): The speech provider shared by all sessions, e.g. the pooled ElevenLabs client.
+            selected_speakers (List[Speaker]): The list of selected speakers.
+            tts_model_id (str): The ID of the TTS model to use.
+            output_dir (str): The directory the audio and subtitle files are written to.
+            workers (int): The maximum number of reaction requests in flight across all sessions.
+            interval (float): The time in seconds between narrated frames of a video.
+            audio_format (str): The audio format, "mp3" or "wav".
+            override_next_speaker (bool): Whether a speaker mentioned in a reaction gets the next turn.
+            image_options (ImageOptions): How frames are resized and encoded.
+            request_policy (Optional[RequestPolicy]): The deadline, retry and hedging policy of the reaction requests.
+            history_token_budget (int): The token budget of each session's history.
+            history_turns (int): The number of most recent turns that are always sent verbatim.
+            summary_model (str): The model that summarizes older turns.
+        """
+        self.client = client
+        self.tts_client = tts_client
+        self.selected_speakers = selected_speakers
+        self.tts_model_id = tts_model_id
+        self.output_dir = output_dir
+        self.interval = interval
+        self.audio_format = audio_format
+        self.override_next_speaker = override_next_speaker
+        self.image_options = image_options or ImageOptions()
+        self.request_policy = request_policy or RequestPolicy()
+        self.history_token_budget = history_token_budget
+        self.history_turns = history_turns
+        self.summary_model = summary_model
+        self._workers = asyncio.Semaphore(workers)
+
+    async def _encode(self, img: Optional[Image.Image]) -> Optional[io.BytesIO]:
+        if img is None:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(None, encode_image, img, self.image_options)
+
+    def _encode_composite(self, screen: Image.Image, cam: Optional[Image.Image]) -> io.BytesIO:
+        return encode_image(composite_image(screen, cam, self.image_options), self.image_options)
+
+    async def _synthesize(self, turn: int, speaker: Speaker, reaction: str) -> Optional[np.ndarray]:
+        with tagged(speaker=speaker.value, turn=turn):
+            return await self.tts_client.synthesize(speaker, reaction, self.tts_model_id)
+
+    async def narrate(self, path: str, name: Optional[str] = None) -> int:
+        """
+        Narrate one recorded session and write its audio and subtitle files.
+
+        Args:
+            path (str): A directory of frame pairs or a screen recording video file.
+            name (Optional[str]): The name of the output files. Defaults to the name of the session.
+
+        Returns:
+            int: The number of narrated turns.
+        """
+        loop = asyncio.get_running_loop()
+        session = await loop.run_in_executor(None, open_session, path, self.interval)
+        name = name or session.name
+        history = ConversationHistory(self.client, self.history_token_budget, self.history_turns, self.summary_model)
+        speaker = random.choice(self.selected_speakers)
+        turns = []
+        try:
+            for index, timestamp in enumerate(session.timestamps):
+                screen, cam = await loop.run_in_executor(None, session.load, index)
+                if screen is None:
+                    break
+                if self.image_options.composite:
+                    screen_buffer = await loop.run_in_executor(None, self._encode_composite, screen, cam)
+                    cam_buffer = None
+                else:
+                    screen_buffer, cam_buffer = await asyncio.gather(self._encode(screen), self._encode(cam))
+                with tagged(speaker=speaker.value, turn=index + 1):
+                    async with self._workers:
+                        # A session without webcam footage is narrated from the screen alone.
+                        speaker_name, reaction = await react(speaker, cam_buffer, screen_buffer, history,
+                                                             self.selected_speakers, self.client,
+                                                             policy=self.request_policy,
+                                                             composite=self.image_options.composite,
+                                                             webcam=cam is not None)
+                print(f"[{name} {srt_timestamp(timestamp)}] {speaker.value}: {reaction}")
+                history.append(f"[{speaker_name}:] {reaction}")
+                # The speech does not feed back into the history, so it is synthesized while the next turn is generated.
+                synthesis = asyncio.create_task(self._synthesize(index + 1, speaker, reaction))
+                turns.append((timestamp, speaker, reaction, synthesis))
+                speaker = get_next_speaker(speaker, reaction, self.selected_speakers, self.override_next_speaker)
+            audio = await asyncio.gather(*(synthesis for *_, synthesis in turns))
+        finally:
+            for *_, synthesis in turns:
+                synthesis.cancel()
+            session.close()
+            await history.close()
+
+        await loop.run_in_executor(None, self._write, name, turns, audio)
+        return len(turns)
+
+    def _write(self, name: str, turns: list, audio: List[Optional[np.ndarray]]):
+        """
+        Lay the utterances out at the time of the frame they react to, without overlapping, and write the files.
+        """
+        cues = []
+        clips = []
+        end = 0.0
+        for (timestamp, speaker, reaction, _), samples in zip(turns, audio):
+            if samples is None:
+                continue
+            start = max(timestamp, end)
+            end = start + len(samples) / PCM_SAMPLE_RATE
+            cues.append((start, end, f"{speaker.value}: {reaction}"))
+            clips.append((start, samples))
+        track = np.zeros(int(end * PCM_SAMPLE_RATE) + 1, dtype=np.int16)
+        for start, samples in clips:
+            offset = int(start * PCM_SAMPLE_RATE)
+            track[offset:offset + len(samples)] = samples
+        base = os.path.join(self.output_dir, name)
+        write_audio(f"{base}.{self.audio_format}", track, self.audio_format)
+        write_srt(f"{base}.srt", cues)
+
+    async def run(self, paths: List[str]):
+        """
+        Narrate all sessions in parallel and report the throughput.
+
+        Args:
+            paths (List[str]): The recorded sessions.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self.narrate(path, name) for path, name in zip(paths, output_names(paths))),
+                                       return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        turns = 0
+        for path, result in zip(paths, results):
+            if isinstance(result, BaseException):
+                print(f"Error narrating {path}: {result!r}")
+            else:
+                turns += result
+        print(f"Narrated {turns} turns of {len(paths)} sessions in {elapsed:.1f}s ({turns / elapsed * 60:.1f} turns/min)")
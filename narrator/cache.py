@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Optional
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "narrator", "tts")
+
+def tts_cache_key(voice_id: str, payload: dict, target_dbfs: float, output_format: str) -> str:
+    """
+    Build the content address of a synthesized utterance.
+
+    Args:
+        voice_id (str): The ElevenLabs voice ID.
+        payload (dict): The TTS request payload with the model ID, voice settings and text.
+        target_dbfs (float): The normalization target the audio is stored at.
+        output_format (str): The requested audio format.
+
+    Returns:
+        str: The hex SHA-256 digest identifying the audio.
+    """
+    material = json.dumps({
+        "voice_id": voice_id,
+        "payload": payload,
+        "target_dbfs": target_dbfs,
+        "output_format": output_format,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class TTSCache:
+    """
+    A size-bounded, content-addressed on-disk cache of normalized TTS audio.
+
+    Entries are stored as one file per key. A hit refreshes the file's modification time,
+    so eviction removes the least recently used entries once the cache grows beyond
+    `max_bytes`. Entries are written to a temporary file and atomically renamed into
+    place, so several narrator sessions can share one cache directory.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        # Writes run in executor threads; the lock guards the size and the evictions.
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pcm")
+
+    def _entries(self):
+        """
+        List the cached entries as (path, size, modification time) tuples.
+        """
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.name.endswith(".pcm"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        existed = os.path.exists(path)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        with self._lock:
+            if not existed:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the cache fits its size bound. Called with the lock held.
+
+        The size is recounted from disk first, since other sessions may have added or
+        removed entries in the same directory.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Look up the audio stored under a key.
+
+        Args:
+            key (str): The content address from `tts_cache_key`.
+
+        Returns:
+            Optional[bytes]: The cached PCM audio, or None on a miss.
+        """
+        data = await asyncio.get_running_loop().run_in_executor(None, self._read, key)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    async def put(self, key: str, data: bytes):
+        """
+        Store audio under a key, evicting old entries if the cache is full.
+
+        Args:
+            key (str): The content address from `tts_cache_key`.
+            data (bytes): The PCM audio, or any bytes-like object such as a memoryview of the samples.
+        """
+        if len(data) > self.max_bytes:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, key, data)
+        except OSError as e:
+            print(f"Error writing to the TTS cache: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get the hit/miss statistics of this session.
+
+        Returns:
+            Dict[str, float]: The hits, misses, evictions, hit rate and cache size in bytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes": self._size,
+        }
+
+    def summary(self) -> str:
+        """
+        Describe the hit/miss statistics in one line.
+        """
+        stats = self.stats()
+        return (f"TTS cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+                f"{stats['evictions']} evictions, {stats['bytes'] / 1024 / 1024:.1f} MB on disk")
@@ -0,0 +1,219 @@
+import asyncio
+from typing import Optional
+
+from .metrics import count
+
+class Budget:
+    """
+    A per-minute budget of a resource such as prompt tokens, kept as a token bucket.
+
+    The bucket holds up to one minute's worth and refills continuously, so a quiet minute
+    allows a short burst afterwards. Spending may take it below zero; the next turn then
+    waits until it has refilled. The cost of a turn is estimated from the average of the
+    recent turns. Amounts are spent per turn number, and a turn counts as complete once a later
+    turn spends, since the stages of the pipeline spend for different turns at the same time.
+    """
+
+    def __init__(self, name: str, per_minute: float, smoothing: float = 0.3):
+        """
+        Args:
+            name (str): The name of the resource, for the counters and the summary.
+            per_minute (float): The amount that may be spent per minute.
+            smoothing (float): The weight of the latest turn in the average cost per turn.
+        """
+        self.name = name
+        self.per_minute = per_minute
+        self.smoothing = smoothing
+        self.level = float(per_minute)
+        self.used = 0
+        self.turn_cost: Optional[float] = None
+        self._refilled: Optional[float] = None
+        self._turn: Optional[int] = None
+        self._spent = 0
+
+    def refill(self, now: float):
+        if self._refilled is not None:
+            self.level = min(self.per_minute, self.level + (now - self._refilled) * self.per_minute / 60)
+        self._refilled = now
+
+    def spend(self, amount: int, now: float, turn: int):
+        """
+        Take an amount from the bucket for a turn.
+        """
+        self.refill(now)
+        self.level -= amount
+        self.used += amount
+        if turn != self._turn:
+            if self._turn is not None:
+                self.end_turn(self._spent)
+            self._turn, self._spent = turn, 0
+        self._spent += amount
+
+    def end_turn(self, cost: int):
+        """
+        Update the average cost per turn with the amount a complete turn spent.
+        """
+        if self.turn_cost is None:
+            self.turn_cost = float(cost)
+        else:
+            self.turn_cost += self.smoothing * (cost - self.turn_cost)
+
+    def wait_time(self, now: float) -> float:
+        """
+        The time in seconds until the bucket holds enough for one more turn of average cost.
+        """
+        self.refill(now)
+        needed = min(self.turn_cost or 0.0, self.per_minute)
+        return max(0.0, (needed - self.level) * 60 / self.per_minute)
+
+    def pressure(self) -> float:
+        """
+        How much of the budget is spent, from 0 (a full bucket) to 1 (empty or overdrawn).
+        """
+        return min(1.0, max(0.0, 1 - self.level / self.per_minute))
+
+class CadenceController:
+    """
+    Sets how often the narrator captures the scene, at which detail level the images are sent and how long
+    reactions may be, so that the API usage follows the activity on screen and stays within per-minute budgets.
+
+    A turn starts no sooner than `min_interval` seconds after the previous one. Turns that take
+    longer than that because the APIs are slow start right away, so the measured latency of the
+    stages is what paces a busy session. While the scene stays unchanged, the interval doubles with
+    every idle turn up to `max_interval`; as soon as the screen gets busy again, it drops back to
+    `min_interval`. A turn also waits until the prompt token and TTS character budgets have room
+    for a turn of average cost, and the fuller the budgets are, the lower the detail level and
+    the `max_tokens` of the next request.
+    """
+
+    def __init__(self, prompt_tokens_per_minute: Optional[float] = None, tts_chars_per_minute: Optional[float] = None,
+                 min_interval: float = 0.0, max_interval: float = 60.0, idle_interval: float = 5.0,
+                 idle_threshold: float = 0.02, busy_threshold: float = 0.15, max_tokens: int = 300,
+                 min_max_tokens: int = 120, low_detail_pressure: float = 0.5):
+        """
+        Args:
+            prompt_tokens_per_minute (Optional[float]): The prompt token budget per minute, or None for no budget.
+            tts_chars_per_minute (Optional[float]): The TTS character budget per minute, or None for no budget.
+            min_interval (float): The minimum time between the starts of two turns in seconds.
+            max_interval (float): The maximum time between the starts of two turns while the scene is idle.
+            idle_interval (float): The interval after the first idle turn, doubled with every further one.
+            idle_threshold (float): The scene change (the fraction of differing hash bits) below which a turn counts as idle.
+            busy_threshold (float): The scene change above which the interval drops back to `min_interval`.
+            max_tokens (int): The `max_tokens` of a reaction request while the budgets have room.
+            min_max_tokens (int): The `max_tokens` of a reaction request when a budget is used up.
+            low_detail_pressure (float): The prompt token budget pressure from which images are sent at low detail.
+        """
+        self.prompt_tokens = Budget("prompt_tokens", prompt_tokens_per_minute) if prompt_tokens_per_minute else None
+        self.tts_chars = Budget("tts_characters", tts_chars_per_minute) if tts_chars_per_minute else None
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.idle_interval = idle_interval
+        self.idle_threshold = idle_threshold
+        self.busy_threshold = busy_threshold
+        self.max_tokens = max_tokens
+        self.min_max_tokens = min(min_max_tokens, max_tokens)
+        self.low_detail_pressure = low_detail_pressure
+        self.interval = min_interval
+        self.idle_turns = 0
+        self.turns = 0
+        self.waited = 0.0
+        self.prompt_tokens_used = 0
+        self.tts_chars_used = 0
+        self._last_start: Optional[float] = None
+
+    @property
+    def budgets(self):
+        return [budget for budget in (self.prompt_tokens, self.tts_chars) if budget is not None]
+
+    def delay(self, now: float) -> float:
+        """
+        The time in seconds the next turn has to wait.
+        """
+        if self._last_start is None:
+            return 0.0
+        delay = self._last_start + self.interval - now
+        for budget in self.budgets:
+            delay = max(delay, budget.wait_time(now))
+        return max(0.0, delay)
+
+    async def wait(self):
+        """
+        Wait until the next turn may start, and start it.
+        """
+        loop = asyncio.get_running_loop()
+        delay = self.delay(loop.time())
+        if delay > 0:
+            self.waited += delay
+            count("cadence_wait_seconds", delay)
+            await asyncio.sleep(delay)
+        self._last_start = loop.time()
+        self.turns += 1
+        count("turns")
+
+    def observe_scene(self, change: Optional[float]):
+        """
+        Adjust the interval to the activity in the scene just captured.
+
+        Args:
+            change (Optional[float]): How much the scene changed since the last capture, from 0 to 1,
+                or None if it was not measured.
+        """
+        if change is None:
+            return
+        if change < self.idle_threshold:
+            self.idle_turns += 1
+            self.interval = min(self.max_interval, max(self.min_interval, self.idle_interval * 2 ** (self.idle_turns - 1)))
+        else:
+            self.idle_turns = 0
+            if change >= self.busy_threshold:
+                self.interval = self.min_interval
+            else:
+                self.interval = max(self.min_interval, self.interval / 2)
+
+    def record_prompt_tokens(self, turn: int, tokens: int):
+        """
+        Record the prompt tokens of a reaction request for a turn.
+        """
+        count("prompt_tokens", tokens)
+        self.prompt_tokens_used += tokens
+        if self.prompt_tokens:
+            self.prompt_tokens.spend(tokens, asyncio.get_running_loop().time(), turn)
+
+    def record_tts_chars(self, turn: int, chars: int):
+        """
+        Record the characters of an utterance of a turn sent to synthesis.
+        """
+        count("tts_characters", chars)
+        self.tts_chars_used += chars
+        if self.tts_chars:
+            self.tts_chars.spend(chars, asyncio.get_running_loop().time(), turn)
+
+    def detail(self, detail: str) -> str:
+        """
+        The detail level to send an image at, given the one the scene detection chose.
+        """
+        if self.prompt_tokens and self.prompt_tokens.pressure() >= self.low_detail_pressure:
+            return "low"
+        return detail
+
+    def request_max_tokens(self) -> int:
+        """
+        The `max_tokens` of the next reaction request.
+        """
+        pressure = max((budget.pressure() for budget in self.budgets), default=0.0)
+        return round(self.max_tokens - (self.max_tokens - self.min_max_tokens) * pressure)
+
+    def summary(self, elapsed: float) -> str:
+        """
+        Describe the turns, waits and budget usage of a session.
+
+        Args:
+            elapsed (float): The length of the session in seconds.
+        """
+        minutes = max(elapsed, 1e-9) / 60
+        lines = [f"{self.turns} turns, {self.waited:.0f}s waited for cadence and budgets"]
+        for name, used, budget in (("prompt tokens", self.prompt_tokens_used, self.prompt_tokens),
+                                   ("TTS characters", self.tts_chars_used, self.tts_chars)):
+            limit = f" (budget {budget.per_minute:.0f}/min)" if budget else ""
+            lines.append(f"{name}: {used} used, {used / minutes:.0f}/min{limit}")
+        return "\n".join(lines)
@@ -1,5 +1,6 @@
 from enum import Enum
-from typing import Dict, List
+from typing import Dict, List, Literal, Optional
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 class Speaker(Enum):
@@ -13,17 +14,55 @@ class Settings(BaseSettings):
     herzog_voice_id: str = '242pUn06d7kxuB5cZdVw'
     adorno_voice_id: str = 'B84LQqhW5ZdidYkT9Cgb'
     zizek_voice_id: str = 'tHSWOxKiMYit2kQAqxTV'
+    # An OpenAI-compatible endpoint for --generation-provider local, e.g. a llama.cpp, vLLM or Ollama server.
+    local_llm_url: str = "http://localhost:8080/v1"
+    local_llm_api_key: str = ""
+    local_vision_model: str = "llava"
+    # Paths of Piper voice models (.onnx, with the .onnx.json config next to them) for --speech-provider piper.
+    herzog_local_voice: str = ""
+    adorno_local_voice: str = ""
+    zizek_local_voice: str = ""
 
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
 
+class ImageOptions(BaseModel):
+    """
+    How captured images are resized and encoded before they are sent to the vision model.
+    """
+    max_dimension: int = 2048
+    format: Literal["JPEG", "WEBP", "PNG"] = "JPEG"
+    quality: int = 80
+    # Send one image per turn: the screen with the webcam inset in its bottom-right corner.
+    composite: bool = False
+    pip_fraction: float = 0.3
+
+# Reading the environment and the .env file is not free, so the settings are loaded once and shared.
+settings = Settings()
+
+DEFAULT_VISION_MODEL = "gpt-4-vision-preview"
+
 SPEAKER_TO_VOICE_ID: Dict[Speaker, str] = {
-    Speaker.HERZOG: Settings().herzog_voice_id,
-    Speaker.ADORNO: Settings().adorno_voice_id,
-    Speaker.ZIZEK: Settings().zizek_voice_id,
+    Speaker.HERZOG: settings.herzog_voice_id,
+    Speaker.ADORNO: settings.adorno_voice_id,
+    Speaker.ZIZEK: settings.zizek_voice_id,
+}
+
+SPEAKER_TO_LOCAL_VOICE: Dict[Speaker, str] = {
+    Speaker.HERZOG: settings.herzog_local_voice,
+    Speaker.ADORNO: settings.adorno_local_voice,
+    Speaker.ZIZEK: settings.zizek_local_voice,
 }
 
+# The names of the speech and generation providers of every speaker, see narrator.providers.
+SPEAKER_TO_SPEECH_PROVIDER: Dict[Speaker, str] = {speaker: "elevenlabs" for speaker in Speaker}
+
+SPEAKER_TO_GENERATION_PROVIDER: Dict[Speaker, str] = {speaker: "openai" for speaker in Speaker}
+
+# The vision models of speakers that do not use their generation provider's default.
+SPEAKER_TO_MODEL: Dict[Speaker, Optional[str]] = {speaker: None for speaker in Speaker}
+
 SPEAKER_TO_STYLE_ATTRIBUTES: Dict[Speaker, str] = {
     Speaker.ADORNO: "Complex, critical, dense, interdisciplinary, reflective, abstract, pessimistic, scholarly, multifaceted, provocative",
     Speaker.HERZOG: "Dense, grim, dark, inquisitive, analytical, critical, abstract, complex, philosophical, nuanced, reflective, interdisciplinary, intricate, erudite",
@@ -34,4 +73,10 @@ SPEAKER_TO_FIRST_NAME: Dict[Speaker, List[str]] = {
     Speaker.HERZOG: ['Werner', "Herzog"],
     Speaker.ADORNO: ["Theo", "Theodor", "Adorno"],
     Speaker.ZIZEK: ['Slavoy', 'Slavoj', "Zizek"],
+}
+
+SPEAKER_TO_FALLBACK_REACTION: Dict[Speaker, str] = {
+    Speaker.HERZOG: "The scene before us refuses to speak, and so we must simply watch, in silence, as the machine watches back.",
+    Speaker.ADORNO: "Here the image withholds itself from interpretation, and this very withholding is the truth of the administered world.",
+    Speaker.ZIZEK: "And so on, and so on - sometimes the most radical gesture is simply to say nothing at all, no?",
 }
\ No newline at end of file
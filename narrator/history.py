@@ -0,0 +1,136 @@
+import asyncio
+from typing import TYPE_CHECKING, List, Optional, Union
+from .providers import GenerationProvider, as_generation_provider
+from .ratelimit import request_priority, PRIORITY_BACKGROUND
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text, assuming roughly four characters per token.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+class ConversationHistory:
+    """
+    The narration history sent along with every reaction request, bounded by a token budget.
+
+    The most recent turns are kept verbatim. Once the history exceeds the budget, the older
+    turns are compacted into a rolling summary by a background request, so the prompt size
+    stays flat over long sessions and the narration never waits for the summary.
+    """
+
+    def __init__(self, client: Union["AsyncOpenAI", GenerationProvider], token_budget: int = 1500, keep_turns: int = 6,
+                 summary_model: str = "gpt-3.5-turbo", summary_words: int = 150):
+        """
+        Args:
+            client (Union[AsyncOpenAI, GenerationProvider]): The generation provider, or the OpenAI API client,
+                used for summarization.
+            token_budget (int): The number of history tokens above which older turns are summarized.
+            keep_turns (int): The number of most recent turns that are always kept verbatim.
+            summary_model (str): The model that writes the rolling summary.
+            summary_words (int): The approximate maximum length of the summary in words.
+        """
+        self.client = as_generation_provider(client)
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary_model = summary_model
+        self.summary_words = summary_words
+        self.summary = ""
+        self._turns: List[str] = []
+        self._summary_task: Optional[asyncio.Task] = None
+        # The number of turns at the front of the list that the running summary covers.
+        self._summarizing = 0
+
+    def __len__(self) -> int:
+        return len(self._turns) + (1 if self.summary else 0)
+
+    def append(self, entry: str):
+        """
+        Add a turn to the history and compact older turns if the budget is exceeded.
+
+        Args:
+            entry (str): The turn, including the speaker name.
+        """
+        self._turns.append(entry)
+        if self.token_count() <= self.token_budget or len(self._turns) <= self.keep_turns:
+            return
+        if self._summary_task is None or self._summary_task.done():
+            # Not `[:-keep_turns]`, which is empty for keep_turns=0.
+            older_turns = self._turns[:len(self._turns) - self.keep_turns]
+            self._summarizing = len(older_turns)
+            self._summary_task = asyncio.create_task(self._summarize(older_turns))
+        elif self.token_count() > 2 * self.token_budget:
+            # The summary is lagging behind; drop the oldest turn so the prompt stays bounded.
+            self._turns.pop(0)
+            self._summarizing = max(0, self._summarizing - 1)
+
+    async def _summarize(self, turns: List[str]):
+        """
+        Replace the given oldest turns with an updated rolling summary.
+        """
+        previous = f"Summary of the conversation so far:\n{self.summary}\n\n" if self.summary else ""
+        conversation = "\n".join(turns)
+        try:
+            # The summary is housekeeping: reactions for the narration go first.
+            with request_priority(PRIORITY_BACKGROUND):
+                response = await self.client.complete(
+                    [{
+                        "role": "user",
+                        "content": f"""{previous}Continue the summary with the following narration turns:
+{conversation}
+
+Write a summary of the whole conversation in at most {self.summary_words} words. Keep who said what,
+the observations and topics already covered, and open questions between the narrators."""
+                    }],
+                    max_tokens=self.summary_words * 2,
+                    temperature=0.3,
+                    model=self.summary_model,
+                )
+            self.summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"Error summarizing the conversation history: {e}")
+        finally:
+            # The turns are removed even if summarization failed, to keep the history bounded.
+            # Turns dropped while the summary was running are no longer at the front of the list.
+            del self._turns[:self._summarizing]
+            self._summarizing = 0
+
+    async def close(self):
+        """
+        Cancel a running summary, e.g. when the session ends.
+        """
+        if self._summary_task is not None and not self._summary_task.done():
+            self._summary_task.cancel()
+            await asyncio.gather(self._summary_task, return_exceptions=True)
+
+    def messages(self) -> List[dict]:
+        """
+        Build the chat messages that represent the history.
+
+        Returns:
+            List[dict]: The rolling summary, if any, followed by the verbatim turns.
+        """
+        messages = []
+        if self.summary:
+            messages.append({"role": "assistant", "content": [
+                {"type": "text", "text": f"[Summary of the earlier narration:] {self.summary}"}
+            ]})
+        messages.extend({"role": "assistant", "content": [{"type": "text", "text": msg}]} for msg in self._turns)
+        return messages
+
+    def token_count(self) -> int:
+        """
+        Estimate the number of tokens the history adds to a request.
+
+        Returns:
+            int: The estimated number of tokens of the summary and the verbatim turns.
+        """
+        return estimate_tokens(self.summary) + sum(estimate_tokens(turn) for turn in self._turns)
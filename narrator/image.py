@@ -1,48 +1,316 @@
-import asyncio
 import io
+import time
+import asyncio
 import base64
-import magic
-from PIL import ImageGrab
-from cv2 import VideoCapture, imencode
+import atexit
+import threading
+import collections
+import math
+from typing import List, Optional, Tuple
+from PIL import Image, ImageGrab
+from .config import ImageOptions
+from .metrics import span
+
+# The vision model fits high-detail images into a 2048x2048 square, scales the shortest
+# side down to 768 pixels and bills them per 512-pixel tile.
+VISION_MAX_SIDE = 2048
+VISION_MAX_SHORT_SIDE = 768
+VISION_TILE_SIZE = 512
+VISION_BASE_TOKENS = 85
+VISION_TILE_TOKENS = 170
 
-async def capture_screen() -> io.BytesIO:
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+def vision_size(width: int, height: int, max_dimension: int = VISION_MAX_SIDE) -> Tuple[int, int]:
     """
-    Capture the current screen and return it as a BytesIO object.
+    Compute the size the vision model would downsample an image to, capped at a maximum dimension.
+
+    Args:
+        width (int): The width of the image.
+        height (int): The height of the image.
+        max_dimension (int): The maximum length of the longer side.
 
     Returns:
-        io.BytesIO: The captured screen image as a BytesIO object.
+        Tuple[int, int]: The target width and height. Images are never upscaled.
+    """
+    scale = min(1.0, VISION_MAX_SIDE / max(width, height))
+    scale = min(scale, VISION_MAX_SHORT_SIDE / min(width, height))
+    scale = min(scale, max_dimension / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def vision_tokens(width: int, height: int, detail: str = "high", max_dimension: int = VISION_MAX_SIDE) -> int:
+    """
+    Estimate the number of prompt tokens the vision model bills for an image.
+
+    Args:
+        width (int): The width of the image.
+        height (int): The height of the image.
+        detail (str): The detail level the image is sent at.
+        max_dimension (int): The maximum length of the longer side the image is resized to before it is sent.
+
+    Returns:
+        int: The estimated number of image tokens.
+    """
+    if detail == "low":
+        return VISION_BASE_TOKENS
+    width, height = vision_size(width, height, max_dimension)
+    tiles = math.ceil(width / VISION_TILE_SIZE) * math.ceil(height / VISION_TILE_SIZE)
+    return VISION_BASE_TOKENS + VISION_TILE_TOKENS * tiles
+
+class EncodedImage(io.BytesIO):
+    """
+    An encoded image that carries its MIME type, so it does not have to be sniffed from the bytes again.
+    """
+
+    def __init__(self, mime_type: str, initial_bytes: bytes = b""):
+        super().__init__(initial_bytes)
+        self.mime_type = mime_type
+
+def image_mime_type(image_buffer_io: io.BytesIO) -> str:
     """
-    img = ImageGrab.grab()
-    img_byte_io = io.BytesIO()
-    img.convert("RGB").save(img_byte_io, format='PNG')
-    img_byte_io.flush()
+    Get the MIME type of an image buffer, from the buffer itself if it is an EncodedImage.
+
+    Other buffers are identified from their header, without decoding the pixels.
+
+    Args:
+        image_buffer_io (io.BytesIO): The image buffer.
+
+    Returns:
+        str: The MIME type, e.g. "image/jpeg".
+
+    Raises:
+        ValueError: If the buffer does not hold an image.
+    """
+    mime_type = getattr(image_buffer_io, "mime_type", None)
+    if mime_type:
+        return mime_type
+    position = image_buffer_io.tell()
+    try:
+        image_buffer_io.seek(0)
+        with Image.open(image_buffer_io) as img:
+            mime_type = Image.MIME.get(img.format)
+    except (OSError, SyntaxError):
+        mime_type = None
+    finally:
+        image_buffer_io.seek(position)
+    if not mime_type or not mime_type.startswith("image"):
+        raise ValueError("The file type is not recognized as an image")
+    return mime_type
+
+def encode_image(img: Image.Image, options: ImageOptions) -> EncodedImage:
+    """
+    Resize an image to the vision model's budget and encode it with the configured codec.
+
+    Args:
+        img (Image.Image): The image to encode.
+        options (ImageOptions): The resize and encoding options.
+
+    Returns:
+        EncodedImage: The encoded image as a BytesIO object that knows its MIME type.
+    """
+    size = vision_size(img.width, img.height, options.max_dimension)
+    if size != img.size:
+        img = img.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img_byte_io = EncodedImage(MIME_TYPES[options.format])
+    if options.format == "PNG":
+        img.save(img_byte_io, format="PNG", compress_level=1)
+    else:
+        img.save(img_byte_io, format=options.format, quality=options.quality)
     img_byte_io.seek(0)
     return img_byte_io
 
-async def capture_cam() -> io.BytesIO:
+def composite_image(screen: Image.Image, cam: Optional[Image.Image], options: ImageOptions) -> Image.Image:
+    """
+    Combine the screen and the webcam into one image that fits the vision model's budget for the screen alone.
+
+    The screen is downscaled to the size the vision model would use, and the webcam is inset
+    picture-in-picture in its bottom-right corner, `options.pip_fraction` of the width wide.
+
+    Args:
+        screen (Image.Image): The screen image.
+        cam (Optional[Image.Image]): The webcam image, or None to send the screen alone.
+        options (ImageOptions): The resize and picture-in-picture options.
+
+    Returns:
+        Image.Image: The composite image.
+    """
+    size = vision_size(screen.width, screen.height, options.max_dimension)
+    canvas = screen.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0) if size != screen.size else screen.copy()
+    if canvas.mode != "RGB":
+        canvas = canvas.convert("RGB")
+    if cam is None:
+        return canvas
+    width = max(1, round(canvas.width * options.pip_fraction))
+    height = max(1, round(cam.height * width / cam.width))
+    margin = max(4, canvas.width // 100)
+    border = max(2, canvas.width // 400)
+    left, top = canvas.width - width - margin, canvas.height - height - margin
+    # A light frame keeps the inset apart from whatever is on the screen behind it.
+    canvas.paste((255, 255, 255), (left - border, top - border, left + width + border, top + height + border))
+    canvas.paste(cam.convert("RGB").resize((width, height), Image.Resampling.BILINEAR, reducing_gap=2.0), (left, top))
+    return canvas
+
+def grab_screen() -> Image.Image:
+    """
+    Capture the current screen at full resolution.
+
+    Returns:
+        Image.Image: The captured screen image.
+    """
+    return ImageGrab.grab()
+
+async def capture_screen(options: ImageOptions) -> io.BytesIO:
+    """
+    Capture the current screen in a worker thread and return it as a BytesIO object.
+
+    Args:
+        options (ImageOptions): The resize and encoding options.
+
+    Returns:
+        io.BytesIO: The captured screen image as a BytesIO object.
+    """
+    loop = asyncio.get_running_loop()
+    with span("screen_capture"):
+        return await loop.run_in_executor(None, lambda: encode_image(grab_screen(), options))
+
+class CameraService:
+    """
+    Keeps the camera open and grabs frames continuously on a background thread.
+
+    The most recent frames are kept in a small ring buffer, so reading the latest frame
+    never waits for the camera. The warm-up frames the camera produces after opening are
+    discarded once, when the service starts. The service has to be started, e.g. by using it
+    as a context manager, before frames are read.
+    """
+
+    def __init__(self, device: int = 0, buffer_size: int = 2, warmup_frames: int = 3):
+        self._device = device
+        self._warmup_frames = warmup_frames
+        self._frames = collections.deque(maxlen=buffer_size)
+        self._frame_ready = threading.Event()
+        self._running = threading.Event()
+        self._capture = None
+        self._thread = None
+        # Starting and stopping may happen from worker threads; only one of them opens or releases the camera.
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def start(self):
+        """
+        Opens the camera and starts grabbing frames in the background.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            # OpenCV is slow to import, so only sessions with a camera load it.
+            from cv2 import VideoCapture
+            self._capture = VideoCapture(self._device)
+            if not self._capture.isOpened():
+                raise Exception("Could not open camera")
+            self._running.set()
+            self._thread = threading.Thread(target=self._grab_frames, name="camera", daemon=True)
+            self._thread.start()
+
+    def _grab_frames(self):
+        """
+        Reads frames from the camera into the ring buffer until the service is stopped.
+        """
+        skipped = 0
+        try:
+            while self._running.is_set():
+                success, frame = self._capture.read()
+                if not success:
+                    time.sleep(0.05)
+                    continue
+                if skipped < self._warmup_frames:
+                    skipped += 1
+                    continue
+                self._frames.append(frame)
+                self._frame_ready.set()
+        finally:
+            self._capture.release()
+
+    def latest_frame(self, timeout: float = 5.0):
+        """
+        Returns the most recent camera frame, waiting for the first frame if necessary.
+
+        Raises:
+            Exception: If the service is not running or no frame arrives within the timeout.
+        """
+        if not self._running.is_set():
+            raise Exception("The camera service is not running")
+        if not self._frame_ready.wait(timeout):
+            raise Exception("Could not capture camera image")
+        return self._frames[-1]
+
+    def stop(self):
+        """
+        Stops grabbing frames and releases the camera.
+        """
+        with self._lock:
+            self._running.clear()
+            if self._thread is not None:
+                self._thread.join(timeout=5)
+                self._thread = None
+            self._frames.clear()
+            self._frame_ready.clear()
+
+    def __enter__(self) -> "CameraService":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def frame_to_image(frame) -> Image.Image:
     """
-    Capture an image from the default camera and return it as a BytesIO object.
+    Convert a BGR frame from OpenCV to an RGB image.
+
+    Pillow swaps the channels while it copies the frame in, so the frame is copied only once.
+
+    Args:
+        frame (np.ndarray): The frame as a contiguous height x width x 3 array of 8-bit BGR pixels.
+
+    Returns:
+        Image.Image: The RGB image.
+    """
+    height, width = frame.shape[:2]
+    return Image.frombuffer("RGB", (width, height), frame, "raw", "BGR", 0, 1)
+
+def grab_cam(camera: CameraService) -> Image.Image:
+    """
+    Get the most recent frame of the camera service as an RGB image.
+
+    Args:
+        camera (CameraService): The running camera service.
+
+    Returns:
+        Image.Image: The camera image.
+    """
+    return frame_to_image(camera.latest_frame())
+
+async def capture_cam(camera: CameraService, options: ImageOptions) -> io.BytesIO:
+    """
+    Encode the most recent frame of the camera service in a worker thread and return it as a BytesIO object.
+
+    Args:
+        camera (CameraService): The running camera service.
+        options (ImageOptions): The resize and encoding options.
 
     Returns:
         io.BytesIO: The captured camera image as a BytesIO object.
     """
-    cam = VideoCapture(0)
-    for _ in range(3):
-        cam.read()
-        await asyncio.sleep(0.3)
-    success, img = cam.read()
-    if success:
-        is_success, buffer = imencode(".jpg", img)
-        io_buf = io.BytesIO(buffer)
-        if is_success:
-            io_buf.flush()
-            io_buf.seek(0)
-            return io_buf
-    raise Exception("Could not capture camera image")
+    loop = asyncio.get_running_loop()
+    with span("cam_capture"):
+        return await loop.run_in_executor(None, lambda: encode_image(grab_cam(camera), options))
 
 def image_to_base64(image_buffer_io: io.BytesIO) -> str:
     """
-    Convert an image buffer to a base64-encoded string.
+    Convert an image buffer to a base64-encoded data URL.
+
+    The image is encoded straight from the buffer's memory, without copying it out first.
 
     Args:
         image_buffer_io (io.BytesIO): The input image buffer.
@@ -50,11 +318,22 @@ def image_to_base64(image_buffer_io: io.BytesIO) -> str:
     Returns:
         str: The base64-encoded image string.
     """
-    image_buffer_io.seek(0)
-    mime_type = magic.from_buffer(image_buffer_io.getvalue(), mime=True)
-    if not mime_type or not mime_type.startswith('image'):
-        raise ValueError("The file type is not recognized as an image")
-    image_buffer_io.seek(0)
-    encoded_string = base64.b64encode(image_buffer_io.getvalue()).decode('utf-8')
-    image_base64 = f"data:{mime_type};base64,{encoded_string}"
-    return image_base64
\ No newline at end of file
+    prefix = f"data:{image_mime_type(image_buffer_io)};base64,".encode("ascii")
+    with image_buffer_io.getbuffer() as view:
+        # The base64 bytes are freed once they are joined to the prefix, so at most two copies exist at a time.
+        data_url = prefix + base64.b64encode(view)
+    return data_url.decode("ascii")
+
+async def images_to_base64(*image_buffers: io.BytesIO) -> List[str]:
+    """
+    Convert image buffers to base64-encoded data URLs in worker threads.
+
+    Args:
+        *image_buffers (io.BytesIO): The input image buffers.
+
+    Returns:
+        List[str]: The base64-encoded image strings, in the order of the buffers.
+    """
+    loop = asyncio.get_running_loop()
+    with span("base64_encode"):
+        return await asyncio.gather(*(loop.run_in_executor(None, image_to_base64, buffer) for buffer in image_buffers))
\ No newline at end of file
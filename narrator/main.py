@@ -1,28 +1,145 @@
-import time
-import random
 import asyncio
 import click
 import os
-from typing import List
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 
-from pygame import mixer
-from openai import AsyncOpenAI
+# Only lightweight modules are imported here. pygame, OpenCV, PIL, OpenAI and the subtitle
+# backend are imported by the commands that use them, so `--help` starts quickly and the
+# subcommands only load what they need.
+from .config import (SPEAKER_TO_GENERATION_PROVIDER, SPEAKER_TO_LOCAL_VOICE, SPEAKER_TO_MODEL, SPEAKER_TO_SPEECH_PROVIDER,
+                     SPEAKER_TO_VOICE_ID, DEFAULT_VISION_MODEL, ImageOptions, Speaker, settings)
+from .cache import TTSCache, DEFAULT_CACHE_DIR
+from .cadence import CadenceController
+from .metrics import Tracer, set_tracer
+from .policy import RequestPolicy
+from .providers import (DEFAULT_GENERATION_PROVIDER, DEFAULT_SPEECH_PROVIDER, GENERATION_PROVIDERS,
+                        create_speech_provider, load_speech_provider, speech_providers)
+from .subtitles import DEFAULT_SUBTITLE_BACKEND, create_subtitle_backend, load_subtitle_backend, subtitle_backends
 
-from .config import SPEAKER_TO_VOICE_ID, Settings, Speaker
-from .audio import tts_output, get_audio_duration
-from .image import capture_screen, capture_cam
-from .api import react, get_next_speaker
-from .overlay import SubtitleOverlay
+if TYPE_CHECKING:
+    from .providers import SpeakerGeneration, SpeakerSpeech
+    from .ratelimit import ProviderLimiter
 
-settings = Settings()
+def speaker_options(values: Tuple[str, ...], option: str) -> Dict[Speaker, str]:
+    """
+    Parse the values of a repeatable SPEAKER=VALUE option, e.g. "herzog=piper".
+
+    Args:
+        values (Tuple[str, ...]): The values of the option.
+        option (str): The name of the option, for error messages.
+
+    Returns:
+        Dict[Speaker, str]: The value of every speaker that was given one.
+    """
+    parsed = {}
+    for value in values:
+        name, _, setting = value.partition("=")
+        matches = [speaker for speaker in Speaker if speaker.name.lower() == name.strip().lower()]
+        if not matches or not setting.strip():
+            raise click.BadParameter(f"Expected SPEAKER=VALUE with SPEAKER one of herzog, adorno or zizek, got {value!r}.", param_hint=option)
+        parsed[matches[0]] = setting.strip()
+    return parsed
+
+def check_providers(selected_speakers: List[Speaker], default_generation_provider: str):
+    """
+    Check that the API keys, local voices and dependencies the providers of the selected speakers need are available.
+
+    Args:
+        selected_speakers (List[Speaker]): The list of selected speakers.
+        default_generation_provider (str): The generation provider of the history summaries.
+    """
+    generation = {SPEAKER_TO_GENERATION_PROVIDER[speaker] for speaker in selected_speakers} | {default_generation_provider}
+    if "openai" in generation and not settings.openai_api_key:
+        raise click.UsageError("OpenAI API key is missing. Please provide it using --openai-api-key, provide it as an environment variable, or set it in the .env file.")
+    speech = {SPEAKER_TO_SPEECH_PROVIDER[speaker] for speaker in selected_speakers}
+    if "elevenlabs" in speech and not settings.elevenlabs_api_key:
+        raise click.UsageError("ElevenLabs API key is missing. Please provide it using --elevenlabs-api-key, provide it as an environment variable, or set it in the .env file.")
+    for name in speech - {"elevenlabs"}:
+        try:
+            load_speech_provider(name)
+        except ImportError as e:
+            raise click.UsageError(f"The {name} speech provider is not available ({e}). Install it with `pip install narrator[local]`.")
+    for speaker in selected_speakers:
+        if SPEAKER_TO_SPEECH_PROVIDER[speaker] != "elevenlabs" and not SPEAKER_TO_LOCAL_VOICE[speaker]:
+            raise click.UsageError(f"No local voice model is set for {speaker.value}. Please provide it using --{speaker.name.lower()}-local-voice, provide it as an environment variable, or set it in the .env file.")
+
+def generation_provider(speakers: List[Speaker], openai_limiter: "ProviderLimiter", local_limiter: "ProviderLimiter",
+                        default_generation_provider: str) -> "SpeakerGeneration":
+    """
+    Create the clients of the generation providers the given speakers use and route every speaker to its provider.
+
+    Clients are only created for the providers of these speakers and the default provider, so a
+    provider that no speaker uses needs no API key or endpoint.
+
+    Args:
+        speakers (List[Speaker]): The speakers that may narrate.
+        openai_limiter (ProviderLimiter): The rate limiter all requests to the OpenAI API go through.
+        local_limiter (ProviderLimiter): The rate limiter all requests to the local endpoint go through.
+        default_generation_provider (str): The generation provider of the history summaries.
+
+    Returns:
+        SpeakerGeneration: The generation provider of the narration.
+    """
+    from openai import AsyncOpenAI
+    from .providers import OpenAIGeneration, SpeakerGeneration
+    from .ratelimit import rate_limited_http_client
+    names = {SPEAKER_TO_GENERATION_PROVIDER[speaker] for speaker in speakers} | {default_generation_provider}
+    providers = {}
+    if "openai" in names:
+        # The limiter's transport retries rate-limited requests and the request policy retries the rest.
+        client = AsyncOpenAI(api_key=settings.openai_api_key, max_retries=0,
+                             http_client=rate_limited_http_client(openai_limiter))
+        providers["openai"] = OpenAIGeneration(client, DEFAULT_VISION_MODEL, SPEAKER_TO_MODEL)
+    if "local" in names:
+        # Local servers usually ignore the API key, but the client requires one.
+        client = AsyncOpenAI(api_key=settings.local_llm_api_key or "local", base_url=settings.local_llm_url,
+                             max_retries=0, http_client=rate_limited_http_client(local_limiter))
+        providers["local"] = OpenAIGeneration(client, settings.local_vision_model, SPEAKER_TO_MODEL)
+    return SpeakerGeneration({speaker: providers[SPEAKER_TO_GENERATION_PROVIDER[speaker]] for speaker in speakers},
+                             providers[default_generation_provider])
+
+def speech_provider(speakers: List[Speaker], tts_max_connections: int, tts_timeout: float,
+                    tts_cache: TTSCache = None, tts_limiter: "ProviderLimiter" = None) -> "SpeakerSpeech":
+    """
+    Create the speech providers the given speakers use and route every speaker to its provider.
+
+    Args:
+        speakers (List[Speaker]): The speakers that may narrate.
+        tts_max_connections (int): The maximum number of pooled connections to the ElevenLabs API.
+        tts_timeout (float): The total timeout of a single ElevenLabs request in seconds.
+        tts_cache (TTSCache): The on-disk cache of synthesized utterances, or None to disable caching.
+        tts_limiter (ProviderLimiter): The rate limiter of the ElevenLabs requests.
+
+    Returns:
+        SpeakerSpeech: The speech provider of the narration.
+    """
+    from .providers import SpeakerSpeech
+    providers = {}
+    for name in {SPEAKER_TO_SPEECH_PROVIDER[speaker] for speaker in speakers}:
+        if name == "elevenlabs":
+            options = dict(api_key=settings.elevenlabs_api_key, max_connections=tts_max_connections,
+                           timeout=tts_timeout, cache=tts_cache, limiter=tts_limiter)
+        else:
+            options = dict(voices=SPEAKER_TO_LOCAL_VOICE, cache=tts_cache)
+        providers[name] = create_speech_provider(name, **options)
+    return SpeakerSpeech({speaker: providers[SPEAKER_TO_SPEECH_PROVIDER[speaker]] for speaker in speakers})
 
-async def async_main(client: AsyncOpenAI, disable_subtitles: bool, selected_speakers: List[Speaker], tts_model_id: str,
+async def async_main(client: "SpeakerGeneration", disable_subtitles: bool, selected_speakers: List[Speaker], tts_model_id: str,
                      disable_override_next_speaker: bool, subtitles_text_color: str = None, subtitles_font_size: int = None,
                      subtitles_font: str = None, subtitles_shadow_color: str = None, subtitles_shadow_offset_x: float = None,
                      subtitles_shadow_offset_y: float = None, subtitles_shadow_blur_radius: int = None, subtitles_shadow_alpha: float = None,
-                     subtitles_font_alpha: float = None):
+                     subtitles_font_alpha: float = None, stream_tts: bool = False, tts_max_connections: int = 4,
+                     tts_timeout: float = 60.0, image_options: ImageOptions = None, loop_lag_threshold: float = None,
+                     scene_change_threshold: float = None, unchanged_scene_mode: str = "low",
+                     history_token_budget: int = 1500, history_turns: int = 6, summary_model: str = "gpt-3.5-turbo",
+                     speculative: bool = False, lookahead: int = 1, drain_on_exit: bool = False,
+                     request_policy: RequestPolicy = None, stream_reactions: bool = False,
+                     tts_cache: TTSCache = None, tracer: Tracer = None, metrics_port: int = None,
+                     tts_limiter: "ProviderLimiter" = None, crossfade_ms: int = 0,
+                     subtitles_backend: str = DEFAULT_SUBTITLE_BACKEND, subtitles_file: str = None,
+                     cadence: CadenceController = None):
     """
     The main asynchronous function that orchestrates the narration process.
 
@@ -40,7 +157,42 @@ async def async_main(client: AsyncOpenAI, disable_subtitles: bool, selected_spea
         subtitles_shadow_blur_radius (int): The blur radius of the subtitle shadow. Defaults to the overlay's default value.
         subtitles_shadow_alpha (float): The alpha value of the subtitle shadow. Defaults to the overlay's default value.
         subtitles_font_alpha (float): The alpha value of the subtitle font. Defaults to the overlay's default value.
+        stream_tts (bool): Whether to stream TTS audio into playback as it arrives instead of waiting for the whole clip.
+        tts_max_connections (int): The maximum number of pooled connections to the ElevenLabs API.
+        tts_timeout (float): The total timeout of a single ElevenLabs request in seconds.
+        image_options (ImageOptions): How captured images are resized and encoded. Defaults to ImageOptions().
+        loop_lag_threshold (float): If set, measure event loop lag and report stalls longer than this many seconds.
+        scene_change_threshold (float): If set, the fraction of perceptual hash bits that must differ for an image
+            to count as changed. Unchanged images are not re-encoded and are sent according to unchanged_scene_mode.
+        unchanged_scene_mode (str): "low" to resend unchanged images at low detail, "text" to leave them out.
+        history_token_budget (int): The number of history tokens above which older turns are summarized.
+        history_turns (int): The number of most recent turns that are always sent verbatim.
+        summary_model (str): The model that summarizes older turns.
+        speculative (bool): Whether to request the next reaction from every speaker who may follow while the current
+            reaction is still being generated, keeping the one who does.
+        lookahead (int): The number of utterances that may be generated and synthesized ahead of playback.
+        drain_on_exit (bool): Whether to play the utterances already generated before exiting.
+        request_policy (RequestPolicy): The deadline, retry and hedging policy of the reaction requests.
+        stream_reactions (bool): Whether to stream reactions and synthesize every sentence as soon as it is complete.
+        tts_cache (TTSCache): The on-disk cache of synthesized utterances, or None to disable caching.
+        tracer (Tracer): The tracer that records the latency of the narration stages, or None to disable metrics.
+        metrics_port (int): The port to serve Prometheus metrics on, or None to not serve them.
+        tts_limiter (ProviderLimiter): The rate limiter of the ElevenLabs requests.
+        crossfade_ms (int): The length of the crossfade between consecutive utterances in milliseconds, or 0 for none.
+        subtitles_backend (str): The name of the registered subtitle backend.
+        subtitles_file (str): The file the srt subtitle backend writes to, or None for its default.
+        cadence (CadenceController): Paces the turns to the scene activity and the usage budgets, or None to run
+            turns back to back.
     """
+    from pygame import mixer
+    from .audio import PCM_SAMPLE_RATE
+    from .image import CameraService
+    from .scene import SceneChangeDetector
+    from .monitor import LoopLagMonitor
+    from .history import ConversationHistory
+    from .pipeline import NarrationPipeline
+    from .playback import PlaybackEngine
+
     subtitle_kwargs = {}
     if subtitles_text_color is not None:
         subtitle_kwargs['text_color'] = subtitles_text_color
@@ -58,59 +210,72 @@ async def async_main(client: AsyncOpenAI, disable_subtitles: bool, selected_spea
         subtitle_kwargs['shadow_alpha'] = subtitles_shadow_alpha
     if subtitles_font_alpha is not None:
         subtitle_kwargs['font_alpha'] = subtitles_font_alpha
+    if image_options is None:
+        image_options = ImageOptions()
+    mixer.init(frequency=PCM_SAMPLE_RATE, size=-16, channels=1)
+    playback = PlaybackEngine(crossfade_ms)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    history = ConversationHistory(client, history_token_budget, history_turns, summary_model)
+    scene_detector = None
+    if scene_change_threshold is not None:
+        scene_detector = SceneChangeDetector(scene_change_threshold, unchanged_scene_mode)
+    elif cadence:
+        # The cadence follows the scene activity, so the scene is hashed even without a threshold,
+        # but every image is still sent.
+        scene_detector = SceneChangeDetector(None, unchanged_scene_mode)
+    if tracer:
+        set_tracer(tracer)
+        if metrics_port:
+            await tracer.serve(metrics_port)
+    loop_lag_monitor = None
+    if loop_lag_threshold is not None:
+        loop_lag_monitor = LoopLagMonitor(loop_lag_threshold)
+        loop_lag_monitor.start()
+    subtitle_overlay = None
     if not disable_subtitles:
-        subtitle_overlay = SubtitleOverlay()
-    history = []
-    play_time = time.time()
-    speaker = random.choice(selected_speakers)
+        subtitle_options = {"path": subtitles_file} if subtitles_backend == "srt" and subtitles_file else {}
+        subtitle_overlay = create_subtitle_backend(subtitles_backend, **subtitle_options)
+    try:
+        with CameraService() as camera:
+            async with speech_provider(selected_speakers, tts_max_connections, tts_timeout, tts_cache, tts_limiter) as tts_client:
+                pipeline = NarrationPipeline(
+                    client, tts_client, camera, history, selected_speakers, tts_model_id,
+                    override_next_speaker=not disable_override_next_speaker,
+                    subtitle_overlay=subtitle_overlay,
+                    subtitle_kwargs=subtitle_kwargs,
+                    stream_tts=stream_tts,
+                    image_options=image_options,
+                    scene_detector=scene_detector,
+                    speculative=speculative,
+                    lookahead=lookahead,
+                    drain_on_stop=drain_on_exit,
+                    request_policy=request_policy,
+                    stream_reactions=stream_reactions,
+                    playback=playback,
+                    cadence=cadence,
+                )
+                await pipeline.run()
+    finally:
+        playback.stop()
+        if cadence:
+            print(cadence.summary(loop.time() - started))
+        if subtitle_overlay:
+            subtitle_overlay.dispose()
+        if loop_lag_monitor:
+            loop_lag_monitor.stop()
+            print(loop_lag_monitor.summary())
+        if tts_cache:
+            print(tts_cache.summary())
+        if tracer:
+            print(tracer.summary())
+            await tracer.close()
 
-    mixer.init()
-    
-    if not disable_subtitles:
-        subtitle_overlay.clearSubtitle()
-        subtitle_overlay.setSubtitle("(Will take Screenshot and webcam image in a second.)", text_color="red")
-        await asyncio.sleep(1)
-        subtitle_overlay.clearSubtitle()
-    screen = await capture_screen()
-    cam = await capture_cam()
-    react_promise = asyncio.create_task(react(speaker, cam, screen, history, selected_speakers, client))
-    current_subtitle = None
-
-    while True:
-        speaker_name, reaction = await react_promise
-        next_subtitle = f"{speaker.value}: {reaction}"
-        print(next_subtitle)
-        history.append(f"[{speaker_name}:] {reaction}")
-        output_promise = asyncio.create_task(tts_output(speaker, reaction, tts_model_id, settings.elevenlabs_api_key))
-        speaker = get_next_speaker(speaker, reaction, selected_speakers, not disable_override_next_speaker)
-
-
-        if not disable_subtitles:
-            subtitle_overlay.clearSubtitle()
-            subtitle_overlay.setSubtitle("(Will take Screenshot and webcam image in a second.)", text_color="red")
-            await asyncio.sleep(1)
-            subtitle_overlay.clearSubtitle()
-        screen = await capture_screen()
-        if not disable_subtitles and current_subtitle:
-            subtitle_overlay.setSubtitle(current_subtitle, **subtitle_kwargs)
-        
-        cam = await capture_cam()
-        react_promise = asyncio.create_task(react(speaker, cam, screen, history, selected_speakers, client))
-
-        if play_time > time.time():
-            await asyncio.sleep(play_time - time.time())
-
-        output_audio_buffer = await output_promise
-        mixer.music.load(output_audio_buffer)
-        if not disable_subtitles and next_subtitle:
-            current_subtitle = next_subtitle
-            subtitle_overlay.setSubtitle(current_subtitle, **subtitle_kwargs)
-
-        mixer.music.play()
-        play_time = time.time() + get_audio_duration(output_audio_buffer)
-
-@click.command()
+@click.group(invoke_without_command=True)
+@click.pass_context
 @click.option("--disable-subtitles", is_flag=True, help="Disable subtitle overlays.")
+@click.option("--subtitles-backend", type=click.Choice(subtitle_backends()), default=DEFAULT_SUBTITLE_BACKEND, show_default=True, help="Set how subtitles are displayed: an overlay window on macOS, the terminal, or an SRT file.")
+@click.option("--subtitles-file", type=click.Path(dir_okay=False), default=None, help="Set the file the srt subtitle backend writes to (default: subtitles.srt).")
 @click.option("--disable-adorno", is_flag=True, help="Exclude Theodor W. Adorno from the narration.")
 @click.option("--disable-herzog", is_flag=True, help="Exclude Werner Herzog from the narration.")
 @click.option("--disable-zizek", is_flag=True, help="Exclude Slavoj Žižek from the narration.")
@@ -130,24 +295,77 @@ async def async_main(client: AsyncOpenAI, disable_subtitles: bool, selected_spea
 @click.option("--zizek-voice-id", default=None, help="Set the voice ID for Slavoj Žižek.")
 @click.option("--openai-api-key", default=None, help="Set the OpenAI API key.")
 @click.option("--elevenlabs-api-key", default=None, help="Set the ElevenLabs API key.")
-def main(disable_subtitles: bool, disable_adorno: bool, disable_herzog: bool, disable_zizek: bool, tts_model_id: str,
+@click.option("--generation-provider", "generation_provider_name", type=click.Choice(GENERATION_PROVIDERS), default=DEFAULT_GENERATION_PROVIDER, show_default=True, help="Generate the reactions with the OpenAI API or an OpenAI-compatible local endpoint (see --local-llm-url).")
+@click.option("--speech-provider", "speech_provider_name", type=click.Choice(speech_providers()), default=DEFAULT_SPEECH_PROVIDER, show_default=True, help="Synthesize the speech with ElevenLabs or with local Piper voices (see --herzog-local-voice).")
+@click.option("--speaker-generation-provider", multiple=True, metavar="SPEAKER=PROVIDER", help="Use another generation provider for one speaker, e.g. herzog=local. Repeatable.")
+@click.option("--speaker-speech-provider", multiple=True, metavar="SPEAKER=PROVIDER", help="Use another speech provider for one speaker, e.g. zizek=piper. Repeatable.")
+@click.option("--speaker-model", multiple=True, metavar="SPEAKER=MODEL", help="Use another vision model for one speaker, e.g. adorno=llava:13b. Repeatable.")
+@click.option("--local-llm-url", default=None, help="Set the base URL of the OpenAI-compatible endpoint of the local generation provider (default: http://localhost:8080/v1).")
+@click.option("--local-vision-model", default=None, help="Set the vision model of the local generation provider (default: llava).")
+@click.option("--herzog-local-voice", type=click.Path(exists=True, dir_okay=False), default=None, help="Set the Piper voice model (.onnx) for Werner Herzog.")
+@click.option("--adorno-local-voice", type=click.Path(exists=True, dir_okay=False), default=None, help="Set the Piper voice model (.onnx) for Theodor W. Adorno.")
+@click.option("--zizek-local-voice", type=click.Path(exists=True, dir_okay=False), default=None, help="Set the Piper voice model (.onnx) for Slavoj Žižek.")
+@click.option("--stream-tts", is_flag=True, help="Stream TTS audio and start playback as soon as the first bytes arrive.")
+@click.option("--crossfade-ms", type=click.IntRange(0, 500), default=0, help="Crossfade consecutive utterances by this many milliseconds instead of playing them back to back.")
+@click.option("--tts-max-connections", type=click.IntRange(1), default=4, help="Set the maximum number of pooled connections to the ElevenLabs API.")
+@click.option("--tts-cache-dir", default=DEFAULT_CACHE_DIR, show_default=True, help="Set the directory of the on-disk TTS cache.")
+@click.option("--tts-cache-size", type=float, default=256.0, help="Set the maximum size of the TTS cache in MB, or 0 to disable it.")
+@click.option("--tts-rpm", type=float, default=None, help="Limit the ElevenLabs requests per minute.")
+@click.option("--openai-rpm", type=float, default=None, help="Limit the OpenAI requests per minute. The limit reported by the API is always respected.")
+@click.option("--openai-max-concurrency", type=click.IntRange(1), default=8, help="Set the maximum number of concurrent OpenAI requests; lowered automatically when rate limited.")
+@click.option("--tts-timeout", type=float, default=60.0, help="Set the timeout of a single ElevenLabs request in seconds.")
+@click.option("--image-max-dimension", type=click.IntRange(64), default=2048, help="Set the maximum width or height of images sent to the vision model (at least 64).")
+@click.option("--image-format", type=click.Choice(["JPEG", "WEBP", "PNG"], case_sensitive=False), default="JPEG", help="Set the codec of images sent to the vision model.")
+@click.option("--image-quality", type=click.IntRange(1, 100), default=80, help="Set the JPEG or WebP quality of images sent to the vision model.")
+@click.option("--composite-image", is_flag=True, help="Send one image per turn: the screen with the webcam inset in its bottom-right corner.")
+@click.option("--pip-size", type=click.FloatRange(0.1, 0.5), default=0.3, help="Set the width of the webcam inset of --composite-image as a fraction of the screen width.")
+@click.option("--scene-change-threshold", type=click.FloatRange(0.0, 1.0), default=None, help="Only resend images whose perceptual hash differs by more than this fraction of bits.")
+@click.option("--unchanged-scene", "unchanged_scene_mode", type=click.Choice(["low", "text"]), default="low", help="Resend unchanged images at low detail or leave them out.")
+@click.option("--history-token-budget", type=click.IntRange(1), default=1500, help="Summarize older narration once the history exceeds this many tokens.")
+@click.option("--history-turns", type=click.IntRange(0), default=6, help="Set the number of most recent turns that are always sent verbatim.")
+@click.option("--summary-model", default=None, help="Set the model that summarizes older narration (default: gpt-3.5-turbo, or the local vision model with --generation-provider local).")
+@click.option("--speculative", is_flag=True, help="Capture the next images while the current reaction is generated and request a reaction to them from every speaker who may follow, cancelling all but the one who does.")
+@click.option("--lookahead", type=click.IntRange(1, 5), default=1, help="Set how many utterances may be generated and synthesized ahead of playback.")
+@click.option("--drain-on-exit", is_flag=True, help="Finish playing the utterances already generated when stopped with Ctrl+C.")
+@click.option("--stream-reactions", is_flag=True, help="Stream reactions and synthesize every sentence as soon as it is complete.")
+@click.option("--request-deadline", type=float, default=30.0, help="Set the time budget in seconds for generating one reaction, including retries.")
+@click.option("--request-retries", type=int, default=2, help="Set the maximum number of retries of a failed or refused reaction request.")
+@click.option("--adaptive-cadence", is_flag=True, help="Pace the turns to the activity on screen: slow down while the scene is idle and speed up when it is busy.")
+@click.option("--prompt-tokens-per-minute", type=click.IntRange(1), default=None, help="Keep the OpenAI prompt tokens within this budget per minute. Implies --adaptive-cadence.")
+@click.option("--tts-chars-per-minute", type=click.IntRange(1), default=None, help="Keep the characters sent to ElevenLabs within this budget per minute. Implies --adaptive-cadence.")
+@click.option("--min-turn-interval", type=click.FloatRange(0), default=0.0, help="Set the minimum time in seconds between the starts of two turns with --adaptive-cadence.")
+@click.option("--max-turn-interval", type=click.FloatRange(0), default=60.0, help="Set the maximum time in seconds between two turns while the scene is idle with --adaptive-cadence.")
+@click.option("--disable-hedging", is_flag=True, help="Do not send a duplicate of reaction requests that are slower than usual.")
+@click.option("--metrics", is_flag=True, help="Record the latency of every narration stage and print percentiles on exit.")
+@click.option("--metrics-jsonl", type=click.Path(dir_okay=False), default=None, help="Append every recorded span to this JSONL file. Implies --metrics.")
+@click.option("--metrics-port", type=int, default=None, help="Serve the latency metrics in the Prometheus text format on this port. Implies --metrics.")
+@click.option("--loop-lag-threshold", type=float, default=None, help="Measure event loop lag and report stalls longer than this many seconds.")
+def main(ctx: click.Context, disable_subtitles: bool, subtitles_backend: str, subtitles_file: str, disable_adorno: bool, disable_herzog: bool, disable_zizek: bool, tts_model_id: str,
          disable_override_next_speaker: bool, subtitles_text_color: str, subtitles_font_size: int, subtitles_font: str,
          subtitles_shadow_color: str, subtitles_shadow_offset_x: float, subtitles_shadow_offset_y: float,
          subtitles_shadow_blur_radius: int, subtitles_shadow_alpha: float, subtitles_font_alpha: float,
-         herzog_voice_id: str, adorno_voice_id: str, zizek_voice_id: str, openai_api_key: str, elevenlabs_api_key: str):
+         herzog_voice_id: str, adorno_voice_id: str, zizek_voice_id: str, openai_api_key: str, elevenlabs_api_key: str,
+         generation_provider_name: str, speech_provider_name: str, speaker_generation_provider: Tuple[str, ...],
+         speaker_speech_provider: Tuple[str, ...], speaker_model: Tuple[str, ...], local_llm_url: str,
+         local_vision_model: str, herzog_local_voice: str, adorno_local_voice: str, zizek_local_voice: str, stream_tts: bool,
+         crossfade_ms: int, tts_max_connections: int, tts_cache_dir: str, tts_cache_size: float, tts_rpm: float,
+         openai_rpm: float, openai_max_concurrency: int, tts_timeout: float, image_max_dimension: int, image_format: str, image_quality: int,
+         composite_image: bool, pip_size: float,
+         scene_change_threshold: float, unchanged_scene_mode: str, history_token_budget: int, history_turns: int,
+         summary_model: str, speculative: bool, lookahead: int, drain_on_exit: bool, stream_reactions: bool,
+         request_deadline: float, request_retries: int, adaptive_cadence: bool, prompt_tokens_per_minute: int,
+         tts_chars_per_minute: int, min_turn_interval: float, max_turn_interval: float, disable_hedging: bool, metrics: bool,
+         metrics_jsonl: str, metrics_port: int, loop_lag_threshold: float):
     """
     The main function that sets up the narration process based on the provided CLI options.
+
+    Without a subcommand, narrates the live screen and webcam. The options also apply to subcommands.
     """
     if openai_api_key:
         settings.openai_api_key = openai_api_key
     if elevenlabs_api_key:
         settings.elevenlabs_api_key = elevenlabs_api_key
 
-    if not settings.openai_api_key:
-        raise click.UsageError("OpenAI API key is missing. Please provide it using --openai-api-key, provide it as an environment variable, or set it in the .env file.")
-    if not settings.elevenlabs_api_key:
-        raise click.UsageError("ElevenLabs API key is missing. Please provide it using --elevenlabs-api-key, provide it as an environment variable, or set it in the .env file.")
-
     selected_speakers = [Speaker.ADORNO, Speaker.HERZOG, Speaker.ZIZEK]
     if disable_adorno:
         selected_speakers.remove(Speaker.ADORNO)
@@ -165,13 +383,178 @@ def main(disable_subtitles: bool, disable_adorno: bool, disable_herzog: bool, di
         SPEAKER_TO_VOICE_ID[Speaker.ADORNO] = adorno_voice_id
     if zizek_voice_id:
         SPEAKER_TO_VOICE_ID[Speaker.ZIZEK] = zizek_voice_id
+    if herzog_local_voice:
+        SPEAKER_TO_LOCAL_VOICE[Speaker.HERZOG] = herzog_local_voice
+    if adorno_local_voice:
+        SPEAKER_TO_LOCAL_VOICE[Speaker.ADORNO] = adorno_local_voice
+    if zizek_local_voice:
+        SPEAKER_TO_LOCAL_VOICE[Speaker.ZIZEK] = zizek_local_voice
+    if local_llm_url:
+        settings.local_llm_url = local_llm_url
+    if local_vision_model:
+        settings.local_vision_model = local_vision_model
 
-    client = AsyncOpenAI(api_key=settings.openai_api_key)
+    SPEAKER_TO_GENERATION_PROVIDER.update(dict.fromkeys(Speaker, generation_provider_name))
+    SPEAKER_TO_SPEECH_PROVIDER.update(dict.fromkeys(Speaker, speech_provider_name))
+    for speaker, name in speaker_options(speaker_generation_provider, "--speaker-generation-provider").items():
+        if name not in GENERATION_PROVIDERS:
+            raise click.BadParameter(f"Unknown generation provider {name!r}, choose from {', '.join(GENERATION_PROVIDERS)}.", param_hint="--speaker-generation-provider")
+        SPEAKER_TO_GENERATION_PROVIDER[speaker] = name
+    for speaker, name in speaker_options(speaker_speech_provider, "--speaker-speech-provider").items():
+        if name not in speech_providers():
+            raise click.BadParameter(f"Unknown speech provider {name!r}, choose from {', '.join(speech_providers())}.", param_hint="--speaker-speech-provider")
+        SPEAKER_TO_SPEECH_PROVIDER[speaker] = name
+    SPEAKER_TO_MODEL.update(speaker_options(speaker_model, "--speaker-model"))
+    if summary_model is None:
+        summary_model = "gpt-3.5-turbo" if generation_provider_name == "openai" else settings.local_vision_model
 
+    image_options = ImageOptions(max_dimension=image_max_dimension, format=image_format.upper(), quality=image_quality,
+                                 composite=composite_image, pip_fraction=pip_size)
+    request_policy = RequestPolicy(deadline=request_deadline, max_retries=request_retries, hedge=not disable_hedging)
+    cadence = None
+    if adaptive_cadence or prompt_tokens_per_minute or tts_chars_per_minute:
+        cadence = CadenceController(prompt_tokens_per_minute, tts_chars_per_minute, min_turn_interval, max_turn_interval)
+    tracer = Tracer(metrics_jsonl) if metrics or metrics_jsonl or metrics_port else None
+    tts_cache = TTSCache(tts_cache_dir, int(tts_cache_size * 1024 * 1024)) if tts_cache_size > 0 else None
+
+    from .ratelimit import ProviderLimiter
+    openai_limiter = ProviderLimiter("OpenAI", openai_rpm / 60 if openai_rpm else None, max_concurrency=openai_max_concurrency)
+    tts_limiter = ProviderLimiter("ElevenLabs", tts_rpm / 60 if tts_rpm else None, max_concurrency=tts_max_connections)
+    local_limiter = ProviderLimiter("Local model", max_concurrency=openai_max_concurrency)
+
+    if ctx.invoked_subcommand is not None:
+        ctx.obj = dict(openai_limiter=openai_limiter, local_limiter=local_limiter, generation_provider=generation_provider_name,
+                       tts_limiter=tts_limiter, selected_speakers=selected_speakers, tts_model_id=tts_model_id,
+                       override_next_speaker=not disable_override_next_speaker, image_options=image_options,
+                       request_policy=request_policy, history_token_budget=history_token_budget,
+                       history_turns=history_turns, summary_model=summary_model, tts_max_connections=tts_max_connections,
+                       tts_timeout=tts_timeout, tts_cache=tts_cache, tracer=tracer)
+        return
+
+    if not disable_subtitles:
+        try:
+            load_subtitle_backend(subtitles_backend)
+        except ImportError as e:
+            raise click.UsageError(f"The {subtitles_backend} subtitle backend is not available ({e}). Install its dependencies or use --disable-subtitles.")
+    check_providers(selected_speakers, generation_provider_name)
+    client = generation_provider(selected_speakers, openai_limiter, local_limiter, generation_provider_name)
     asyncio.run(async_main(client, disable_subtitles, selected_speakers, tts_model_id, disable_override_next_speaker,
                            subtitles_text_color, subtitles_font_size, subtitles_font, subtitles_shadow_color,
                            subtitles_shadow_offset_x, subtitles_shadow_offset_y, subtitles_shadow_blur_radius,
-                           subtitles_shadow_alpha, subtitles_font_alpha))
+                           subtitles_shadow_alpha, subtitles_font_alpha, stream_tts, tts_max_connections, tts_timeout,
+                           image_options, loop_lag_threshold, scene_change_threshold, unchanged_scene_mode,
+                           history_token_budget, history_turns, summary_model, speculative, lookahead, drain_on_exit,
+                           request_policy, stream_reactions, tts_cache, tracer, metrics_port, tts_limiter,
+                           crossfade_ms, subtitles_backend, subtitles_file, cadence))
+
+async def async_batch(client: "SpeakerGeneration", sessions: List[str], output_dir: str, workers: int, interval: float,
+                      audio_format: str, selected_speakers: List[Speaker], tts_model_id: str, override_next_speaker: bool,
+                      image_options: ImageOptions, request_policy: RequestPolicy, history_token_budget: int,
+                      history_turns: int, summary_model: str, tts_max_connections: int, tts_timeout: float,
+                      tts_cache: TTSCache = None, tracer: Tracer = None, tts_limiter: "ProviderLimiter" = None):
+    """
+    Narrate recorded sessions offline. See `BatchNarrator` for the arguments.
+    """
+    from .batch import BatchNarrator
+    if tracer:
+        set_tracer(tracer)
+    try:
+        async with speech_provider(selected_speakers, tts_max_connections, tts_timeout, tts_cache, tts_limiter) as tts_client:
+            narrator = BatchNarrator(
+                client, tts_client, selected_speakers, tts_model_id, output_dir,
+                workers=workers,
+                interval=interval,
+                audio_format=audio_format,
+                override_next_speaker=override_next_speaker,
+                image_options=image_options,
+                request_policy=request_policy,
+                history_token_budget=history_token_budget,
+                history_turns=history_turns,
+                summary_model=summary_model,
+            )
+            await narrator.run(sessions)
+    finally:
+        if tts_cache:
+            print(tts_cache.summary())
+        if tracer:
+            print(tracer.summary())
+            await tracer.close()
+
+@main.command()
+@click.argument("sessions", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--output-dir", type=click.Path(file_okay=False), default="narration", show_default=True, help="Set the directory the audio and subtitle files are written to.")
+@click.option("--workers", type=click.IntRange(1), default=4, help="Set the maximum number of reaction requests in flight across all sessions.")
+@click.option("--interval", type=click.FloatRange(0, min_open=True), default=20.0, help="Set the time in seconds between narrated frames (and between frame pairs of a directory).")
+@click.option("--audio-format", type=click.Choice(["mp3", "wav"]), default="mp3", help="Set the format of the narration audio. MP3 requires pydub and ffmpeg.")
+@click.pass_obj
+def batch(obj: dict, sessions: List[str], output_dir: str, workers: int, interval: float, audio_format: str):
+    """
+    Narrate recorded sessions offline into an audio file and an SRT subtitle file each.
+
+    Every session is a directory of screen*/cam* frame pairs or a screen recording video
+    (with an optional <name>_cam video of the webcam next to it).
+    """
+    from .batch import mp3_supported
+    if audio_format == "mp3" and not mp3_supported():
+        raise click.UsageError("MP3 output requires pydub. Install it with `pip install narrator[batch]` or use --audio-format wav.")
+    check_providers(obj["selected_speakers"], obj["generation_provider"])
+    client = generation_provider(obj["selected_speakers"], obj.pop("openai_limiter"), obj.pop("local_limiter"),
+                                 obj.pop("generation_provider"))
+    asyncio.run(async_batch(client, list(sessions), output_dir, workers, interval, audio_format, **obj))
+
+async def async_serve(client: "SpeakerGeneration", host: str, port: int, max_sessions: int, max_concurrent_requests: int,
+                      selected_speakers: List[Speaker], tts_model_id: str, override_next_speaker: bool,
+                      image_options: ImageOptions, request_policy: RequestPolicy, history_token_budget: int,
+                      history_turns: int, summary_model: str, tts_max_connections: int, tts_timeout: float,
+                      tts_cache: TTSCache = None, tracer: Tracer = None, tts_limiter: "ProviderLimiter" = None):
+    """
+    Serve narration sessions over WebSocket. See `NarrationServer` for the arguments.
+    """
+    from .server import NarrationServer
+    if tracer:
+        set_tracer(tracer)
+    try:
+        # Sessions may select any speaker, so all of them need their providers.
+        async with speech_provider(list(Speaker), tts_max_connections, tts_timeout, tts_cache, tts_limiter) as tts_client:
+            server = NarrationServer(
+                client, tts_client, selected_speakers, tts_model_id,
+                max_sessions=max_sessions,
+                max_concurrent_requests=max_concurrent_requests,
+                override_next_speaker=override_next_speaker,
+                image_options=image_options,
+                request_policy=request_policy,
+                history_token_budget=history_token_budget,
+                history_turns=history_turns,
+                summary_model=summary_model,
+            )
+            await server.serve(host, port)
+    finally:
+        if tts_cache:
+            print(tts_cache.summary())
+        if tracer:
+            print(tracer.summary())
+            await tracer.close()
+
+@main.command()
+@click.option("--host", default="127.0.0.1", show_default=True, help="Set the address to listen on.")
+@click.option("--port", type=int, default=8765, show_default=True, help="Set the port to listen on.")
+@click.option("--max-sessions", type=click.IntRange(1), default=32, help="Set the maximum number of concurrent sessions.")
+@click.option("--max-concurrent-requests", type=click.IntRange(1), default=8, help="Set the maximum number of OpenAI and TTS requests in flight across all sessions.")
+@click.pass_obj
+def serve(obj: dict, host: str, port: int, max_sessions: int, max_concurrent_requests: int):
+    """
+    Serve narration sessions to many clients over WebSocket.
+
+    Clients upload frames and receive subtitle and audio events; see `NarrationServer` for the protocol.
+    """
+    # Sessions may select any speaker, so all of them need their providers.
+    check_providers(list(Speaker), obj["generation_provider"])
+    client = generation_provider(list(Speaker), obj.pop("openai_limiter"), obj.pop("local_limiter"),
+                                 obj.pop("generation_provider"))
+    try:
+        asyncio.run(async_serve(client, host, port, max_sessions, max_concurrent_requests, **obj))
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
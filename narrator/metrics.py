@@ -0,0 +1,218 @@
+import json
+import time
+import contextlib
+import contextvars
+import collections
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_tags = contextvars.ContextVar("narrator_span_tags", default={})
+
+def quantile(values: List[float], q: float) -> float:
+    """
+    Get a quantile of a list of values by linear interpolation between the closest ranks.
+
+    Args:
+        values (List[float]): The values, in any order.
+        q (float): The quantile between 0 and 1.
+
+    Returns:
+        float: The quantile, or 0.0 if there are no values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+class NullTracer:
+    """
+    The tracer used while metrics are off. Its spans do nothing, so instrumented code costs next to nothing.
+    """
+
+    enabled = False
+
+    def span(self, name: str, **tags):
+        return contextlib.nullcontext()
+
+    def tagged(self, **tags):
+        return contextlib.nullcontext()
+
+    def count(self, name: str, amount: float = 1):
+        pass
+
+    async def close(self):
+        pass
+
+class Tracer:
+    """
+    Records timing spans of the narration stages, tagged with the speaker and turn they belong to.
+
+    Every span is appended to a JSONL file if one is given, and kept in a window of recent
+    durations per span name for the p50/p95/p99 summary and the Prometheus text endpoint.
+    """
+
+    enabled = True
+
+    def __init__(self, jsonl_path: Optional[str] = None, window: int = 1000):
+        self._window = window
+        self._durations: Dict[str, collections.deque] = {}
+        self._sums: Dict[str, float] = collections.defaultdict(float)
+        self._counts: Dict[str, int] = collections.defaultdict(int)
+        self._counters: Dict[str, float] = collections.defaultdict(float)
+        self._jsonl = open(jsonl_path, "a", buffering=1) if jsonl_path else None
+        self._runner = None
+
+    @contextlib.contextmanager
+    def span(self, name: str, **tags):
+        """
+        Time the enclosed block as a span.
+
+        Args:
+            name (str): The name of the span, e.g. "tts_download".
+            **tags: Tags in addition to the ones set with `tagged`.
+        """
+        start, started_at = time.perf_counter(), time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, started_at, {**_tags.get(), **tags})
+
+    @contextlib.contextmanager
+    def tagged(self, **tags):
+        """
+        Tag all spans recorded in the enclosed block, including spans in tasks created within it.
+        """
+        token = _tags.set({**_tags.get(), **tags})
+        try:
+            yield
+        finally:
+            _tags.reset(token)
+
+    def record(self, name: str, duration: float, started_at: float, tags: dict):
+        """
+        Record a finished span.
+        """
+        if name not in self._durations:
+            self._durations[name] = collections.deque(maxlen=self._window)
+        self._durations[name].append(duration)
+        self._sums[name] += duration
+        self._counts[name] += 1
+        if self._jsonl:
+            self._jsonl.write(json.dumps({"span": name, "start": started_at, "duration": duration, **tags}) + "\n")
+
+    def count(self, name: str, amount: float = 1):
+        """
+        Add to a counter, e.g. of the prompt tokens sent.
+        """
+        self._counters[name] += amount
+
+    def counters(self) -> Dict[str, float]:
+        """
+        Get the totals of all counters.
+        """
+        return dict(self._counters)
+
+    def quantiles(self) -> Dict[str, Dict[float, float]]:
+        """
+        Get the p50/p95/p99 durations of the recent spans per span name.
+        """
+        return {name: {q: quantile(list(durations), q) for q in QUANTILES}
+                for name, durations in self._durations.items()}
+
+    def summary(self) -> str:
+        """
+        Describe the span durations as a table with one row per span name.
+        """
+        lines = [f"{'span':<22}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}"]
+        for name, values in sorted(self.quantiles().items()):
+            lines.append(f"{name:<22}{self._counts[name]:>7}"
+                         + "".join(f"{values[q] * 1000:>8.0f}ms" for q in QUANTILES))
+        if self._counters:
+            lines.append(f"{'counter':<22}{'total':>17}")
+            for name, total in sorted(self._counters.items()):
+                lines.append(f"{name:<22}{total:>17.0f}")
+        return "\n".join(lines)
+
+    def prometheus_text(self) -> str:
+        """
+        Render the span durations in the Prometheus text exposition format.
+        """
+        lines = ["# HELP narrator_span_seconds Duration of the narration stages.",
+                 "# TYPE narrator_span_seconds summary"]
+        for name, values in sorted(self.quantiles().items()):
+            for q, value in values.items():
+                lines.append(f'narrator_span_seconds{{span="{name}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'narrator_span_seconds_sum{{span="{name}"}} {self._sums[name]:.6f}')
+            lines.append(f'narrator_span_seconds_count{{span="{name}"}} {self._counts[name]}')
+        for name, total in sorted(self._counters.items()):
+            lines.append(f"# TYPE narrator_{name}_total counter")
+            lines.append(f"narrator_{name}_total {total:g}")
+        return "\n".join(lines) + "\n"
+
+    async def _handle_metrics(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+        return web.Response(text=self.prometheus_text(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def serve(self, port: int, host: str = "127.0.0.1"):
+        """
+        Serve the Prometheus text format at /metrics.
+        """
+        # Every module records spans, so aiohttp is only imported once the endpoint is actually served.
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        """
+        Stop the metrics endpoint and close the JSONL file.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._jsonl:
+            self._jsonl.close()
+            self._jsonl = None
+
+_tracer = NullTracer()
+
+def get_tracer():
+    """
+    Get the active tracer, a NullTracer unless metrics were enabled with `set_tracer`.
+    """
+    return _tracer
+
+def set_tracer(tracer):
+    """
+    Make a tracer the active one for all instrumented code.
+    """
+    global _tracer
+    _tracer = tracer
+
+def span(name: str, **tags):
+    """
+    Time the enclosed block as a span of the active tracer.
+    """
+    return _tracer.span(name, **tags)
+
+def tagged(**tags):
+    """
+    Tag all spans of the active tracer recorded in the enclosed block.
+    """
+    return _tracer.tagged(**tags)
+
+def count(name: str, amount: float = 1):
+    """
+    Add to a counter of the active tracer.
+    """
+    _tracer.count(name, amount)
@@ -0,0 +1,54 @@
+import asyncio
+
+class LoopLagMonitor:
+    """
+    Measures how long the event loop is blocked by scheduling a short sleep over and over
+    and recording how late each wake-up is.
+    """
+
+    def __init__(self, threshold: float = 0.05, interval: float = 0.01):
+        """
+        Args:
+            threshold (float): The lag in seconds above which a stall is reported.
+            interval (float): The sleep interval in seconds between two measurements.
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.max_lag = 0.0
+        self.samples = 0
+        self.stalls = 0
+        self._task = None
+
+    def start(self):
+        """
+        Starts measuring in a background task on the running event loop.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.samples += 1
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.stalls += 1
+                print(f"Event loop blocked for {lag * 1000:.0f} ms (threshold {self.threshold * 1000:.0f} ms).")
+
+    def stop(self):
+        """
+        Stops measuring.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def summary(self) -> str:
+        """
+        Returns a one-line summary of the measured loop lag.
+        """
+        return (f"Event loop lag: max {self.max_lag * 1000:.1f} ms over {self.samples} samples, "
+                f"{self.stalls} stalls above {self.threshold * 1000:.0f} ms.")
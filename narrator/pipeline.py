@@ -0,0 +1,370 @@
+import io
+import random
+import functools
+import asyncio
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple, Union
+
+from .config import ImageOptions, Speaker
+from .audio import StreamingPlayback
+from .playback import Clip, PlaybackEngine
+from .image import CameraService, capture_screen, capture_cam, grab_screen, grab_cam, composite_image, encode_image
+from .scene import SceneChangeDetector
+from .cadence import CadenceController
+from .history import ConversationHistory
+from .api import react, react_stream, get_next_speaker
+from .policy import RequestPolicy
+from .providers import GenerationProvider, SpeechProvider
+from .metrics import count, span, tagged
+from .ratelimit import request_priority, PRIORITY_CURRENT, PRIORITY_PREFETCH
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+CAPTURE_NOTICE = "(Will take Screenshot and webcam image in a second.)"
+
+class NarrationPipeline:
+    """
+    Runs the narration as four stages connected by bounded queues: capture -> generate -> synthesize -> play.
+
+    Each stage runs in its own task, so a slow stage only stalls the stages behind it once
+    the queue in front of it is full. The lookahead depth is the size of the queues between
+    generation, synthesis and playback, i.e. how many utterances may be prepared ahead of
+    the one that is playing.
+    """
+
+    def __init__(self, client: Union["AsyncOpenAI", GenerationProvider], tts_client: SpeechProvider,
+                 camera: CameraService, history: ConversationHistory,
+                 selected_speakers: List[Speaker], tts_model_id: str, override_next_speaker: bool = True,
+                 subtitle_overlay=None, subtitle_kwargs: dict = None, stream_tts: bool = False,
+                 image_options: ImageOptions = None, scene_detector: Optional[SceneChangeDetector] = None,
+                 speculative: bool = False, lookahead: int = 1, drain_on_stop: bool = False,
+                 shutdown_timeout: float = 30.0, request_policy: Optional[RequestPolicy] = None,
+                 stream_reactions: bool = False, on_playback: Optional[Callable[[Speaker, str, bool], None]] = None,
+                 playback: Optional[PlaybackEngine] = None, cadence: Optional[CadenceController] = None):
+        """
+        Args:
+            client (Union[AsyncOpenAI, GenerationProvider]): The generation provider of the reactions, or an OpenAI API client.
+            tts_client (SpeechProvider): The speech provider, e.g. the pooled ElevenLabs client.
+            camera (CameraService): The running webcam capture service.
+            history (ConversationHistory): The conversation history.
+            selected_speakers (List[Speaker]): The list of selected speakers.
+            tts_model_id (str): The ID of the TTS model to use.
+            override_next_speaker (bool): Whether a speaker mentioned in a reaction gets the next turn.
+            subtitle_overlay (SubtitleOverlay): The subtitle overlay, or None to disable subtitles.
+            subtitle_kwargs (dict): The styling arguments for the subtitle overlay.
+            stream_tts (bool): Whether to stream TTS audio into playback as it arrives.
+            image_options (ImageOptions): How captured images are resized and encoded.
+            scene_detector (Optional[SceneChangeDetector]): If set, reuses unchanged images instead of re-encoding them.
+            speculative (bool): Whether to capture the next images while the current reaction is generated and
+                request a reaction to them from every speaker who may follow, keeping only the one who does.
+                Speculative reactions are requested whole, even with `stream_reactions`.
+            lookahead (int): The number of utterances that may wait between generation, synthesis and playback.
+            drain_on_stop (bool): Whether to play the utterances already generated before shutting down.
+            shutdown_timeout (float): The maximum time in seconds to wait for draining on shutdown.
+            request_policy (Optional[RequestPolicy]): The deadline, retry and hedging policy of the reaction requests.
+            stream_reactions (bool): Whether to stream reactions and synthesize every sentence as soon as it is complete.
+            on_playback (Optional[Callable[[Speaker, str, bool], None]]): Called with the speaker, the text and True
+                when an utterance starts playing, and with False when it has finished.
+            playback (Optional[PlaybackEngine]): The engine that plays the utterances back to back. The mixer must be
+                initialized before the pipeline runs.
+            cadence (Optional[CadenceController]): If set, paces the turns and sets the detail level and length of
+                the reactions to follow the scene activity and the usage budgets. Without it, turns run back to back.
+        """
+        self.client = client
+        self.tts_client = tts_client
+        self.camera = camera
+        self.history = history
+        self.selected_speakers = selected_speakers
+        self.tts_model_id = tts_model_id
+        self.override_next_speaker = override_next_speaker
+        self.subtitle_overlay = subtitle_overlay
+        self.subtitle_kwargs = subtitle_kwargs or {}
+        self.stream_tts = stream_tts
+        self.image_options = image_options or ImageOptions()
+        self.scene_detector = scene_detector
+        self.speculative = speculative
+        self.drain_on_stop = drain_on_stop
+        self.shutdown_timeout = shutdown_timeout
+        self.request_policy = request_policy or RequestPolicy()
+        self.stream_reactions = stream_reactions
+        self.on_playback = on_playback
+        self.playback = playback or PlaybackEngine()
+        self.cadence = cadence
+
+        self._captured = asyncio.Queue(maxsize=1)
+        self._generated = asyncio.Queue(maxsize=lookahead)
+        self._synthesized = asyncio.Queue(maxsize=lookahead)
+        self._capture_requested = asyncio.Event()
+        self._capturing = False
+        self._current_subtitle = None
+        self._producers: List[asyncio.Task] = []
+        self._consumers: List[asyncio.Task] = []
+
+    async def run(self):
+        """
+        Runs all stages until one of them fails or the pipeline is cancelled.
+        """
+        self.playback.start()
+        self._producers = [
+            asyncio.create_task(self._capture_stage(), name="capture"),
+            asyncio.create_task(self._generate_stage(), name="generate"),
+        ]
+        self._consumers = [
+            asyncio.create_task(self._synthesize_stage(), name="synthesize"),
+            asyncio.create_task(self._play_stage(), name="play"),
+        ]
+        try:
+            # asyncio.wait, unlike gather, leaves the stages running when run() is cancelled, so they can drain.
+            done, _ = await asyncio.wait(self._producers + self._consumers, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        except asyncio.CancelledError:
+            await self.stop(drain=self.drain_on_stop)
+            raise
+        finally:
+            await self.stop(drain=False)
+
+    async def stop(self, drain: bool = False):
+        """
+        Stops the pipeline.
+
+        Args:
+            drain (bool): Whether to finish synthesizing and playing the utterances that were
+                already generated before stopping.
+        """
+        await self._cancel(self._producers)
+        if drain and any(not task.done() for task in self._consumers):
+            try:
+                await asyncio.wait_for(self._drain(), self.shutdown_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+        await self._cancel(self._consumers)
+        self.playback.clear()
+
+    async def _drain(self):
+        # The sentinel travels behind the pending utterances and ends each consumer in turn.
+        await self._generated.put(None)
+        await asyncio.gather(*self._consumers)
+
+    async def _cancel(self, tasks: List[asyncio.Task]):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _set_subtitle(self, text: str, **kwargs):
+        with span("subtitle"):
+            self.subtitle_overlay.setSubtitle(text, **kwargs)
+
+    def _clear_subtitle(self):
+        with span("subtitle"):
+            self.subtitle_overlay.clearSubtitle()
+
+    def _grab_composite(self):
+        return composite_image(grab_screen(), grab_cam(self.camera), self.image_options)
+
+    async def _capture_scene(self) -> Tuple[Optional[io.BytesIO], str, Optional[io.BytesIO], str]:
+        if self.image_options.composite:
+            # The composite takes the place of the screenshot; there is no separate webcam image.
+            if self.scene_detector is None:
+                loop = asyncio.get_running_loop()
+                with span("composite_capture"):
+                    composite = await loop.run_in_executor(
+                        None, lambda: encode_image(self._grab_composite(), self.image_options))
+                return composite, "high", None, "high"
+            composite, detail = await self.scene_detector.capture("composite", self._grab_composite, self.image_options)
+            return composite, detail, None, "high"
+        if self.scene_detector is None:
+            screen, cam = await asyncio.gather(capture_screen(self.image_options), capture_cam(self.camera, self.image_options))
+            return screen, "high", cam, "high"
+        (screen, screen_detail), (cam, cam_detail) = await asyncio.gather(
+            self.scene_detector.capture("screen", grab_screen, self.image_options),
+            self.scene_detector.capture("cam", lambda: grab_cam(self.camera), self.image_options),
+        )
+        return screen, screen_detail, cam, cam_detail
+
+    async def _capture_turn(self) -> Tuple[Optional[io.BytesIO], str, Optional[io.BytesIO], str]:
+        # The subtitle is hidden while the screenshot is taken, so it does not end up in the image.
+        self._capturing = True
+        try:
+            if self.subtitle_overlay:
+                self._clear_subtitle()
+                self._set_subtitle(CAPTURE_NOTICE, text_color="red")
+                await asyncio.sleep(1)
+                self._clear_subtitle()
+            scene = await self._capture_scene()
+            if self.subtitle_overlay and self._current_subtitle:
+                self._set_subtitle(self._current_subtitle, **self.subtitle_kwargs)
+            return scene
+        finally:
+            self._capturing = False
+
+    async def _capture_stage(self):
+        # Captures and generations pair up one to one, so the capture for turn n is the n-th one.
+        turn = 0
+        while True:
+            if not self.speculative:
+                await self._capture_requested.wait()
+                self._capture_requested.clear()
+            if self.cadence:
+                await self.cadence.wait()
+            turn += 1
+            with tagged(turn=turn):
+                scene = await self._capture_turn()
+            if self.cadence and self.scene_detector:
+                self.cadence.observe_scene(max(self.scene_detector.changes.values(), default=None))
+            await self._captured.put(scene)
+
+    async def _generate_stage(self):
+        if self.speculative:
+            return await self._speculative_generate_stage()
+        speaker = random.choice(self.selected_speakers)
+        turn = 0
+        while True:
+            self._capture_requested.set()
+            screen, screen_detail, cam, cam_detail = await self._captured.get()
+            turn += 1
+            max_tokens, on_prompt_tokens = 300, None
+            if self.cadence:
+                screen_detail, cam_detail = self.cadence.detail(screen_detail), self.cadence.detail(cam_detail)
+                max_tokens = self.cadence.request_max_tokens()
+                on_prompt_tokens = functools.partial(self.cadence.record_prompt_tokens, turn)
+            # Playback waits for this reaction only if nothing else is queued in front of it.
+            urgent = self._generated.empty() and self._synthesized.empty()
+            with tagged(speaker=speaker.value, turn=turn), request_priority(PRIORITY_CURRENT if urgent else PRIORITY_PREFETCH):
+                if self.stream_reactions:
+                    # Every sentence goes to synthesis as soon as it is complete; the history gets the whole reaction.
+                    sentences = []
+                    async for sentence in react_stream(speaker, cam, screen, self.history, self.selected_speakers,
+                                                       self.client, cam_detail, screen_detail, self.request_policy,
+                                                       self.image_options.composite, max_tokens, on_prompt_tokens):
+                        sentences.append(sentence)
+                        await self._generated.put((turn, speaker, sentence))
+                    speaker_name, reaction = speaker.value, " ".join(sentences)
+                else:
+                    speaker_name, reaction = await react(speaker, cam, screen, self.history, self.selected_speakers,
+                                                         self.client, cam_detail, screen_detail, self.request_policy,
+                                                         self.image_options.composite, max_tokens, on_prompt_tokens)
+                    await self._generated.put((turn, speaker, reaction))
+            print(f"{speaker.value}: {reaction}")
+            self.history.append(f"[{speaker_name}:] {reaction}")
+            speaker = get_next_speaker(speaker, reaction, self.selected_speakers, self.override_next_speaker)
+
+    def _start_reaction(self, speaker: Speaker, scene: Tuple[Optional[io.BytesIO], str, Optional[io.BytesIO], str],
+                        turn: int) -> asyncio.Task:
+        screen, screen_detail, cam, cam_detail = scene
+        max_tokens, on_prompt_tokens = 300, None
+        if self.cadence:
+            screen_detail, cam_detail = self.cadence.detail(screen_detail), self.cadence.detail(cam_detail)
+            max_tokens = self.cadence.request_max_tokens()
+            on_prompt_tokens = functools.partial(self.cadence.record_prompt_tokens, turn)
+        urgent = self._generated.empty() and self._synthesized.empty()
+        # The task inherits the tags and the priority of the block it is created in.
+        with tagged(speaker=speaker.value, turn=turn), request_priority(PRIORITY_CURRENT if urgent else PRIORITY_PREFETCH):
+            return asyncio.create_task(react(speaker, cam, screen, self.history, self.selected_speakers, self.client,
+                                             cam_detail, screen_detail, self.request_policy,
+                                             self.image_options.composite, max_tokens, on_prompt_tokens))
+
+    async def _speculative_generate_stage(self):
+        # The next images are captured while a reaction is generated. If they arrive first, every speaker
+        # who may follow starts reacting to them; once the reaction is in, get_next_speaker picks one of
+        # them and the others are cancelled. Their prompts cannot contain the reaction they follow.
+        speaker = random.choice(self.selected_speakers)
+        turn = 1
+        current = self._start_reaction(speaker, await self._captured.get(), turn)
+        capture = None
+        candidates = {}
+        try:
+            while True:
+                capture = asyncio.ensure_future(self._captured.get())
+                await asyncio.wait([current, capture], return_when=asyncio.FIRST_COMPLETED)
+                if not current.done():
+                    # get_next_speaker never picks the current speaker unless they are the only one.
+                    followers = [other for other in self.selected_speakers if other != speaker] or [speaker]
+                    candidates = {follower: self._start_reaction(follower, capture.result(), turn + 1)
+                                  for follower in followers}
+                speaker_name, reaction = await current
+                await self._generated.put((turn, speaker, reaction))
+                print(f"{speaker.value}: {reaction}")
+                self.history.append(f"[{speaker_name}:] {reaction}")
+                speaker = get_next_speaker(speaker, reaction, self.selected_speakers, self.override_next_speaker)
+                turn += 1
+                if candidates:
+                    current = candidates.pop(speaker)
+                    count("speculative_cancelled", len(candidates))
+                    await self._cancel(list(candidates.values()))
+                    candidates = {}
+                else:
+                    current = self._start_reaction(speaker, await capture, turn)
+        finally:
+            await self._cancel([task for task in [current, capture, *candidates.values()] if task is not None])
+
+    async def _synthesize_stage(self):
+        downloads = set()
+        try:
+            while True:
+                utterance = await self._generated.get()
+                if utterance is None:
+                    await self._synthesized.put(None)
+                    # Draining: the streams already queued for playback are downloaded to the end.
+                    await asyncio.gather(*downloads, return_exceptions=True)
+                    return
+                turn, speaker, reaction = utterance
+                if self.cadence:
+                    self.cadence.record_tts_chars(turn, len(reaction))
+                urgent = self._synthesized.empty()
+                with tagged(speaker=speaker.value, turn=turn), request_priority(PRIORITY_CURRENT if urgent else PRIORITY_PREFETCH):
+                    if self.stream_tts:
+                        # The download runs in the background; the playback sink buffers what arrives early.
+                        audio = StreamingPlayback()
+                        download = asyncio.create_task(self.tts_client.stream(speaker, reaction, self.tts_model_id, audio))
+                        downloads.add(download)
+                        download.add_done_callback(downloads.discard)
+                    else:
+                        audio = await self.tts_client.synthesize(speaker, reaction, self.tts_model_id)
+                await self._synthesized.put((turn, speaker, reaction, audio))
+        finally:
+            # Only reached with unfinished downloads when the stage is cancelled or fails.
+            for download in downloads:
+                download.cancel()
+
+    async def _play_stage(self):
+        presenting = set()
+        previous = None
+        try:
+            while True:
+                utterance = await self._synthesized.get()
+                if utterance is None:
+                    await asyncio.gather(*presenting)
+                    return
+                turn, speaker, reaction, audio = utterance
+                if audio is None:
+                    continue
+                # A streamed clip starts with the samples that already arrived and plays the rest as they are downloaded.
+                clip = audio.clip if self.stream_tts else Clip(audio)
+                # The next clip is handed to the engine once the previous one has started, so it can follow without a gap
+                # while the queues in front of playback still bound how far ahead the pipeline runs.
+                if previous is not None:
+                    await previous.wait_started()
+                with tagged(speaker=speaker.value, turn=turn):
+                    self.playback.enqueue(clip)
+                    presentation = asyncio.create_task(self._present(speaker, reaction, clip))
+                presenting.add(presentation)
+                presentation.add_done_callback(presenting.discard)
+                previous = clip
+        finally:
+            await self._cancel(list(presenting))
+
+    async def _present(self, speaker: Speaker, reaction: str, clip: Clip):
+        """
+        Show the subtitle of an utterance while its clip is playing.
+        """
+        await clip.wait_started()
+        self._current_subtitle = f"{speaker.value}: {reaction}"
+        if self.subtitle_overlay and not self._capturing:
+            self._set_subtitle(self._current_subtitle, **self.subtitle_kwargs)
+        if self.on_playback:
+            self.on_playback(speaker, reaction, True)
+        with span("playback"):
+            await clip.wait_done()
+        if self.on_playback:
+            self.on_playback(speaker, reaction, False)
@@ -0,0 +1,136 @@
+import asyncio
+from typing import AsyncIterator, Dict, Optional
+import numpy as np
+from piper import PiperVoice
+
+from .audio import (PCM_OUTPUT_FORMAT, PCM_SAMPLE_RATE, TARGET_DBFS, StreamingPlayback, apply_gain, normalize_pcm,
+                    pcm_bytes, pcm_samples)
+from .cache import TTSCache, tts_cache_key
+from .config import SPEAKER_TO_LOCAL_VOICE, Speaker
+from .metrics import span
+from .providers import SpeechProvider
+
+def resample_pcm(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    Resample 16-bit mono PCM audio to PCM_SAMPLE_RATE by linear interpolation.
+
+    Args:
+        samples (np.ndarray): The samples as 16-bit integers.
+        sample_rate (int): The sample rate of the samples.
+
+    Returns:
+        np.ndarray: The resampled samples, or the samples themselves if they already have the right rate.
+    """
+    if sample_rate == PCM_SAMPLE_RATE or not samples.size:
+        return samples
+    count = round(len(samples) * PCM_SAMPLE_RATE / sample_rate)
+    positions = np.arange(count) * (sample_rate / PCM_SAMPLE_RATE)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+
+class PiperSpeech(SpeechProvider):
+    """
+    A local speech provider that synthesizes with Piper voice models on this machine, without network requests.
+
+    A voice is loaded on its first utterance. Synthesis runs in a worker thread, one utterance
+    at a time, since the phonemizer is not thread-safe. Piper synthesizes sentence by sentence,
+    so streaming hands every sentence to the sink as soon as it is ready.
+    """
+
+    def __init__(self, voices: Optional[Dict[Speaker, str]] = None, cache: Optional[TTSCache] = None,
+                 use_cuda: bool = False):
+        """
+        Args:
+            voices (Optional[Dict[Speaker, str]]): The path of every speaker's voice model. Defaults to SPEAKER_TO_LOCAL_VOICE.
+            cache (Optional[TTSCache]): The on-disk cache of synthesized utterances, or None to disable caching.
+            use_cuda (bool): Whether to run the voice models on a CUDA GPU.
+        """
+        self.voices = voices if voices is not None else SPEAKER_TO_LOCAL_VOICE
+        self.cache = cache
+        self.use_cuda = use_cuda
+        self._loaded: Dict[str, PiperVoice] = {}
+        self._lock = asyncio.Lock()
+
+    async def _voice(self, speaker: Speaker) -> Optional[PiperVoice]:
+        path = self.voices.get(speaker)
+        if not path:
+            print(f"Error generating TTS audio: no local voice model for {speaker.value}")
+            return None
+        if path not in self._loaded:
+            with span("tts_load_voice"):
+                self._loaded[path] = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: PiperVoice.load(path, use_cuda=self.use_cuda))
+        return self._loaded[path]
+
+    def cache_key(self, speaker: Speaker, text: str) -> str:
+        """
+        Build the cache key of an utterance from its voice model and text.
+        """
+        return tts_cache_key(self.voices[speaker], {"engine": "piper", "text": text}, TARGET_DBFS, PCM_OUTPUT_FORMAT)
+
+    async def _sentences(self, voice: PiperVoice, text: str) -> AsyncIterator[np.ndarray]:
+        """
+        Synthesize the sentences of a text in a worker thread and yield their samples at PCM_SAMPLE_RATE.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = voice.synthesize_stream_raw(text)
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                return
+            yield resample_pcm(pcm_samples(chunk), voice.config.sample_rate)
+
+    async def synthesize(self, speaker: Speaker, text: str, model_id: str) -> Optional[np.ndarray]:
+        if self.cache is not None and self.voices.get(speaker):
+            key = self.cache_key(speaker, text)
+            pcm = await self.cache.get(key)
+            if pcm is not None:
+                return pcm_samples(pcm)
+        try:
+            async with self._lock:
+                voice = await self._voice(speaker)
+                if voice is None:
+                    return None
+                with span("tts_synthesize"):
+                    sentences = [samples async for samples in self._sentences(voice, text)]
+        except Exception as e:
+            print(f"Error generating TTS audio: {e}")
+            return None
+        with span("normalize"):
+            samples = normalize_pcm(pcm_bytes(np.concatenate(sentences)) if sentences else b"", TARGET_DBFS)
+        if self.cache is not None:
+            await self.cache.put(key, pcm_bytes(samples))
+        return samples
+
+    async def stream(self, speaker: Speaker, text: str, model_id: str, sink: StreamingPlayback) -> bool:
+        try:
+            if self.cache is not None and self.voices.get(speaker):
+                key = self.cache_key(speaker, text)
+                pcm = await self.cache.get(key)
+                if pcm is not None:
+                    sink.feed_normalized(pcm)
+                    return True
+            received = []
+            try:
+                async with self._lock:
+                    voice = await self._voice(speaker)
+                    if voice is None:
+                        return False
+                    with span("tts_synthesize"):
+                        async for samples in self._sentences(voice, text):
+                            sink.feed(pcm_bytes(samples))
+                            if self.cache is not None:
+                                received.append(samples)
+            except Exception as e:
+                print(f"Error streaming TTS audio: {e}")
+                return False
+            if self.cache is not None and received:
+                # Cached with the gain the sink played it at, so a replay sounds like the first play.
+                with span("normalize"):
+                    samples = apply_gain(np.concatenate(received), sink.final_gain())
+                await self.cache.put(key, pcm_bytes(samples))
+            return True
+        finally:
+            sink.finish()
+
+    async def close(self):
+        self._loaded.clear()
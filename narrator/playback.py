@@ -0,0 +1,333 @@
+import asyncio
+import threading
+import collections
+import time
+from typing import List, Optional
+import numpy as np
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class Clip:
+    """
+    A clip of 16-bit mono PCM audio for the PlaybackEngine.
+
+    A complete clip is created with its samples. A streamed clip is created empty, receives its
+    samples with `feed` while it may already be playing, and ends with `close`.
+    """
+
+    def __init__(self, samples: Optional[np.ndarray] = None):
+        self._chunks = collections.deque()
+        self.closed = False
+        self._engine = None
+        self._loop = None
+        self._started = None
+        self._finished = None
+        if samples is not None:
+            self._chunks.append(samples)
+            self.closed = True
+
+    def feed(self, samples: np.ndarray):
+        """
+        Add samples to a streamed clip.
+        """
+        self._chunks.append(samples)
+        if self._engine is not None:
+            self._engine._wake()
+
+    def close(self):
+        """
+        Mark the end of a streamed clip.
+        """
+        self.closed = True
+        if self._engine is not None:
+            self._engine._wake()
+
+    def _take(self) -> Optional[np.ndarray]:
+        """
+        Remove and return all samples that have arrived so far, or None if there are none.
+        """
+        parts = []
+        while self._chunks:
+            parts.append(self._chunks.popleft())
+        if not parts:
+            return None
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def _attach(self, engine: "PlaybackEngine", loop: asyncio.AbstractEventLoop):
+        self._engine = engine
+        self._loop = loop
+        self._started = loop.create_future()
+        self._finished = loop.create_future()
+
+    def _signal(self, future: asyncio.Future):
+        """
+        Resolve one of the clip's futures from the audio thread.
+        """
+        try:
+            self._loop.call_soon_threadsafe(_resolve, future)
+        except RuntimeError:
+            # The event loop is already closed; nobody is waiting anymore.
+            pass
+
+    async def wait_started(self):
+        """
+        Wait until the first sample of the clip is playing.
+        """
+        await asyncio.shield(self._started)
+
+    async def wait_done(self):
+        """
+        Wait until the last sample of the clip has been played.
+        """
+        await asyncio.shield(self._finished)
+
+class _Segment:
+    """
+    A piece of audio handed to the mixer channel, with the clips that start and end with it.
+    """
+
+    def __init__(self, sound, duration: float, starts: List[Clip], ends: List[Clip]):
+        self.sound = sound
+        self.duration = duration
+        self.starts = starts
+        self.ends = ends
+        self.began = None
+
+class PlaybackEngine:
+    """
+    Plays a queue of clips back to back on a dedicated audio thread.
+
+    The thread keeps the next segment queued on a reserved mixer channel, so the mixer starts
+    it on the sample after the previous one ends. It watches which sound the channel is
+    playing and reports the real start and end of every clip back to the event loop, instead
+    of the caller sleeping for the expected duration.
+
+    With a crossfade, the tail of every complete clip is held back until the clip is nearly
+    over. If the next complete clip has been enqueued by then, the tail is mixed into its
+    beginning; otherwise the tail is played as it is. Streamed clips are never crossfaded.
+    """
+
+    def __init__(self, crossfade_ms: int = 0, lead_ms: int = 150, poll_interval: float = 0.005):
+        """
+        Args:
+            crossfade_ms (int): The length of the crossfade between consecutive clips, or 0 for none.
+            lead_ms (int): How long before the end of a clip the crossfade with the next clip is decided.
+            poll_interval (float): How often the audio thread checks the channel while audio is playing, in seconds.
+        """
+        self.crossfade_ms = crossfade_ms
+        self.lead = lead_ms / 1000
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._pending = collections.deque()
+        self._submitted = collections.deque()
+        self._streaming = None
+        self._tail = None
+        # The body of a crossfaded clip, played after the overlap with the previous one.
+        self._body = None
+        self._thread = None
+        self._stopping = False
+        self._mixer = None
+        self._channel = None
+        self._sample_rate = None
+        self._crossfade_samples = 0
+
+    def start(self):
+        """
+        Reserve a mixer channel and start the audio thread. The mixer must be initialized.
+        """
+        if self._thread is not None:
+            return
+        # pygame is only loaded by the code paths that play audio, not by batch mode or the server.
+        from pygame import mixer
+        self._mixer = mixer
+        self._sample_rate = mixer.get_init()[0]
+        self._crossfade_samples = int(self._sample_rate * self.crossfade_ms / 1000)
+        mixer.set_reserved(1)
+        self._channel = mixer.Channel(0)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="playback", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, clip: Clip) -> Clip:
+        """
+        Add a clip to the end of the queue. It starts right after the clips queued before it.
+
+        Must be called from the event loop that waits for the clip.
+
+        Args:
+            clip (Clip): The clip, complete or streamed.
+
+        Returns:
+            Clip: The clip, to wait for its start and end.
+        """
+        clip._attach(self, asyncio.get_running_loop())
+        with self._condition:
+            self._pending.append(clip)
+            self._condition.notify()
+        return clip
+
+    def clear(self):
+        """
+        Stop playing and drop all queued clips. Their waiters are released.
+        """
+        with self._condition:
+            clips = list(self._pending)
+            self._pending.clear()
+            for segment in self._submitted:
+                clips.extend(segment.starts + segment.ends)
+            self._submitted.clear()
+            if self._streaming is not None:
+                clips.append(self._streaming)
+                self._streaming = None
+            if self._tail is not None:
+                clips.append(self._tail[0])
+                self._tail = None
+            self._body = None
+            if self._channel is not None:
+                self._channel.stop()
+        for clip in clips:
+            clip._signal(clip._started)
+            clip._signal(clip._finished)
+
+    def stop(self):
+        """
+        Stop playing, release all waiters and end the audio thread.
+        """
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        self.clear()
+
+    def _wake(self):
+        with self._condition:
+            self._condition.notify()
+
+    def _idle(self) -> bool:
+        return not (self._pending or self._submitted or self._streaming or self._tail or self._body is not None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+                self._condition.wait(None if self._idle() else self.poll_interval)
+                if self._stopping:
+                    return
+                self._update()
+
+    def _begin(self, segment: _Segment, now: float):
+        segment.began = now
+        for clip in segment.starts:
+            clip._signal(clip._started)
+
+    def _end(self, segment: _Segment):
+        for clip in segment.ends:
+            clip._signal(clip._finished)
+
+    def _update(self):
+        """
+        Report the segments that started or ended since the last check and keep the channel supplied.
+        """
+        channel = self._channel
+        now = time.monotonic()
+        playing = channel.get_sound() if channel.get_busy() else None
+        while self._submitted and self._submitted[0].sound is not playing:
+            self._end(self._submitted.popleft())
+            if self._submitted:
+                self._begin(self._submitted[0], now)
+
+        if not self._submitted:
+            segment = self._produce()
+            if segment is not None:
+                channel.play(segment.sound)
+                self._submitted.append(segment)
+                self._begin(segment, now)
+        if len(self._submitted) == 1 and channel.get_queue() is None:
+            current = self._submitted[0]
+            remaining = current.duration - (now - current.began)
+            # A held-back tail waits for the next clip until shortly before it is needed.
+            next_ready = bool(self._pending) and self._pending[0].closed
+            if self._tail is None or self._body is not None or next_ready or remaining <= self.lead:
+                segment = self._produce()
+                if segment is not None:
+                    channel.queue(segment.sound)
+                    self._submitted.append(segment)
+
+    def _segment(self, samples: np.ndarray, starts: List[Clip], ends: List[Clip]) -> _Segment:
+        return _Segment(self._mixer.Sound(buffer=samples), len(samples) / self._sample_rate, starts, ends)
+
+    def _produce(self) -> Optional[_Segment]:
+        """
+        Build the next segment to play, or return None if no audio is ready.
+        """
+        n = self._crossfade_samples
+        if self._body is not None:
+            body = self._body
+            self._body = None
+            return self._segment(body, [], [])
+
+        if self._tail is not None:
+            clip, tail = self._tail
+            self._tail = None
+            following = self._pending[0] if self._pending else None
+            if following is not None and following.closed:
+                samples = following._take()
+                if samples is not None and len(samples) > 2 * n:
+                    self._pending.popleft()
+                    fade = np.linspace(0.0, 1.0, n, dtype=np.float32)
+                    mixed = tail * (1 - fade) + samples[:n] * fade
+                    # The fade is mixed into the clip's own samples, so the segment is a view instead of a copy.
+                    if not samples.flags.writeable:
+                        samples = samples.copy()
+                    samples[:n] = mixed
+                    self._tail = (following, samples[-n:])
+                    # The overlap is a segment of its own, so the previous clip ends when the fade does.
+                    self._body = samples[n:-n]
+                    return self._segment(samples[:n], [following], [clip])
+                if samples is not None:
+                    following._chunks.appendleft(samples)
+            return self._segment(tail, [], [clip])
+
+        if self._streaming is not None:
+            clip = self._streaming
+            closed = clip.closed
+            samples = clip._take()
+            if closed:
+                self._streaming = None
+            if samples is not None:
+                return self._segment(samples, [], [clip] if closed else [])
+            if not closed:
+                return None
+            # The stream ended after its last samples were handed to the channel.
+            if self._submitted:
+                self._submitted[-1].ends.append(clip)
+            else:
+                clip._signal(clip._finished)
+
+        while self._pending:
+            clip = self._pending.popleft()
+            closed = clip.closed
+            samples = clip._take()
+            if not closed:
+                self._streaming = clip
+                if samples is None:
+                    # Nothing has arrived yet; the clip starts with its first samples.
+                    self._streaming = None
+                    self._pending.appendleft(clip)
+                    return None
+                return self._segment(samples, [clip], [])
+            if samples is None or not len(samples):
+                clip._signal(clip._started)
+                clip._signal(clip._finished)
+                continue
+            if n and len(samples) > 2 * n:
+                self._tail = (clip, samples[-n:])
+                return self._segment(samples[:-n], [clip], [])
+            return self._segment(samples, [clip], [clip])
+        return None
@@ -0,0 +1,145 @@
+import random
+import asyncio
+import collections
+from typing import Awaitable, Callable, Dict, List, Optional, Set, TypeVar
+
+T = TypeVar("T")
+
+class RequestBudgetExceeded(Exception):
+    """
+    Raised when a request produced no acceptable result within its deadline and retries.
+    """
+
+class RequestPolicy:
+    """
+    Runs API requests with a deadline, a capped number of jittered retries and hedging.
+
+    A hedged request fires a duplicate of a call that is still outstanding after the observed
+    p95 latency of earlier calls and keeps whichever acceptable answer arrives first. Until
+    enough latencies have been observed, no duplicates are sent.
+    """
+
+    def __init__(self, deadline: float = 30.0, max_retries: int = 2, backoff_base: float = 0.5, backoff_cap: float = 4.0,
+                 hedge: bool = True, hedge_quantile: float = 0.95, hedge_min_samples: int = 5, latency_window: int = 50):
+        """
+        Args:
+            deadline (float): The total time budget of a request in seconds, including retries.
+            max_retries (int): The maximum number of retries after the first attempt.
+            backoff_base (float): The backoff before the first retry in seconds, doubled for every further retry.
+            backoff_cap (float): The maximum backoff between two attempts in seconds.
+            hedge (bool): Whether to send a duplicate of slow requests.
+            hedge_quantile (float): The latency quantile after which a duplicate is sent.
+            hedge_min_samples (int): The number of observed latencies needed before hedging starts.
+            latency_window (int): The number of most recent latencies the quantile is computed from.
+        """
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = collections.deque(maxlen=latency_window)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        The time after which an outstanding request is duplicated, or None if hedging is off or not calibrated yet.
+        """
+        if not self.hedge or len(self._latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(self.hedge_quantile * len(latencies)))]
+
+    def backoff(self, attempt: int) -> float:
+        """
+        The jittered backoff in seconds before the given retry.
+        """
+        return random.uniform(0.5, 1.0) * min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+
+    async def run(self, request: Callable[[], Awaitable[T]], accept: Callable[[T], bool] = lambda result: True,
+                  fallback: Optional[Callable[[], T]] = None,
+                  discard: Optional[Callable[[T], Awaitable[None]]] = None) -> T:
+        """
+        Run a request under this policy.
+
+        Args:
+            request (Callable[[], Awaitable[T]]): Starts one attempt of the request.
+            accept (Callable[[T], bool]): Whether a result is good enough to return. Rejected results are retried.
+            fallback (Optional[Callable[[], T]]): Produces the result if the budget runs out.
+            discard (Optional[Callable[[T], Awaitable[None]]]): Releases a result that is not returned, e.g. the
+                open stream of a hedged duplicate that completed along with the accepted one.
+
+        Returns:
+            T: The first accepted result, or the fallback result.
+
+        Raises:
+            RequestBudgetExceeded: If the budget runs out and there is no fallback.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - loop.time()
+            try:
+                return await asyncio.wait_for(self._hedged(request, accept, discard), remaining)
+            except asyncio.TimeoutError:
+                print(f"Request timed out after {self.deadline:.0f} seconds.")
+                break
+            except Exception as e:
+                print(f"Request attempt {attempt + 1} failed: {e}")
+            backoff = self.backoff(attempt)
+            if attempt == self.max_retries or loop.time() + backoff >= deadline:
+                break
+            await asyncio.sleep(backoff)
+        if fallback is None:
+            raise RequestBudgetExceeded("No acceptable result within the request budget")
+        return fallback()
+
+    async def _hedged(self, request: Callable[[], Awaitable[T]], accept: Callable[[T], bool],
+                      discard: Optional[Callable[[T], Awaitable[None]]] = None) -> T:
+        """
+        Run one attempt, duplicated after the hedge delay, and return the first accepted result.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        first = asyncio.create_task(request())
+        started: Dict[asyncio.Task, float] = {first: start}
+        pending: Set[asyncio.Task] = {first}
+        unused: List[T] = []
+        hedge_delay = self.hedge_delay()
+        error = None
+        try:
+            while pending:
+                timeout = None
+                if hedge_delay is not None:
+                    timeout = max(0.0, start + hedge_delay - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge = asyncio.create_task(request())
+                    started[hedge] = loop.time()
+                    pending.add(hedge)
+                    hedge_delay = None
+                    continue
+                accepted = None
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    self._latencies.append(loop.time() - started[task])
+                    if accepted is None and accept(task.result()):
+                        accepted = task
+                    else:
+                        # Rejected results, and a second result when both attempts complete at once, are released.
+                        unused.append(task.result())
+                        error = ValueError("The result was rejected")
+                if accepted is not None:
+                    return accepted.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            if discard is not None:
+                for result in unused:
+                    try:
+                        await discard(result)
+                    except Exception as e:
+                        print(f"Error releasing an unused result: {e}")
@@ -0,0 +1,229 @@
+import abc
+import importlib
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+from .config import DEFAULT_VISION_MODEL, Speaker
+
+if TYPE_CHECKING:
+    import numpy as np
+    from openai import AsyncOpenAI
+    from .audio import StreamingPlayback
+
+# Speech providers are registered as "module:attribute" paths, like the subtitle backends,
+# so a local TTS engine is only imported when a speaker uses it.
+SPEECH_PROVIDERS: Dict[str, str] = {
+    "elevenlabs": "narrator.audio:TTSClient",
+    "piper": "narrator.piper:PiperSpeech",
+}
+
+DEFAULT_SPEECH_PROVIDER = "elevenlabs"
+
+# Both generation providers speak the OpenAI chat completions API; "local" is any
+# OpenAI-compatible endpoint, e.g. a llama.cpp, vLLM or Ollama server on the LAN.
+GENERATION_PROVIDERS: List[str] = ["openai", "local"]
+
+DEFAULT_GENERATION_PROVIDER = "openai"
+
+class GenerationProvider(abc.ABC):
+    """
+    Generates the chat completions of the reactions and the history summaries.
+
+    Responses are shaped like those of the OpenAI SDK: a completion with `choices` and an
+    optional `usage`, or, when streaming, an async iterator of chunks with a `close` method.
+    """
+
+    @abc.abstractmethod
+    async def complete(self, messages: List[dict], max_tokens: int, temperature: float = 1.0, stream: bool = False,
+                       speaker: Optional[Speaker] = None, model: Optional[str] = None):
+        """
+        Request a chat completion.
+
+        Args:
+            messages (List[dict]): The chat messages.
+            max_tokens (int): The maximum length of the completion in tokens.
+            temperature (float): The sampling temperature.
+            stream (bool): Whether to stream the completion.
+            speaker (Optional[Speaker]): The speaker the completion is for, or None for housekeeping requests.
+            model (Optional[str]): The model to use instead of the speaker's.
+
+        Returns:
+            The completion, or the stream of completion chunks.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """
+        Release the provider's connections.
+        """
+
+class OpenAIGeneration(GenerationProvider):
+    """
+    Generates completions with an AsyncOpenAI client, from the OpenAI API or any OpenAI-compatible endpoint.
+    """
+
+    def __init__(self, client: "AsyncOpenAI", model: str = DEFAULT_VISION_MODEL,
+                 speaker_models: Optional[Dict[Speaker, str]] = None):
+        """
+        Args:
+            client (AsyncOpenAI): The client, whose base URL selects the endpoint.
+            model (str): The vision model of the reactions.
+            speaker_models (Optional[Dict[Speaker, str]]): The models of speakers that do not use `model`.
+        """
+        self.client = client
+        self.model = model
+        self.speaker_models = speaker_models or {}
+
+    async def complete(self, messages: List[dict], max_tokens: int, temperature: float = 1.0, stream: bool = False,
+                       speaker: Optional[Speaker] = None, model: Optional[str] = None):
+        return await self.client.chat.completions.create(
+            model=model or self.speaker_models.get(speaker) or self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=stream,
+        )
+
+    async def close(self):
+        await self.client.close()
+
+class SpeakerGeneration(GenerationProvider):
+    """
+    Routes the completions of every speaker to that speaker's provider.
+
+    Requests that are not for a speaker, such as the history summaries, go to the default provider.
+    """
+
+    def __init__(self, providers: Dict[Speaker, GenerationProvider], default: GenerationProvider):
+        self.providers = providers
+        self.default = default
+
+    async def complete(self, messages: List[dict], max_tokens: int, temperature: float = 1.0, stream: bool = False,
+                       speaker: Optional[Speaker] = None, model: Optional[str] = None):
+        provider = self.providers.get(speaker, self.default)
+        return await provider.complete(messages, max_tokens, temperature, stream, speaker, model)
+
+    async def close(self):
+        for provider in {id(provider): provider for provider in [self.default, *self.providers.values()]}.values():
+            await provider.close()
+
+def as_generation_provider(client) -> GenerationProvider:
+    """
+    Wrap an AsyncOpenAI client in an OpenAIGeneration with the default vision model; providers are returned as they are.
+    """
+    return client if isinstance(client, GenerationProvider) else OpenAIGeneration(client)
+
+class SpeechProvider(abc.ABC):
+    """
+    Synthesizes the utterances of the speakers as normalized 16-bit mono PCM at PCM_SAMPLE_RATE.
+
+    Providers are async context managers; `close` releases their connections or models.
+    """
+
+    @abc.abstractmethod
+    async def synthesize(self, speaker: Speaker, text: str, model_id: str) -> Optional["np.ndarray"]:
+        """
+        Synthesize a whole utterance.
+
+        Args:
+            speaker (Speaker): The speaker whose voice to use.
+            text (str): The text to be converted to speech.
+            model_id (str): The ID of the TTS model, for providers that offer several.
+
+        Returns:
+            np.ndarray: The normalized 16-bit mono PCM samples, or None if an error occurs.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def stream(self, speaker: Speaker, text: str, model_id: str, sink: "StreamingPlayback") -> bool:
+        """
+        Synthesize an utterance into a playback sink while it is generated, and finish the sink.
+
+        Args:
+            speaker (Speaker): The speaker whose voice to use.
+            text (str): The text to be converted to speech.
+            model_id (str): The ID of the TTS model, for providers that offer several.
+            sink (StreamingPlayback): The playback sink that receives the raw PCM chunks.
+
+        Returns:
+            bool: True if the whole utterance was streamed, False if an error occurred.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """
+        Release the provider's connections or models.
+        """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+class SpeakerSpeech(SpeechProvider):
+    """
+    Routes the utterances of every speaker to that speaker's speech provider.
+    """
+
+    def __init__(self, providers: Dict[Speaker, SpeechProvider]):
+        self.providers = providers
+
+    async def synthesize(self, speaker: Speaker, text: str, model_id: str) -> Optional["np.ndarray"]:
+        return await self.providers[speaker].synthesize(speaker, text, model_id)
+
+    async def stream(self, speaker: Speaker, text: str, model_id: str, sink: "StreamingPlayback") -> bool:
+        return await self.providers[speaker].stream(speaker, text, model_id, sink)
+
+    async def close(self):
+        for provider in {id(provider): provider for provider in self.providers.values()}.values():
+            await provider.close()
+
+def register_speech_provider(name: str, target: str):
+    """
+    Register a speech provider.
+
+    A provider is a SpeechProvider subclass. Except for the ElevenLabs client, providers are
+    created with the keyword arguments `voices` (the SPEAKER_TO_LOCAL_VOICE mapping) and `cache`
+    (the TTSCache, or None).
+
+    Args:
+        name (str): The name of the provider, as selected with --speech-provider.
+        target (str): The import path of the provider class, e.g. "narrator.piper:PiperSpeech".
+    """
+    SPEECH_PROVIDERS[name] = target
+
+def speech_providers() -> List[str]:
+    """
+    Get the names of all registered speech providers.
+    """
+    return list(SPEECH_PROVIDERS)
+
+def load_speech_provider(name: str) -> Callable:
+    """
+    Import a speech provider.
+
+    Args:
+        name (str): The name of the provider.
+
+    Returns:
+        Callable: The provider class.
+
+    Raises:
+        KeyError: If no provider with this name is registered.
+        ImportError: If the dependencies of the provider are not installed.
+    """
+    module_name, _, attribute = SPEECH_PROVIDERS[name].partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+def create_speech_provider(name: str, **options) -> SpeechProvider:
+    """
+    Import a speech provider and create an instance of it.
+
+    Args:
+        name (str): The name of the provider.
+        **options: Provider-specific arguments, e.g. the `api_key` of the ElevenLabs client.
+
+    Returns:
+        SpeechProvider: The speech provider.
+    """
+    return load_speech_provider(name)(**options)
@@ -0,0 +1,308 @@
+import re
+import heapq
+import asyncio
+import itertools
+import contextlib
+import contextvars
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Mapping, Optional
+import httpx
+
+PRIORITY_CURRENT = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_BACKGROUND = 2
+
+DEFAULT_RETRY_AFTER = 1.0
+
+_priority = contextvars.ContextVar("narrator_request_priority", default=PRIORITY_CURRENT)
+
+@contextlib.contextmanager
+def request_priority(priority: int):
+    """
+    Set the priority of all rate-limited requests made in the enclosed block.
+
+    Args:
+        priority (int): PRIORITY_CURRENT for work the listener is waiting for, PRIORITY_PREFETCH for
+            work ahead of playback, or PRIORITY_BACKGROUND for housekeeping such as summaries.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority() -> int:
+    """
+    Get the priority set with `request_priority`, PRIORITY_CURRENT by default.
+    """
+    return _priority.get()
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a rate limit reset duration in seconds, e.g. "20ms", "1.5s", "6m0s" or "30".
+
+    Returns:
+        Optional[float]: The duration in seconds, or None if it is missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts or "".join(number + unit for number, unit in parts) != value.strip():
+        return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given in seconds or as an HTTP date.
+
+    Returns:
+        Optional[float]: The delay in seconds, or None if it is missing or malformed.
+    """
+    if not value:
+        return None
+    delay = parse_duration(value)
+    if delay is not None:
+        return delay
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class ProviderLimiter:
+    """
+    Schedules the requests to one API provider within its rate limits.
+
+    Requests wait for a concurrency slot and, if a request rate is set, a token from a token
+    bucket. Waiting requests are admitted in priority order, so work for the utterance that is
+    about to play goes ahead of prefetching and summaries.
+
+    The concurrency limit adapts to the provider: it is halved on every 429 response and grows
+    by one after a full window of successful requests (additive increase, multiplicative
+    decrease). A 429, a Retry-After header, or an exhausted x-ratelimit-remaining-* header pauses
+    all requests to the provider until the limit resets, and an x-ratelimit-limit-requests
+    header caps the request rate.
+    """
+
+    def __init__(self, name: str, requests_per_second: Optional[float] = None, burst: int = 1,
+                 max_concurrency: int = 8):
+        """
+        Args:
+            name (str): The name of the provider, for log messages.
+            requests_per_second (Optional[float]): The request rate, or None to only limit concurrency.
+            burst (int): The number of requests that may be sent at once after an idle period.
+            max_concurrency (int): The upper bound of the adaptive concurrency limit.
+
+        Raises:
+            ValueError: If `max_concurrency` is less than 1, which would never admit a request.
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"The maximum concurrency of {name} must be at least 1, not {max_concurrency}")
+        self.name = name
+        self.requests_per_second = requests_per_second
+        self.burst = max(1, burst)
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.throttled = 0
+        self._tokens = float(self.burst)
+        self._refilled = None
+        self._active = 0
+        self._successes = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._timer = None
+
+    def _refill(self, now: float):
+        if self._refilled is not None and self.requests_per_second:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.requests_per_second)
+        self._refilled = now
+
+    def _wake_at(self, when: float):
+        loop = asyncio.get_running_loop()
+        if self._timer is not None:
+            if self._timer.when() <= when:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_at(when, self._wake)
+
+    def _wake(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        Admit waiting requests in priority order while the limits allow.
+        """
+        now = asyncio.get_running_loop().time()
+        self._refill(now)
+        while self._waiters and self._active < self.concurrency:
+            if now < self._paused_until:
+                self._wake_at(self._paused_until)
+                return
+            if self.requests_per_second and self._tokens < 1:
+                self._wake_at(now + (1 - self._tokens) / self.requests_per_second)
+                return
+            *_, waiter = heapq.heappop(self._waiters)
+            if waiter.done():
+                continue
+            self._active += 1
+            if self.requests_per_second:
+                self._tokens -= 1
+            waiter.set_result(None)
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: Optional[int] = None):
+        """
+        Wait for permission to send a request and hold it while the enclosed block runs.
+
+        Args:
+            priority (Optional[int]): The priority of the request; lower values go first.
+                Defaults to the priority set with `request_priority`.
+        """
+        if priority is None:
+            priority = current_priority()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+        try:
+            yield self
+        finally:
+            self._release()
+
+    def _pause(self, delay: float):
+        until = asyncio.get_running_loop().time() + delay
+        if until > self._paused_until:
+            self._paused_until = until
+
+    def observe(self, status: int, headers: Mapping[str, str]) -> Optional[float]:
+        """
+        Adjust the limits to a response from the provider.
+
+        Args:
+            status (int): The HTTP status of the response.
+            headers (Mapping[str, str]): The response headers.
+
+        Returns:
+            Optional[float]: The time in seconds to wait before retrying if the request was
+                rate limited, or None otherwise.
+        """
+        limit = headers.get("x-ratelimit-limit-requests")
+        if limit and limit.isdigit() and int(limit) > 0:
+            # The request limit is per minute; never exceed it, even if no rate was configured.
+            per_second = int(limit) / 60
+            if not self.requests_per_second or per_second < self.requests_per_second:
+                self.requests_per_second = per_second
+
+        if status == 429:
+            delay = (parse_retry_after(headers.get("retry-after"))
+                     or parse_duration(headers.get("x-ratelimit-reset-requests"))
+                     or DEFAULT_RETRY_AFTER)
+            self.throttled += 1
+            self._successes = 0
+            self.concurrency = max(1, self.concurrency // 2)
+            print(f"Rate limited by {self.name}; waiting {delay:.1f}s, concurrency limit now {self.concurrency}")
+            self._pause(delay)
+            return delay
+
+        for kind in ("requests", "tokens"):
+            if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self._pause(reset)
+        if status < 400:
+            self._successes += 1
+            if self._successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                self._successes = 0
+                self.concurrency += 1
+                self._dispatch()
+        return None
+
+class _SlotStream(httpx.AsyncByteStream):
+    """
+    A response body that holds its limiter slot until the response is closed.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, slot: contextlib.AsyncExitStack):
+        self._stream = stream
+        self._slot = slot
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            await self._slot.aclose()
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that sends every request through a ProviderLimiter and retries rate-limited ones.
+
+    Passed to AsyncOpenAI via `http_client`, it covers every call of the client, including
+    streamed reactions and history summaries. A request holds its slot until its response is
+    closed, so a streamed reaction counts against the concurrency limit while it is read.
+    """
+
+    def __init__(self, limiter: ProviderLimiter, transport: Optional[httpx.AsyncBaseTransport] = None,
+                 max_attempts: int = 4):
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(self.max_attempts):
+            slot = contextlib.AsyncExitStack()
+            await slot.enter_async_context(self.limiter.slot())
+            try:
+                response = await self._transport.handle_async_request(request)
+            except BaseException:
+                await slot.aclose()
+                raise
+            response.stream = _SlotStream(response.stream, slot)
+            delay = self.limiter.observe(response.status_code, response.headers)
+            if delay is None or attempt == self.max_attempts - 1:
+                return response
+            # The limiter is paused for the delay, so the retry waits for its slot until then.
+            await response.aclose()
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+def rate_limited_http_client(limiter: ProviderLimiter) -> httpx.AsyncClient:
+    """
+    Create an httpx client for AsyncOpenAI that sends its requests through a limiter.
+
+    The transport retries rate-limited requests itself, so the AsyncOpenAI client should be
+    created with `max_retries=0`.
+
+    Args:
+        limiter (ProviderLimiter): The limiter of the OpenAI API.
+
+    Returns:
+        httpx.AsyncClient: The client, with the OpenAI SDK's default timeouts and connection limits.
+    """
+    return httpx.AsyncClient(
+        transport=RateLimitedTransport(limiter, httpx.AsyncHTTPTransport(limits=httpx.Limits(
+            max_connections=1000, max_keepalive_connections=100, keepalive_expiry=5.0))),
+        timeout=httpx.Timeout(600.0, connect=5.0),
+        follow_redirects=True,
+    )
@@ -0,0 +1,82 @@
+import io
+import asyncio
+from typing import Callable, Dict, Optional, Tuple
+from PIL import Image
+from .config import ImageOptions
+from .image import encode_image
+from .metrics import span
+
+def difference_hash(img: Image.Image, hash_size: int = 16) -> int:
+    """
+    Compute a perceptual difference hash of an image.
+
+    The image is shrunk to (hash_size + 1) x hash_size grayscale pixels and every bit
+    records whether a pixel is brighter than its right neighbour, so the hash is robust
+    to noise, scaling and compression but changes when the content moves.
+
+    Args:
+        img (Image.Image): The image to hash.
+        hash_size (int): The number of rows and bits per row of the hash.
+
+    Returns:
+        int: The hash as an integer with hash_size * hash_size bits.
+    """
+    small = img.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR, reducing_gap=2.0).convert("L")
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+class SceneChangeDetector:
+    """
+    Keeps a perceptual hash of the last images sent to the vision model and reuses the
+    encoded images while the scene stays the same.
+
+    An image counts as changed when the fraction of differing hash bits exceeds the threshold.
+    Unchanged images are either resent at low detail ("low") or left out entirely ("text").
+    How much each image differed from the last one sent, at its latest capture, is kept in `changes`.
+    Without a threshold, the changes are only measured and every image is sent as it is.
+    """
+
+    def __init__(self, threshold: Optional[float] = 0.1, unchanged_mode: str = "low", hash_size: int = 16):
+        self.threshold = threshold
+        self.unchanged_mode = unchanged_mode
+        self.hash_size = hash_size
+        self._last: Dict[str, Tuple[int, io.BytesIO]] = {}
+        self.changes: Dict[str, float] = {}
+
+    def _distance(self, a: int, b: int) -> float:
+        return bin(a ^ b).count("1") / (self.hash_size * self.hash_size)
+
+    def _capture(self, name: str, grab: Callable[[], Image.Image], options: ImageOptions) -> Tuple[Optional[io.BytesIO], str]:
+        img = grab()
+        image_hash = difference_hash(img, self.hash_size)
+        last = self._last.get(name)
+        change = self.changes[name] = 1.0 if last is None else self._distance(last[0], image_hash)
+        if self.threshold is None or change > self.threshold:
+            buffer = encode_image(img, options)
+            self._last[name] = (image_hash, buffer)
+            return buffer, "high"
+        if self.unchanged_mode == "text":
+            return None, "low"
+        return last[1], "low"
+
+    async def capture(self, name: str, grab: Callable[[], Image.Image], options: ImageOptions) -> Tuple[Optional[io.BytesIO], str]:
+        """
+        Grab an image in a worker thread and encode it only if it differs from the last one sent.
+
+        Args:
+            name (str): The name of the image source, e.g. "screen" or "cam".
+            grab (Callable[[], Image.Image]): The function that captures the image.
+            options (ImageOptions): The resize and encoding options.
+
+        Returns:
+            Tuple[Optional[io.BytesIO], str]: The encoded image and the detail level to send it at.
+                The image is None if the scene is unchanged and images are left out.
+        """
+        loop = asyncio.get_running_loop()
+        with span(f"{name}_capture"):
+            return await loop.run_in_executor(None, self._capture, name, grab, options)
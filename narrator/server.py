@@ -0,0 +1,312 @@
+import io
+import json
+import base64
+import random
+import asyncio
+import itertools
+import collections
+import contextlib
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+import numpy as np
+from aiohttp import web, WSMsgType
+from PIL import Image
+
+from .config import ImageOptions, Speaker
+from .audio import PCM_SAMPLE_RATE
+from .image import composite_image, encode_image
+from .history import ConversationHistory
+from .api import react, get_next_speaker
+from .policy import RequestPolicy
+from .providers import GenerationProvider, SpeechProvider, as_generation_provider
+from .metrics import tagged
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+class FairScheduler:
+    """
+    Limits the number of concurrent upstream requests and hands free slots to sessions in turn.
+
+    A plain semaphore serves waiters first come, first served, so a session that queues many
+    requests can starve the others. Here every session has its own queue of waiters, and a
+    released slot goes to the next session in round-robin order.
+    """
+
+    def __init__(self, max_concurrent: int):
+        self._free = max_concurrent
+        self._waiters: Dict[str, collections.deque] = collections.OrderedDict()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, session_id: str):
+        """
+        Hold one request slot for a session while the enclosed block runs.
+        """
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(session_id, collections.deque()).append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just before the cancellation; pass it on.
+                    self._release()
+                else:
+                    self._discard(session_id, waiter)
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _discard(self, session_id: str, waiter: asyncio.Future):
+        waiters = self._waiters.get(session_id)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[session_id]
+
+    def _release(self):
+        while self._waiters:
+            session_id, waiters = next(iter(self._waiters.items()))
+            waiter = waiters.popleft()
+            # The session moves to the back of the round, or leaves it if it has nothing queued.
+            del self._waiters[session_id]
+            if waiters:
+                self._waiters[session_id] = waiters
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._free += 1
+
+class ScheduledGeneration(GenerationProvider):
+    """
+    Sends the completions of one session through the fair scheduler, e.g. for the session's history summaries.
+    """
+
+    def __init__(self, provider: GenerationProvider, scheduler: FairScheduler, session_id: str):
+        self.provider = provider
+        self.scheduler = scheduler
+        self.session_id = session_id
+
+    async def complete(self, messages: List[dict], max_tokens: int, temperature: float = 1.0, stream: bool = False,
+                       speaker: Optional[Speaker] = None, model: Optional[str] = None):
+        async with self.scheduler.slot(self.session_id):
+            return await self.provider.complete(messages, max_tokens, temperature, stream, speaker, model)
+
+class NarrationSession:
+    """
+    One client's narration: its own history and speaker rotation, served over a WebSocket.
+
+    The client uploads a screenshot and a webcam image whenever it is ready for the next turn.
+    Each upload triggers one reaction, which is sent back as a subtitle event followed by the
+    audio. Frames uploaded while a turn is in progress replace each other, so only the most
+    recent pair is narrated next. A turn that fails, e.g. on an undecodable image, is reported
+    as an error event and the session waits for the next upload.
+    """
+
+    def __init__(self, session_id: str, server: "NarrationServer", ws: web.WebSocketResponse,
+                 selected_speakers: List[Speaker]):
+        self.session_id = session_id
+        self.server = server
+        self.ws = ws
+        self.selected_speakers = selected_speakers
+        # The summaries share the session's turn of the scheduler with its reactions and utterances.
+        summaries = ScheduledGeneration(as_generation_provider(server.client), server.scheduler, session_id)
+        self.history = ConversationHistory(summaries, server.history_token_budget, server.history_turns,
+                                           server.summary_model)
+        self._frames: Optional[Tuple[bytes, bytes]] = None
+        self._frames_ready = asyncio.Event()
+
+    def upload(self, screen: bytes, cam: bytes):
+        """
+        Store the most recent frames and start the next turn as soon as the current one is done.
+        """
+        self._frames = (screen, cam)
+        self._frames_ready.set()
+
+    def _encode(self, data: bytes) -> io.BytesIO:
+        return encode_image(Image.open(io.BytesIO(data)).convert("RGB"), self.server.image_options)
+
+    def _encode_composite(self, screen_data: bytes, cam_data: bytes) -> io.BytesIO:
+        screen, cam = (Image.open(io.BytesIO(data)).convert("RGB") for data in (screen_data, cam_data))
+        options = self.server.image_options
+        return encode_image(composite_image(screen, cam, options), options)
+
+    async def _send_audio(self, turn: int, samples: np.ndarray):
+        await self.ws.send_json({"type": "audio", "turn": turn, "format": "pcm_s16le",
+                                 "sample_rate": PCM_SAMPLE_RATE, "channels": 1})
+        await self.ws.send_bytes(samples.tobytes())
+
+    async def _narrate(self, turn: int, speaker: Speaker, screen_data: bytes, cam_data: bytes) -> str:
+        """
+        Narrate one pair of frames and send the subtitle and the audio of the reaction.
+
+        Returns:
+            str: The reaction.
+        """
+        server = self.server
+        loop = asyncio.get_running_loop()
+        composite = server.image_options.composite
+        if composite:
+            screen, cam = await loop.run_in_executor(None, self._encode_composite, screen_data, cam_data), None
+        else:
+            screen, cam = await asyncio.gather(loop.run_in_executor(None, self._encode, screen_data),
+                                               loop.run_in_executor(None, self._encode, cam_data))
+        async with server.scheduler.slot(self.session_id):
+            speaker_name, reaction = await react(speaker, cam, screen, self.history, self.selected_speakers,
+                                                 server.client, policy=server.request_policy,
+                                                 composite=composite)
+        self.history.append(f"[{speaker_name}:] {reaction}")
+        await self.ws.send_json({"type": "subtitle", "turn": turn, "speaker": speaker.value, "text": reaction})
+        async with server.scheduler.slot(self.session_id):
+            samples = await server.tts_client.synthesize(speaker, reaction, server.tts_model_id)
+        if samples is not None:
+            await self._send_audio(turn, samples)
+        return reaction
+
+    async def run(self):
+        """
+        Narrate one turn per frame upload until the connection closes.
+        """
+        speaker = random.choice(self.selected_speakers)
+        for turn in itertools.count(1):
+            await self._frames_ready.wait()
+            self._frames_ready.clear()
+            screen_data, cam_data = self._frames
+            try:
+                with tagged(session=self.session_id, speaker=speaker.value, turn=turn):
+                    reaction = await self._narrate(turn, speaker, screen_data, cam_data)
+            except Exception as e:
+                print(f"Session {self.session_id} turn {turn} failed: {e!r}")
+                await self.ws.send_json({"type": "error", "turn": turn, "message": f"Narration failed: {e}"})
+                continue
+            speaker = get_next_speaker(speaker, reaction, self.selected_speakers, self.server.override_next_speaker)
+
+    async def close(self):
+        """
+        Cancel the session's background work, such as a running history summary.
+        """
+        await self.history.close()
+
+class NarrationServer:
+    """
+    Hosts many concurrent narration sessions over WebSocket.
+
+    All sessions share one generation provider and one speech provider; the fair scheduler bounds
+    the upstream requests in flight across all sessions.
+
+    Protocol, on /ws (optionally /ws?speakers=herzog,zizek):
+        client -> server: {"type": "frames", "screen": <base64 image>, "cam": <base64 image>}
+        server -> client: {"type": "subtitle", "turn": n, "speaker": ..., "text": ...}
+        server -> client: {"type": "audio", "turn": n, "format": "pcm_s16le", "sample_rate": ..., "channels": 1},
+                          followed by one binary message with the audio
+        server -> client: {"type": "error", "message": ...}, with the "turn" if a turn failed
+    """
+
+    def __init__(self, client: Union["AsyncOpenAI", GenerationProvider], tts_client: SpeechProvider,
+                 selected_speakers: List[Speaker], tts_model_id: str,
+                 max_sessions: int = 32, max_concurrent_requests: int = 8, override_next_speaker: bool = True,
+                 image_options: ImageOptions = None, request_policy: Optional[RequestPolicy] = None,
+                 history_token_budget: int = 1500, history_turns: int = 6, summary_model: str = "gpt-3.5-turbo"):
+        """
+        Args:
+            client (Union[AsyncOpenAI, GenerationProvider]): The generation provider, or the OpenAI API client,
+                shared by all sessions.
+            tts_client (SpeechProvider): The speech provider shared by all sessions, e.g. the pooled ElevenLabs client.
+            selected_speakers (List[Speaker]): The speakers a session uses unless it selects its own.
+            tts_model_id (str): The ID of the TTS model to use.
+            max_sessions (int): The maximum number of concurrent sessions.
+            max_concurrent_requests (int): The maximum number of OpenAI and TTS requests in flight across all sessions.
+            override_next_speaker (bool): Whether a speaker mentioned in a reaction gets the next turn.
+            image_options (ImageOptions): How uploaded frames are resized and encoded.
+            request_policy (Optional[RequestPolicy]): The deadline, retry and hedging policy of the reaction requests.
+            history_token_budget (int): The token budget of each session's history.
+            history_turns (int): The number of most recent turns that are always sent verbatim.
+            summary_model (str): The model that summarizes older turns.
+        """
+        self.client = client
+        self.tts_client = tts_client
+        self.selected_speakers = selected_speakers
+        self.tts_model_id = tts_model_id
+        self.max_sessions = max_sessions
+        self.override_next_speaker = override_next_speaker
+        self.image_options = image_options or ImageOptions()
+        self.request_policy = request_policy or RequestPolicy()
+        self.history_token_budget = history_token_budget
+        self.history_turns = history_turns
+        self.summary_model = summary_model
+        self.scheduler = FairScheduler(max_concurrent_requests)
+        self.sessions: Dict[str, NarrationSession] = {}
+        self._session_ids = itertools.count(1)
+
+    def _speakers(self, request: web.Request) -> List[Speaker]:
+        names = request.query.get("speakers")
+        if not names:
+            return self.selected_speakers
+        speakers = []
+        for name in names.split(","):
+            matches = [speaker for speaker in Speaker if speaker.name.lower() == name.strip().lower()]
+            if not matches:
+                raise web.HTTPBadRequest(text=f"Unknown speaker: {name}")
+            speakers.append(matches[0])
+        return speakers
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        speakers = self._speakers(request)
+        ws = web.WebSocketResponse(max_msg_size=32 * 1024 * 1024)
+        await ws.prepare(request)
+        if len(self.sessions) >= self.max_sessions:
+            await ws.close(code=1013, message=b"Too many sessions")
+            return ws
+
+        session_id = str(next(self._session_ids))
+        session = NarrationSession(session_id, self, ws, speakers)
+        self.sessions[session_id] = session
+        narration = asyncio.create_task(session.run())
+        narration.add_done_callback(lambda task: self._narration_done(session_id, ws, task))
+        print(f"Session {session_id} connected ({len(self.sessions)} active)")
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    event = json.loads(message.data)
+                    if event.get("type") == "frames":
+                        session.upload(base64.b64decode(event["screen"]), base64.b64decode(event["cam"]))
+                    else:
+                        await ws.send_json({"type": "error", "message": f"Unknown event type: {event.get('type')}"})
+                except (ValueError, KeyError) as e:
+                    await ws.send_json({"type": "error", "message": f"Invalid event: {e}"})
+        finally:
+            narration.cancel()
+            await asyncio.gather(narration, return_exceptions=True)
+            await session.close()
+            del self.sessions[session_id]
+            print(f"Session {session_id} disconnected ({len(self.sessions)} active)")
+        return ws
+
+    def _narration_done(self, session_id: str, ws: web.WebSocketResponse, task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        print(f"Session {session_id} failed: {task.exception()!r}")
+        asyncio.create_task(ws.close(code=1011, message=b"Narration failed"))
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_get("/ws", self.handle_ws)
+        return app
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765):
+        """
+        Serve sessions until cancelled.
+        """
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        print(f"Serving narration sessions on ws://{host}:{port}/ws")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
@@ -0,0 +1,293 @@
+import abc
+import sys
+import time
+import atexit
+import pickle
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+from typing import Dict, Optional, Tuple
+
+from .subtitles import srt_timestamp
+
+# Commands sent from the narrator to a subtitle process:
+#   ("style", style_id, style)  registers a style once
+#   ("set", text, style_id)     shows a subtitle in a registered style
+#   ("clear",)                  hides the subtitle
+#   ("quit",)                   ends the subtitle process
+
+class SubtitleChannel:
+    """
+    The sending end of the subtitle IPC.
+
+    Each distinct style is sent once and referenced by its ID afterwards, so a subtitle
+    command carries only its text. Commands that would not change what is displayed, such
+    as a second clear, are not sent at all.
+    """
+
+    def __init__(self, conn: Connection):
+        self._conn = conn
+        self._styles: Dict[Tuple, int] = {}
+        self._state = ("clear",)
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.suppressed = 0
+
+    def _send(self, message: tuple):
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        self._conn.send_bytes(data)
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+
+    def _style_id(self, style: dict) -> int:
+        key = tuple(sorted(style.items()))
+        style_id = self._styles.get(key)
+        if style_id is None:
+            style_id = self._styles[key] = len(self._styles)
+            self._send(("style", style_id, style))
+        return style_id
+
+    def set(self, text: str, style: dict):
+        """
+        Show a subtitle.
+        """
+        command = ("set", text, self._style_id(style))
+        if command == self._state:
+            self.suppressed += 1
+            return
+        self._state = command
+        self._send(command)
+
+    def clear(self):
+        """
+        Hide the subtitle.
+        """
+        if self._state == ("clear",):
+            self.suppressed += 1
+            return
+        self._state = ("clear",)
+        self._send(self._state)
+
+    def quit(self):
+        """
+        Ask the subtitle process to exit.
+        """
+        self._send(("quit",))
+
+class SubtitleRenderer(abc.ABC):
+    """
+    Displays subtitles inside a subtitle process.
+    """
+
+    @abc.abstractmethod
+    def show(self, text: str, style: dict):
+        """
+        Display a subtitle, replacing the current one.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def hide(self):
+        """
+        Hide the current subtitle.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release the renderer's resources when the process ends.
+        """
+
+    def run(self, receiver: "SubtitleReceiver"):
+        """
+        Apply commands until the narrator quits. Renderers with their own main loop override this.
+        """
+        try:
+            receiver.serve(self.show, self.hide)
+        finally:
+            self.close()
+
+class SubtitleReceiver:
+    """
+    The receiving end of the subtitle IPC.
+
+    Blocks on the connection until a command arrives instead of polling it, then waits up to
+    `coalesce_window` seconds for more commands and applies only the state the burst ends in.
+    A set that is replaced right away is never drawn. Clears are not held back: they hide
+    the subtitle before a screenshot, so only the commands already waiting are coalesced.
+    """
+
+    def __init__(self, conn: Connection, coalesce_window: float = 0.01, max_burst: int = 64):
+        self._conn = conn
+        self.coalesce_window = coalesce_window
+        self.max_burst = max_burst
+        self.styles: Dict[int, dict] = {}
+        self.received = 0
+        self.applied = 0
+
+    def _receive(self) -> tuple:
+        try:
+            message = pickle.loads(self._conn.recv_bytes())
+        except EOFError:
+            # The narrator exited without saying goodbye.
+            return ("quit",)
+        self.received += 1
+        return message
+
+    def serve(self, show, hide):
+        """
+        Apply commands until a quit command arrives or the narrator's end of the connection closes.
+
+        Args:
+            show (Callable[[str, dict], None]): Called with the text and style of a new subtitle.
+            hide (Callable[[], None]): Called when the subtitle is hidden.
+        """
+        displayed = ("clear",)
+        while True:
+            wait([self._conn])
+            state = displayed
+            quitting = False
+            for _ in range(self.max_burst):
+                message = self._receive()
+                if message[0] == "style":
+                    self.styles[message[1]] = message[2]
+                elif message[0] == "quit":
+                    quitting = True
+                    break
+                else:
+                    state = message
+                window = 0 if message[0] == "clear" else self.coalesce_window
+                if not self._conn.poll(window):
+                    break
+            if state != displayed:
+                displayed = state
+                self.applied += 1
+                if state[0] == "set":
+                    show(state[1], self.styles[state[2]])
+                else:
+                    hide()
+            if quitting:
+                return
+
+def _run_renderer(renderer_factory, renderer_args: dict, conn: Connection, coalesce_window: float):
+    renderer_factory(**renderer_args).run(SubtitleReceiver(conn, coalesce_window))
+
+class SubtitleProcess:
+    """
+    A subtitle backend that renders in a separate process, fed through a SubtitleChannel.
+
+    Subclasses set `renderer` to a SubtitleRenderer class, which is created in the child
+    process with the keyword arguments passed to `__init__`.
+    """
+
+    renderer = SubtitleRenderer
+
+    def __init__(self, coalesce_window: float = 0.01, **renderer_args):
+        receive_conn, send_conn = multiprocessing.Pipe(duplex=False)
+        self._channel = SubtitleChannel(send_conn)
+        self._process = multiprocessing.Process(target=_run_renderer, daemon=True,
+                                                args=(self.renderer, renderer_args, receive_conn, coalesce_window))
+        self._process.start()
+        receive_conn.close()
+        atexit.register(self.dispose)
+
+    @property
+    def channel(self) -> SubtitleChannel:
+        """
+        The sending end of the IPC, with its message counters.
+        """
+        return self._channel
+
+    def setSubtitle(self, text: str, **style):
+        """
+        Sets the subtitle text and styling.
+        """
+        self._channel.set(text, style)
+
+    def clearSubtitle(self):
+        """
+        Clears the subtitle text.
+        """
+        self._channel.clear()
+
+    def dispose(self):
+        """
+        Ends the subtitle process.
+        """
+        if self._process.is_alive():
+            try:
+                self._channel.quit()
+            except (BrokenPipeError, OSError):
+                pass
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+
+ANSI_COLORS = {"black": 30, "red": 31, "green": 32, "yellow": 33, "blue": 34, "magenta": 35, "cyan": 36, "white": 37}
+
+class TerminalRenderer(SubtitleRenderer):
+    """
+    Draws the subtitle as a colored status line on stderr, or as one line per subtitle if stderr is not a terminal.
+    """
+
+    def __init__(self):
+        self._stream = sys.stderr
+        self._status_line = self._stream.isatty()
+
+    def show(self, text: str, style: dict):
+        color = ANSI_COLORS.get(style.get("text_color", "white"), 37)
+        text = " ".join(text.split())
+        if self._status_line:
+            self._stream.write(f"\r\x1b[2K\x1b[1;{color}m{text}\x1b[0m")
+        else:
+            self._stream.write(f"{text}\n")
+        self._stream.flush()
+
+    def hide(self):
+        if self._status_line:
+            self._stream.write("\r\x1b[2K")
+            self._stream.flush()
+
+class TerminalSubtitles(SubtitleProcess):
+    """
+    Shows subtitles in the terminal. Works everywhere, including over SSH.
+    """
+
+    renderer = TerminalRenderer
+
+class SrtRenderer(SubtitleRenderer):
+    """
+    Writes every subtitle as a cue to an SRT file, timed from the start of the session.
+    """
+
+    def __init__(self, path: str = "subtitles.srt"):
+        self._file = open(path, "w", encoding="utf-8", buffering=1)
+        self._start = time.monotonic()
+        self._cues = 0
+        self._current: Optional[Tuple[float, str]] = None
+
+    def _end_cue(self):
+        if self._current is None:
+            return
+        start, text = self._current
+        self._current = None
+        self._cues += 1
+        end = time.monotonic() - self._start
+        self._file.write(f"{self._cues}\n{srt_timestamp(start)} --> {srt_timestamp(end)}\n{text}\n\n")
+
+    def show(self, text: str, style: dict):
+        self._end_cue()
+        self._current = (time.monotonic() - self._start, text)
+
+    def hide(self):
+        self._end_cue()
+
+    def close(self):
+        self._end_cue()
+        self._file.close()
+
+class SrtSubtitles(SubtitleProcess):
+    """
+    Records the subtitles of a live session to an SRT file.
+    """
+
+    renderer = SrtRenderer
@@ -0,0 +1,72 @@
+import importlib
+from typing import Callable, Dict, List
+
+# Backends are registered as "module:attribute" paths, so a backend's dependencies
+# (e.g. PyObjC for the macOS overlay) are only imported when it is selected.
+SUBTITLE_BACKENDS: Dict[str, str] = {
+    "macos": "narrator.overlay:SubtitleOverlay",
+    "terminal": "narrator.subtitle_ipc:TerminalSubtitles",
+    "srt": "narrator.subtitle_ipc:SrtSubtitles",
+}
+
+DEFAULT_SUBTITLE_BACKEND = "macos"
+
+def register_subtitle_backend(name: str, target: str):
+    """
+    Register a subtitle backend.
+
+    A backend is a class whose instances display subtitles with `setSubtitle(text, **style)`,
+    hide them with `clearSubtitle()` and release their resources with `dispose()`.
+    SubtitleProcess in narrator.subtitle_ipc is the base class of the bundled backends.
+
+    Args:
+        name (str): The name of the backend, as selected with --subtitles-backend.
+        target (str): The import path of the backend class, e.g. "narrator.overlay:SubtitleOverlay".
+    """
+    SUBTITLE_BACKENDS[name] = target
+
+def subtitle_backends() -> List[str]:
+    """
+    Get the names of all registered subtitle backends.
+    """
+    return list(SUBTITLE_BACKENDS)
+
+def load_subtitle_backend(name: str) -> Callable:
+    """
+    Import a subtitle backend.
+
+    Args:
+        name (str): The name of the backend.
+
+    Returns:
+        Callable: The backend class.
+
+    Raises:
+        KeyError: If no backend with this name is registered.
+        ImportError: If the dependencies of the backend are not installed.
+    """
+    module_name, _, attribute = SUBTITLE_BACKENDS[name].partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+def create_subtitle_backend(name: str, **options):
+    """
+    Import a subtitle backend and create an instance of it.
+
+    Args:
+        name (str): The name of the backend.
+        **options: Backend-specific arguments, e.g. the `path` of the srt backend.
+
+    Returns:
+        The subtitle backend.
+    """
+    return load_subtitle_backend(name)(**options)
+
+def srt_timestamp(seconds: float) -> str:
+    """
+    Format a time in seconds as an SRT timestamp, e.g. "00:01:02,500".
+    """
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
@@ -3,20 +3,24 @@ from setuptools import setup, find_packages
 setup(
     name='narrator',
     version='0.1.0',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     install_requires=[
         'openai~=1.16.1',
         'pygame~=2.5.2',
-        'pydub~=0.25.1',
-        'mutagen~=1.47.0',
+        'numpy~=1.26.4',
         'aiohttp~=3.9.3',
+        'httpx~=0.27.0',
         'click~=8.1.7',
         'pillow~=10.3.0',
         'opencv-python~=4.9.0.80',
-        'python-magic~=0.4.27',
         'pydantic~=2.6.4',
         'pydantic-settings~=2.2.1',
     ],
+    extras_require={
+        'batch': ['pydub~=0.25.1'],
+        'macos': ['pyobjc-framework-Cocoa~=10.2', 'pyobjc-framework-Quartz~=10.2'],
+        'local': ['piper-tts~=1.2.0'],
+    },
     entry_points={
         'console_scripts': [
             'narrator = narrator.main:main',